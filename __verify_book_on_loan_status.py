@@ -1,24 +1,11 @@
-import database
+import verifier
 
 
 def main():
-    logs = database.logs
+    violations = [violation for violation in verifier.verify()
+                  if violation['kind'] in verifier.ON_LOAN_KINDS]
 
-    logsBookId = dict[int, list[dict]]()
-    for log in logs:
-        bookId = log['book_id']
-        logsBookId.setdefault(bookId, []).append(log)
-
-    for bookId, bookLogs in logsBookId.items():
-        book = database.search_book_by_id(bookId)
-        isOnLoanMemberID = book.member != '0'
-
-        logsOnLoan = sum(1 for log in bookLogs if database.is_log_on_loan(log))
-
-        if isOnLoanMemberID:
-            assert logsOnLoan == 1, f'{bookId} is out but has {logsOnLoan} on loan'
-        else:
-            assert logsOnLoan == 0, f'{bookId} is not out but has {logsOnLoan} on loan'
+    assert not violations, '\n'.join(map(verifier.describe, violations))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,271 @@
+"""
+This module benchmarks the library at different scales, using synthetic book
+databases and logfiles (see the datagen module), and outputs the timings as
+JSON.
+
+For each scale, a book database and logfile are generated in a temporary
+directory, the database module is pointed at them, and these are timed:
+    generate - generating the files
+    load - reading the book database and logfile
+    save_database/save_logfile - rewriting the book database/logfile in full
+    search_by_param - searching by title, author and genre, with and without
+      ignoring case
+    fuzzy_search - searching fuzzily for titles with a typo
+    checkout_book/return_book - checking out/returning a single book, including
+      updating the files
+    recommend_genres/recommend_titles_for_genre - recommending for members who
+      have checked out books (skipped if matplotlib isn't installed)
+
+Each timing is stored as:
+    'calls': int
+    'total': float - in seconds
+    'mean': float - in seconds per call
+
+Usage: python benchmark.py [--scales N [N ...]] [--events-per-book N]
+                           [--repeat N] [--seed SEED] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from itertools import islice
+from typing import List, Dict, Optional
+
+import bookcheckout
+import bookreturn
+import booksearch
+import database
+import datagen
+
+# the numbers of books to benchmark with by default
+SCALES = (1_000, 10_000, 100_000)
+
+# the database module's file paths, which are pointed at the generated files
+_PATHS = ('DATABASE_FILE', 'LOGFILE', 'JOURNAL_FILE', 'ARCHIVE_DIR',
+          'LOCK_FILE', 'VERSION_FILE')
+
+# the member who checks out books while benchmarking
+_MEMBER = 'bnch'
+
+
+def run(scales=SCALES, events_per_book: int = 10, repeat: int = 20,
+        seed: int = 0) -> dict:
+    """
+    Benchmark the library at each of the given scales.
+
+    :param scales: the numbers of books to benchmark with
+    :param events_per_book: the number of checkouts to generate for each book
+    :param repeat: the number of times to time each operation (except loading
+                   and saving, which are timed once)
+    :param seed: the seed of the random number generator
+    :return: {'python': Python version, 'scales': [{'books': int, 'logs': int,
+             'timings': name -> timing, 'skipped': names of skipped timings}]}
+    """
+    return {
+        'python': platform.python_version(),
+        'scales': [benchmark_scale(n_books, n_books * events_per_book, repeat,
+                                   seed) for n_books in scales],
+    }
+
+
+def benchmark_scale(n_books: int, n_events: int, repeat: int,
+                    seed: int) -> dict:
+    """
+    Benchmark the library with a generated book database and logfile.
+
+    :param n_books: the number of books
+    :param n_events: the number of checkouts to generate
+    :param repeat: the number of times to time each operation
+    :param seed: the seed of the random number generator
+    :return: the results (see run)
+    """
+    timings: Dict[str, dict] = {}
+    paths = {name: getattr(database, name) for name in _PATHS}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _time(timings, 'generate', datagen.generate, tmp, n_books, n_events,
+              seed=seed)
+
+        for name, path in paths.items():
+            setattr(database, name, os.path.join(tmp, os.path.basename(path)))
+
+        try:
+            _time(timings, 'load', database.reload)
+            n_logs = sum(1 for _ in database.iter_logs())
+
+            rng = random.Random(seed)
+            _benchmark_search(timings, rng, repeat)
+            _benchmark_checkout(timings, rng, repeat)
+            skipped = _benchmark_recommend(timings, repeat)
+
+            _time(timings, 'save_database', database.update_database)
+            _time(timings, 'save_logfile', database.compact_logfile)
+        finally:
+            for name, path in paths.items():
+                setattr(database, name, path)
+            database.reload()
+
+    for timing in timings.values():
+        timing['mean'] = timing['total'] / timing['calls']
+
+    return {'books': n_books, 'logs': n_logs, 'timings': timings,
+            'skipped': skipped}
+
+
+def _time(timings: Dict[str, dict], name: str, func, *args, **kwargs):
+    """
+    Call the given function, adding how long it took to the given timing.
+
+    :param timings: name -> timing
+    :param name: the name of the timing
+    :param func: the function to call
+    :param args: the arguments to call it with
+    :param kwargs: the keyword arguments to call it with
+    :return: the result of the function
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    timing = timings.setdefault(name, {'calls': 0, 'total': 0.0})
+    timing['calls'] += 1
+    timing['total'] += elapsed
+
+    return result
+
+
+def _benchmark_search(timings: Dict[str, dict], rng: random.Random,
+                      repeat: int):
+    """
+    Time searching for the title, author and genre of random books, and for
+    the first word of their titles ignoring case, and fuzzily for their titles
+    with a character missing.
+
+    :param timings: name -> timing
+    :param rng: the random number generator to use
+    :param repeat: the number of books to search for
+    """
+    books = list(database.iter_books())
+    for book in rng.sample(books, min(repeat, len(books))):
+        _time(timings, 'search_by_param', booksearch.search_by_param, 'title',
+              book.title)
+        _time(timings, 'search_by_param', booksearch.search_by_param,
+              'title', book.title.split()[0].lower(), ignore_case=True)
+        _time(timings, 'search_by_param', booksearch.search_by_param,
+              'author', book.author)
+        _time(timings, 'search_by_param', booksearch.search_by_param,
+              'genre', book.genre)
+        _time(timings, 'fuzzy_search', booksearch.search_by_param, 'title',
+              book.title[:1] + book.title[2:], fuzzy=True)
+
+
+def _benchmark_checkout(timings: Dict[str, dict], rng: random.Random,
+                        repeat: int):
+    """
+    Time checking out then returning random available books.
+
+    :param timings: name -> timing
+    :param rng: the random number generator to use
+    :param repeat: the number of books to check out and return
+    """
+    available = database.search_books_by_param('member', '0')
+    book_ids = [book.id for book in
+                rng.sample(available, min(repeat, len(available)))]
+
+    for book_id in book_ids:
+        _time(timings, 'checkout_book', bookcheckout.checkout_book, _MEMBER,
+              book_id)
+
+    for book_id in book_ids:
+        _time(timings, 'return_book', bookreturn.return_book, book_id)
+
+
+def _benchmark_recommend(timings: Dict[str, dict], repeat: int) -> List[str]:
+    """
+    Time recommending genres, and titles of their favourite genre, to members
+    who have checked out books.
+
+    :param timings: name -> timing
+    :param repeat: the number of members to recommend for
+    :return: the names of the timings that were skipped
+    """
+    try:
+        # bookrecommend needs matplotlib, which isn't needed for anything else
+        import bookrecommend
+    except ImportError:
+        return ['recommend_genres', 'recommend_titles_for_genre']
+
+    members = list(dict.fromkeys(log['member'] for log in
+                                 islice(database.iter_logs(), repeat * 100)))
+
+    for member_id in members[:repeat]:
+        genres = _time(timings, 'recommend_genres',
+                       bookrecommend.recommend_genres, member_id)
+        _time(timings, 'recommend_titles_for_genre',
+              bookrecommend.recommend_titles_for_genre, genres[0], member_id)
+
+    return []
+
+
+def main(args: Optional[List[str]] = None):
+    """
+    Benchmark the library as given on the command line, and output the results
+    as JSON.
+
+    :param args: the command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the library with '
+                                                 'synthetic data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES,
+                        help='the numbers of books to benchmark with')
+    parser.add_argument('--events-per-book', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='the file to write the results to '
+                                         '(default: stdout)')
+    args = parser.parse_args(args)
+
+    results = run(args.scales, args.events_per_book, args.repeat, args.seed)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    results = run([200], events_per_book=5, repeat=3)
+    scale, = results['scales']
+
+    assert scale['books'] == 200 and scale['logs'] > 0, 'run failed test'
+    assert {'generate', 'load', 'save_database', 'save_logfile',
+            'search_by_param', 'fuzzy_search', 'checkout_book',
+            'return_book'} <= set(scale['timings']), 'run is missing timings'
+    assert scale['timings']['checkout_book']['calls'] == 3, \
+        'checkout_book was not timed for each book'
+    assert set(scale['timings']).isdisjoint(scale['skipped']), \
+        'skipped timings were timed'
+    json.dumps(results)
+
+    # the database module is pointed back at the real files afterwards
+    assert database.DATABASE_FILE == 'database.txt' and \
+           database.book_count() == 90, 'the real database was not restored'
+
+    print('benchmark.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['test']:
+        test()
+    else:
+        main()
@@ -12,10 +12,12 @@ message is shown to the librarian about these books.
 Written by F120840 between 8th November and 16th December 2021.
 """
 
+import os
 from tkinter import *
 from tkinter import ttk
 from tkinter.font import Font
-from typing import List, Tuple, Optional
+from types import SimpleNamespace
+from typing import List, Tuple, Optional, Iterable
 
 import database
 
@@ -155,13 +157,20 @@ def _update_book_tree():
     tree.delete(*tree.get_children())
 
     # we only want to show available books
-    available_books = database.search_books_by_param('member', '0')
-
-    for book in available_books:
+    for book in available_books():
         book_dict = vars(book)
         tree.insert('', index=END, values=tuple(book_dict.values()))
 
 
+def available_books() -> List[SimpleNamespace]:
+    """
+    Return the books that are available to check out.
+
+    :return: the available books
+    """
+    return database.search_books_by_param('member', '0')
+
+
 def _get_selected_book_ids() -> List[int]:
     """
     Get the IDs of the books currently selected in the tree.
@@ -292,6 +301,27 @@ def checkout_book(member_id: str, *book_ids: int) -> Tuple[Optional[str],
     Withdraw given book(s) to a given member, and update the database and
     logfile.
 
+    This is done in a database transaction, so if another desk has changed the
+    database or logfile, the books are checked against the latest data.
+
+    :param member_id: the ID of the member to withdraw book(s) to
+    :param book_ids: the ID(s) of the book(s) the member wants to check out
+    :return: (error message, warning message, success message)
+    """
+    database.begin_transaction()
+    try:
+        return _checkout_book(member_id, *book_ids)
+    finally:
+        database.end_transaction()
+
+
+def _checkout_book(member_id: str, *book_ids: int) -> Tuple[Optional[str],
+                                                            Optional[str],
+                                                            Optional[str]]:
+    """
+    Withdraw given book(s) to a given member, and update the database and
+    logfile, assuming a database transaction has been started.
+
     :param member_id: the ID of the member to withdraw book(s) to
     :param book_ids: the ID(s) of the book(s) the member wants to check out
     :return: (error message, warning message, success message)
@@ -314,29 +344,106 @@ def checkout_book(member_id: str, *book_ids: int) -> Tuple[Optional[str],
         if (member := book.member) != '0':
             return error(f'Book {book_id} is already on loan, to: {member}')
 
-        book.member = member_id
-        database.logs.append(database.new_log(book_id, member_id))
+        database.set_book_member(book, member_id)
+        database.add_log(book_id, member_id)
 
         withdrawn.append(str(book_id))
 
-    # get the IDs of the books the member has had on loan for more than 60 days
-    logs = database.logs_for_member_id(member_id)
-    held_book_ids = sorted(log['book_id'] for log in logs
-                           if database.is_log_on_loan(log) and
-                           database.is_more_than_60_days_ago(log['checkout'])
-                           )
+    return None, _warning(member_id), _success(withdrawn)
 
-    warning_msg = None
 
-    if held_book_ids:
-        if len(held_book_ids) == 1:
-            warning_msg = f'Book {held_book_ids[0]} is being held for more ' \
-                          'than 60 days'
-        else:
-            warning_msg = f"Books {','.join(map(str, held_book_ids))} are " \
-                          "being held for more than 60 days"
+def checkout_books(member_id: str, book_ids: Iterable[int]) -> \
+        Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Withdraw all the given books to a given member, or none of them, e.g. to
+    check out a set of copies for a class.
+
+    Unlike checkout_book, every book is checked before any are withdrawn, so if
+    any of them can't be withdrawn, nothing is changed. The logfile and then
+    the database are then updated once each, for all the books.
+
+    The two files are written separately, so this is only all-or-nothing for
+    each file, not for both: if the database can't be written after the logs
+    have been (e.g. the disk is full), the logs record loans that the database
+    doesn't. The books and logs in memory are then reloaded from the files, so
+    they match what was written, and the verifier module reports the books
+    affected as a MEMBER_MISMATCH.
+
+    :param member_id: the ID of the member to withdraw the books to
+    :param book_ids: the IDs of the books the member wants to check out
+    :return: (error message, warning message, success message)
+    """
+    database.begin_transaction()
+    try:
+        return _checkout_books(member_id, list(book_ids))
+    except BaseException:
+        # don't keep changes that couldn't be written, so the books in memory
+        # match the files (even if only the logfile was written)
+        database.reload()
+        raise
+    finally:
+        database.end_transaction()
+
+
+def _checkout_books(member_id: str, book_ids: List[int]) -> \
+        Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Withdraw all the given books to a given member, or none of them, assuming a
+    database transaction has been started.
 
-    return None, warning_msg, _success(withdrawn)
+    :param member_id: the ID of the member to withdraw the books to
+    :param book_ids: the IDs of the books the member wants to check out
+    :return: (error message, warning message, success message)
+    """
+    if len(member_id) != 4:
+        return f"Error: Invalid member ID: '{member_id}'", None, None
+
+    if not book_ids:
+        return 'No books to checkout', None, None
+
+    if len(set(book_ids)) != len(book_ids):
+        return 'Duplicate book IDs entered', None, None
+
+    books = []
+    for book_id in book_ids:
+        book = database.search_book_by_id(book_id)
+
+        if book is None:
+            return f'No book with ID: {book_id}', None, None
+
+        if (member := book.member) != '0':
+            return f'Book {book_id} is already on loan, to: {member}', None, \
+                   None
+
+        books.append(book)
+
+    for book in books:
+        database.set_book_member(book, member_id)
+        database.add_log(book.id, member_id)
+
+    return None, _warning(member_id), _success(list(map(str, book_ids)))
+
+
+def _warning(member_id: str) -> Optional[str]:
+    """
+    Generate the warning message for checkout_book: the books the given member
+    has had on loan for more than 60 days.
+
+    :param member_id: the ID of the member withdrawing books
+    :return: 'warning message' of checkout_book
+    """
+    # get the IDs of the books the member has had on loan for more than 60 days
+    logs = database.overdue_logs_for_member_id(member_id)
+    held_book_ids = sorted(log['book_id'] for log in logs)
+
+    if not held_book_ids:
+        return None
+
+    if len(held_book_ids) == 1:
+        return f'Book {held_book_ids[0]} is being held for more than 60 days'
+    else:
+        return f"Books {','.join(map(str, held_book_ids))} are being held " \
+               "for more than 60 days"
 
 
 def _success(withdrawn: List[str]) -> Optional[str]:
@@ -382,6 +489,29 @@ def test():
     assert _success(['1']) == 'Book 1 withdrawn', \
         '_success failed for non-empty list'
 
+    # nothing is withdrawn if any of the books can't be
+    assert checkout_books('bulk', [18, 22, 5]) == \
+           ('Book 5 is already on loan, to: coaa', None, None), \
+        'checkout_books failed for a book on loan'
+    assert database.search_book_by_id(18).member == '0', \
+        'checkout_books withdrew books after an error'
+    assert checkout_books('bulk', [18, 22, 18])[0] == \
+           'Duplicate book IDs entered', 'checkout_books accepted duplicates'
+    assert checkout_books('bulk', [18, 22]) == \
+           (None, None, 'Books 18,22 withdrawn'), 'checkout_books failed test'
+    assert database.search_book_by_id(22).member == 'bulk', \
+        'checkout_books failed test'
+
+    # the books are reloaded from the files if they can't be written
+    database.update_database = lambda: open(os.curdir, 'w')
+    try:
+        checkout_books('bulk', [25])
+        assert False, 'checkout_books hid an error writing the database'
+    except OSError:
+        pass
+    assert database.search_book_by_id(25).member == '0', \
+        'checkout_books kept books that could not be written'
+
     print('bookcheckout.py has passed all tests!')
 
     database.update_database, database.update_logfile = temp
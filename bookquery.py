@@ -0,0 +1,403 @@
+"""
+This module provides a query language for searching for books by several
+attributes at once, e.g.:
+    genre:Action author:"Stan Lee" member:=0 purchased:<2010
+
+A query is made up of terms, separated by whitespace, which books must all
+match. Each term is written as [attribute:][operator]value, where:
+    attribute - one of database.BOOK_HEADERS, or 'purchased' for purchase_date.
+                Terms without an attribute search titles.
+    value - in double quotes if it contains whitespace
+    operator - how the attribute is compared to the value:
+        none - the attribute contains the value, as with
+               booksearch.search_by_param
+        = - the attribute is the value exactly
+        <, <=, >, >= - (id and purchase_date only) the attribute is before or
+                       after the value
+A range can also be given as low..high (id and purchase_date only), which is
+inclusive. IDs are matched exactly, rather than by containing the value.
+Purchase dates can be given as DD/MM/YYYY, MM/YYYY or YYYY, for a day, month
+or year: purchased:2010 matches books purchased in 2010, purchased:<2010 books
+purchased before it, and purchased:2010..2012 books purchased from 2010 to
+2012.
+
+A query is parsed into terms once (see parse_query), then planned (see
+plan_query): the number of books that match each term is estimated from the
+database's indexes, and the terms are run from the fewest books to the most.
+The first term's books are found through the indexes (with
+booksearch.search_by_param for terms without an operator). Each later term's
+books are found too and intersected with the books so far, unless the books so
+far are fewer than its estimate, in which case they are checked against it
+instead.
+
+Terms are represented by dicts:
+    'param': str - the attribute
+    'kind': str - 'contains', 'equals' or 'range'
+    'value': str/int - what the attribute contains or equals
+    'low'/'high': int/None - the inclusive bounds of a range, as IDs or day
+                             ordinals, or None if the range is unbounded
+  and once planned:
+    'estimate': int - the estimated number of books that match the term
+"""
+
+import re
+from datetime import date
+from types import SimpleNamespace
+from typing import List, Tuple, Optional
+
+import booksearch
+import database
+import datecodec
+
+# the fraction of books estimated to be in a range that can't be estimated
+# from the indexes
+RANGE_SELECTIVITY = 1 / 3
+
+# attributes that can be compared and given as ranges
+RANGE_PARAMS = ('id', 'purchase_date')
+
+# other names for attributes
+_ALIASES = {'purchased': 'purchase_date'}
+
+_TERM = re.compile(r'(?:(?P<attr>\w+):)?(?P<op><=|>=|<|>|=)?'
+                   r'(?:"(?P<quoted>[^"]*)"|(?P<word>[^\s"]+))')
+
+
+def search_by_query(query: str, ignore_case=False) -> List[SimpleNamespace]:
+    """
+    Search for books that match every term of the given query, so every book
+    matches a query without any terms.
+
+    :param query: the query
+    :param ignore_case: whether to ignore casing or not, in terms without an
+                        operator
+    :return: list of books that match the query, in ID order
+    :raises ValueError: if the query is invalid
+    """
+    terms = plan_query(parse_query(query), ignore_case)
+    if not terms:
+        return sorted(database.iter_books(), key=lambda book: book.id)
+
+    results = _term_books(terms[0], ignore_case)
+
+    for term in terms[1:]:
+        if not results:
+            break
+
+        if term['estimate'] <= len(results):
+            book_ids = {book.id for book in _term_books(term, ignore_case)}
+            results = [book for book in results if book.id in book_ids]
+        else:
+            results = [book for book in results
+                       if _term_matches(term, book, ignore_case)]
+
+    return sorted(results, key=lambda book: book.id)
+
+
+def parse_query(query: str) -> List[dict]:
+    """
+    Parse a query into its terms.
+
+    :param query: the query
+    :return: the terms
+    :raises ValueError: if the query is invalid
+    """
+    terms = []
+
+    pos = 0
+    while (pos := _skip_whitespace(query, pos)) < len(query):
+        match = _TERM.match(query, pos)
+        if match is None or (match.end() < len(query) and
+                             not query[match.end()].isspace()):
+            raise ValueError(f'Invalid query at: {query[pos:]}')
+
+        attr, op, quoted, word = match.group('attr', 'op', 'quoted', 'word')
+        value = quoted if quoted is not None else word
+        if attr is None and ':' in value:
+            raise ValueError(f'Invalid term (put values with : in quotes): '
+                             f'{match.group()}')
+
+        terms.append(_parse_term(attr or 'title', op, value, quoted is None))
+        pos = match.end()
+
+    return terms
+
+
+def _skip_whitespace(s: str, pos: int) -> int:
+    """
+    Return the position of the first character at or after the given position
+    that isn't whitespace.
+
+    :param s: the string
+    :param pos: the position
+    :return: the position of the next character that isn't whitespace, or the
+             length of the string if there isn't one
+    """
+    while pos < len(s) and s[pos].isspace():
+        pos += 1
+
+    return pos
+
+
+def _parse_term(attr: str, op: Optional[str], value: str,
+                may_be_range: bool) -> dict:
+    """
+    Return the term for an attribute, operator and value of a query.
+
+    :param attr: the attribute, or one of its other names
+    :param op: the operator, or None
+    :param value: the value
+    :param may_be_range: whether the value may be a low..high range, i.e. it
+                         isn't in quotes
+    :return: the term
+    :raises ValueError: if the term is invalid
+    """
+    param = _ALIASES.get(attr, attr)
+    if param not in database.BOOK_HEADERS:
+        raise ValueError(f'Unknown attribute: {attr}')
+
+    if param not in RANGE_PARAMS:
+        if op not in (None, '='):
+            raise ValueError(f'Only {", ".join(RANGE_PARAMS)} can be '
+                             f'compared with {op}')
+
+        return {'param': param, 'kind': 'contains' if op is None else 'equals',
+                'value': value}
+
+    if may_be_range and op is None and '..' in value:
+        low, high = value.split('..', 1)
+        return {'param': param, 'kind': 'range',
+                'low': _parse_bounds(param, low)[0] if low else None,
+                'high': _parse_bounds(param, high)[1] if high else None}
+
+    first, last = _parse_bounds(param, value)
+
+    if param == 'id' and op in (None, '='):
+        return {'param': param, 'kind': 'equals', 'value': first}
+
+    low, high = {
+        None: (first, last),
+        '=': (first, last),
+        '<': (None, first - 1),
+        '<=': (None, last),
+        '>': (last + 1, None),
+        '>=': (first, None),
+    }[op]
+
+    return {'param': param, 'kind': 'range', 'low': low, 'high': high}
+
+
+def _parse_bounds(param: str, value: str) -> Tuple[int, int]:
+    """
+    Return the first and last ID or day a value of a range parameter covers.
+
+    :param param: 'id' or 'purchase_date'
+    :param value: an ID, or a date in the DD/MM/YYYY, MM/YYYY or YYYY format
+    :return: (first, last) ID or day ordinal
+    :raises ValueError: if the value is invalid
+    """
+    parts = value.split('/')
+    if not all(part.isdigit() for part in parts) or \
+            len(parts) > (1 if param == 'id' else 3):
+        raise ValueError(f'Invalid {param}: {value}')
+
+    if param == 'id':
+        return int(value), int(value)
+
+    if len(parts) == 3:
+        day = datecodec.parse_day(value)
+        return day, day
+
+    year = int(parts[-1])
+    if len(parts) == 2:
+        month = int(parts[0])
+        first = date(year, month, 1)
+        last = date(year + month // 12, month % 12 + 1, 1)
+    else:
+        first = date(year, 1, 1)
+        last = date(year + 1, 1, 1)
+
+    return first.toordinal(), last.toordinal() - 1
+
+
+def plan_query(terms: List[dict], ignore_case=False) -> List[dict]:
+    """
+    Estimate the number of books that match each term, and order the terms
+    from the fewest books to the most.
+
+    Terms for exact values are counted with the indexes. Terms without an
+    operator are estimated from the number of values with the rarest trigram
+    of the query, and the average number of books per value. Ranges of IDs
+    are as long as they are; other ranges are estimated as a fixed fraction
+    of the books (RANGE_SELECTIVITY).
+
+    :param terms: the terms (see parse_query)
+    :param ignore_case: whether to ignore casing or not, in terms without an
+                        operator
+    :return: the terms, with their 'estimate', in the order to run them
+    """
+    return sorted(({**term, 'estimate': _estimate(term, ignore_case)}
+                   for term in terms), key=lambda term: term['estimate'])
+
+
+def _estimate(term: dict, ignore_case: bool) -> int:
+    """
+    Estimate the number of books that match a term (see plan_query).
+
+    :param term: the term
+    :param ignore_case: whether to ignore casing or not
+    :return: the estimated number of books
+    """
+    n_books = database.book_count()
+    param = term['param']
+
+    if term['kind'] == 'equals':
+        return database.count_books_by_param(param, term['value'])
+
+    if term['kind'] == 'contains':
+        values = database.estimate_values_containing(param, term['value'],
+                                                     ignore_case)
+        # rounded up, so a term that may match any books isn't estimated as 0
+        return -(-values * n_books // max(1, database.count_values(param)))
+
+    if param == 'id' and term['low'] is not None and term['high'] is not None:
+        return max(0, min(n_books, term['high'] - term['low'] + 1))
+
+    return int(n_books * RANGE_SELECTIVITY)
+
+
+def _term_books(term: dict, ignore_case: bool) -> List[SimpleNamespace]:
+    """
+    Return the books that match a term, using the indexes where possible.
+
+    :param term: the term
+    :param ignore_case: whether to ignore casing or not
+    :return: the books that match the term
+    """
+    param = term['param']
+
+    if term['kind'] == 'contains':
+        return booksearch.search_by_param(param, term['value'], ignore_case)
+
+    if term['kind'] == 'equals':
+        return database.search_books_by_param(param, term['value'])
+
+    if param == 'id' and None not in (term['low'], term['high']) and \
+            term['high'] - term['low'] < database.book_count():
+        return [book for book_id in range(term['low'], term['high'] + 1)
+                if (book := database.search_book_by_id(book_id)) is not None]
+
+    if param == 'purchase_date':
+        # each distinct purchase date is only parsed and checked once
+        return [book for value, matches in
+                database.books_grouped_by_param(param)
+                if _in_range(term, datecodec.parse_day(value))
+                for book in matches]
+
+    return [book for book in database.iter_books()
+            if _term_matches(term, book, ignore_case)]
+
+
+def _term_matches(term: dict, book: SimpleNamespace,
+                  ignore_case: bool) -> bool:
+    """
+    Check whether a book matches a term.
+
+    :param term: the term
+    :param book: the book
+    :param ignore_case: whether to ignore casing or not
+    :return: whether the book matches the term
+    """
+    value = getattr(book, term['param'])
+
+    if term['kind'] == 'contains':
+        if ignore_case:
+            return term['value'].casefold() in str(value).casefold()
+        return term['value'] in str(value)
+
+    if term['kind'] == 'equals':
+        return value == term['value']
+
+    if term['param'] == 'purchase_date':
+        value = datecodec.parse_day(value)
+
+    return _in_range(term, value)
+
+
+def _in_range(term: dict, key: int) -> bool:
+    """
+    Check whether an ID or day ordinal is within the range of a term.
+
+    :param term: the range term
+    :param key: the ID or day ordinal
+    :return: whether it's within the range
+    """
+    return (term['low'] is None or term['low'] <= key) and \
+           (term['high'] is None or key <= term['high'])
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    assert parse_query('genre:Action author:"Stan Lee" member:=0 '
+                       'purchased:<2010') == [
+        {'param': 'genre', 'kind': 'contains', 'value': 'Action'},
+        {'param': 'author', 'kind': 'contains', 'value': 'Stan Lee'},
+        {'param': 'member', 'kind': 'equals', 'value': '0'},
+        {'param': 'purchase_date', 'kind': 'range', 'low': None,
+         'high': date(2010, 1, 1).toordinal() - 1},
+    ], 'parse_query failed test'
+
+    assert parse_query('  "Sinful Duty"  id:5..9 purchased:12/2010') == [
+        {'param': 'title', 'kind': 'contains', 'value': 'Sinful Duty'},
+        {'param': 'id', 'kind': 'range', 'low': 5, 'high': 9},
+        {'param': 'purchase_date', 'kind': 'range',
+         'low': date(2010, 12, 1).toordinal(),
+         'high': date(2010, 12, 31).toordinal()},
+    ], 'parse_query failed for titles, ID ranges and months'
+
+    assert parse_query('id:7 id:>=80 purchased:>1/2/2003') == [
+        {'param': 'id', 'kind': 'equals', 'value': 7},
+        {'param': 'id', 'kind': 'range', 'low': 80, 'high': None},
+        {'param': 'purchase_date', 'kind': 'range',
+         'low': date(2003, 2, 2).toordinal(), 'high': None},
+    ], 'parse_query failed for comparisons'
+
+    for query in ('shelf:3', 'title:<A', 'id:x', 'purchased:13/2010',
+                  'author:"Stan', 'Avengers:'):
+        try:
+            parse_query(query)
+            assert False, f"parse_query accepted '{query}'"
+        except ValueError:
+            pass
+
+    # search_by_query agrees with checking every book against every term
+    for query in ('genre:Action author:"Stan Lee" member:=0 purchased:<2010',
+                  'Avengers purchased:2003', 'id:10..40 genre:=Crime',
+                  'member:=0 id:<20', 'purchased:>=01/01/2015 title:a',
+                  'genre:Action genre:Crime', ''):
+        terms = parse_query(query)
+        expected = [book for book in database.iter_books()
+                    if all(_term_matches(term, book, True) for term in terms)]
+        assert search_by_query(query, ignore_case=True) == expected, \
+            f"search_by_query failed for '{query}'"
+
+    assert [book.id for book in search_by_query('genre:Action author:"Stan '
+                                                'Lee" member:=0')] == [2, 3], \
+        'search_by_query failed test'
+
+    # the term with the fewest books is run first
+    plan = plan_query(parse_query('member:=0 purchased:2003 id:1..3 '
+                                  'title:Avengers'))
+    assert [term['param'] for term in plan][:2] == ['id', 'title'] and \
+           plan[-1]['param'] == 'member', 'plan_query failed test'
+    assert all(term['estimate'] >= len(_term_books(term, False))
+               for term in plan if term['kind'] != 'range' or
+               term['param'] == 'id'), 'plan_query underestimated a term'
+
+    print('bookquery.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    test()
@@ -375,7 +375,7 @@ def _book_id_popularity(book_id: int) -> int:
     :param book_id: the ID of the book to check
     :return: the popularity of the book
     """
-    return sum(1 for log in database.logs if log['book_id'] == book_id)
+    return database.log_count_for_book_id(book_id)
 
 
 def _titles_member_has_read(member_id: str) -> Set[str]:
@@ -15,9 +15,9 @@ librarian is warned.
 Written by F120840 between 8th November and 16th December 2021.
 """
 
-from datetime import datetime
 from tkinter import *
 from tkinter import ttk
+from types import SimpleNamespace
 from typing import List, Tuple, Optional
 
 import database
@@ -228,7 +228,7 @@ def _books_on_loan_for_member(*_):
 
     member = member_entry.get()
 
-    books_on_loan = database.search_books_by_param('member', member)
+    books_on_loan = books_on_loan_to(member)
     for book in books_on_loan:
         book_dict = vars(book)
         tree.insert('', index=END, values=tuple(book_dict.values()))
@@ -237,6 +237,16 @@ def _books_on_loan_for_member(*_):
         tree_frame.place(x=30, y=100)
 
 
+def books_on_loan_to(member_id: str) -> List[SimpleNamespace]:
+    """
+    Return the books that a given member currently has on loan.
+
+    :param member_id: the ID of the member
+    :return: the member's books
+    """
+    return database.search_books_by_param('member', member_id)
+
+
 def _get_selected_book_ids() -> List[int]:
     """
     Return the IDs of the books currently selected in the tree.
@@ -315,6 +325,25 @@ def return_book(*book_ids: int) -> Tuple[Optional[str], Optional[str],
     """
     Try to return given books, update the database and logfile if successful.
 
+    This is done in a database transaction, so if another desk has changed the
+    database or logfile, the books are checked against the latest data.
+
+    :param book_ids: the id(s) of the book(s) to return
+    :return: (error message, warning message, success message)
+    """
+    database.begin_transaction()
+    try:
+        return _return_book(*book_ids)
+    finally:
+        database.end_transaction()
+
+
+def _return_book(*book_ids: int) -> Tuple[Optional[str], Optional[str],
+                                          Optional[str]]:
+    """
+    Try to return given books, update the database and logfile if successful,
+    assuming a database transaction has been started.
+
     :param book_ids: the id(s) of the book(s) to return
     :return: (error message, warning message, success message)
     """
@@ -323,29 +352,43 @@ def return_book(*book_ids: int) -> Tuple[Optional[str], Optional[str],
     overdue: List[str] = []
 
     for book_id in book_ids:
-        book = database.search_book_by_id(book_id)
+        error = _return_one(book_id, returned, overdue)
+
+        if error is not None:
+            return error, _warning(overdue), _success(returned)
+
+    return None, _warning(overdue), _success(returned)
 
-        if book is None:
-            return (f'No book with ID: {book_id}', _warning(overdue),
-                    _success(returned))
 
-        if book.member == '0':
-            return (f'Book {book_id} already returned', _warning(overdue),
-                    _success(returned))
+def _return_one(book_id: int, returned: List[str],
+                overdue: List[str]) -> Optional[str]:
+    """
+    Return the book with the given ID in memory, without updating the database
+    and logfile, and add its ID to returned (and overdue, if it is overdue).
 
-        book.member = '0'
+    :param book_id: the ID of the book to return
+    :param returned: the IDs of the books that have been returned
+    :param overdue: the IDs of the returned books that were returned after 60
+                    days
+    :return: the error message if the book couldn't be returned, else None
+    """
+    book = database.search_book_by_id(book_id)
 
-        # the log that was the checkout of this book is the most recent one
-        most_recent_log = database.most_recent_log_for_book_id(book.id)
+    if book is None:
+        return f'No book with ID: {book_id}'
 
-        # update the log, indicating the book has been returned
-        most_recent_log['return'] = datetime.now()
+    if book.member == '0':
+        return f'Book {book_id} already returned'
 
-        returned.append(str(book_id))
-        if database.is_more_than_60_days_ago(most_recent_log['checkout']):
-            overdue.append(str(book_id))
+    database.set_book_member(book, '0')
 
-    return None, _warning(overdue), _success(returned)
+    # update the log that was the checkout of this book (the most recent one),
+    # indicating the book has been returned
+    most_recent_log = database.stamp_return(book.id)
+
+    returned.append(str(book_id))
+    if database.is_more_than_60_days_ago(most_recent_log['checkout']):
+        overdue.append(str(book_id))
 
 
 def _success(returned: List[str]) -> Optional[str]:
@@ -11,15 +11,29 @@ A book can be searched for according to:
   - ID of the member that currently has the book
 
 The default search behaviour is case-insensitive, though case-sensitive
-searching is an available option.
+searching is an available option. Titles and authors can also be searched for
+fuzzily, which tolerates typos in the query and ranks the closest matches first.
+
+Choosing 'query' instead of an attribute searches by several attributes at once,
+with the query language of the bookquery module.
+
+The IDs of the books found by recent searches are cached, and reused until the
+books' values of the searched attribute change (see database.catalog_version).
+The books are read again on each cache hit, so their other attributes (e.g.
+their member) are always up to date. The cache is bounded: once it is full,
+the least recently used search is evicted. Its statistics are kept as:
+    'hits': int
+    'misses': int
+    'evictions': int
 
 Written by F120840 between 8th November and 16th December 2021.
 """
 
+from collections import OrderedDict
 from tkinter import *
 from tkinter import ttk
 from types import SimpleNamespace
-from typing import List, Iterable
+from typing import List, Iterable, Dict, Set
 
 import database
 from database import str_to_date
@@ -30,10 +44,34 @@ attr: StringVar
 query_entry: Entry
 query: StringVar
 exact_case: IntVar
+fuzzy: IntVar
 
 results_wrapper: Frame
 tree: ttk.Treeview
 
+error_frame: LabelFrame
+
+# the attribute that searches with the query language (see the bookquery module)
+QUERY_ATTR = 'query'
+
+# how long to wait after the query changes before searching, in milliseconds,
+# so a burst of keystrokes only leads to one search
+SEARCH_DELAY = 150
+
+# the Tk 'after' ID of the search waiting to be run, if there is one
+_pending_search = None
+# (attr, query, ignore_case, results) of the last search, with the query
+# casefolded if ignoring case
+_last_search = None
+
+# the maximum number of searches whose results are cached
+CACHE_SIZE = 256
+
+# (attr, query, ignore_case, fuzzy) -> (catalog version of attr, IDs of the
+# books found), with the query casefolded if ignoring case
+_cache: OrderedDict = OrderedDict()
+_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0}
+
 
 def get_frame(parent, bg, fg) -> LabelFrame:
     """
@@ -49,7 +87,9 @@ def get_frame(parent, bg, fg) -> LabelFrame:
     global query_entry
     global query
     global exact_case
+    global fuzzy
     global results_wrapper
+    global error_frame
 
     frame = LabelFrame(parent, text='Book Search', padx=5, pady=5, bg=bg, fg=fg)
 
@@ -62,8 +102,9 @@ def get_frame(parent, bg, fg) -> LabelFrame:
     attr.set('title')  # default: search by title
     # search when attr is modified
     attr.trace_add('write', _search)
-    ttk.Combobox(input_frame, state='readonly', values=database.BOOK_HEADERS,
-                 width=13, textvariable=attr).grid(row=0, column=0, padx=5)
+    ttk.Combobox(input_frame, state='readonly',
+                 values=database.BOOK_HEADERS + (QUERY_ATTR,), width=13,
+                 textvariable=attr).grid(row=0, column=0, padx=5)
 
     query = StringVar()
     # search when query is modified
@@ -73,16 +114,30 @@ def get_frame(parent, bg, fg) -> LabelFrame:
     query_entry.focus_set()
     query_entry.grid(row=0, column=1, padx=5)
 
+    # embed a frame for the search options so they can be side-by-side
+    options_frame = Frame(frame, bg=bg)
+    options_frame.pack(pady=5)
+
     exact_case = IntVar()
     # search when exact_case is modified
     exact_case.trace_add('write', _search)
-    Checkbutton(frame, text='Case Sensitive', bg=fg, fg=bg,
+    Checkbutton(options_frame, text='Case Sensitive', bg=fg, fg=bg,
+                activebackground=fg, activeforeground=bg,
+                variable=exact_case).grid(row=0, column=0, padx=5)
+
+    fuzzy = IntVar()
+    # search when fuzzy is modified
+    fuzzy.trace_add('write', _search)
+    Checkbutton(options_frame, text='Fuzzy', bg=fg, fg=bg,
                 activebackground=fg, activeforeground=bg,
-                variable=exact_case).pack(pady=5)
+                variable=fuzzy).grid(row=0, column=1, padx=5)
 
     Button(frame, text='Show All Books', command=_show_all_books, bg=fg, fg=bg) \
         .pack(pady=5)
 
+    error_frame = LabelFrame(frame, text='Error', padx=1, bg='red')
+    Label(error_frame, bg=bg, fg=fg, wraplength=300).pack()
+
     _create_results_view()
 
     return frame
@@ -90,8 +145,10 @@ def get_frame(parent, bg, fg) -> LabelFrame:
 
 def on_show():
     """
-    Set focus on the query entry when this module is shown.
+    Set focus on the query entry when this module is shown, and forget the last
+    search as books may have changed since.
     """
+    reset_search()
     query_entry.focus_set()
 
 
@@ -157,33 +214,96 @@ def _sort_tree_column(column, reverse):
 
 def _search(*_):
     """
-    Perform a book search then display the results on screen.
+    Schedule a book search for once the query has stopped changing for
+    SEARCH_DELAY milliseconds, cancelling the search that was waiting to be
+    run, if any.
 
     :param _: unused varargs to allow this to be used as any callback
     """
+    global _pending_search
+
+    if _pending_search is not None:
+        frame.after_cancel(_pending_search)
+
+    _pending_search = frame.after(SEARCH_DELAY, _run_search)
+
+
+def _run_search():
+    """
+    Perform a book search then display the results on screen.
+    """
+    global _pending_search
+
+    _pending_search = None
+
     hide_results()
+    _hide_error()
     _clear_results()
 
     query_ = query.get().strip()
     if not query_:
         return
 
-    results: List[SimpleNamespace] = search_by_param(attr.get(),
-                                                     query_,
-                                                     not exact_case.get())
-
-    _show_books(results)
+    try:
+        if attr.get() == QUERY_ATTR:
+            results = _query_search(query_)
+        else:
+            results: List[SimpleNamespace] = refine_search(attr.get(),
+                                                           query_,
+                                                           not exact_case.get(),
+                                                           bool(fuzzy.get()))
+
+        _show_books(results)
+    except (RuntimeError, OSError) as e:
+        # libraryclient raises these if the library server can't search
+        _show_error(f'Search failed: {e}')
+        return
 
     if results:
         display_results()
 
 
+def _query_search(query_: str) -> List[SimpleNamespace]:
+    """
+    Search for books with the query language of the bookquery module. Fuzzy
+    searching doesn't apply to queries.
+
+    :param query_: the query
+    :return: list of books that match the query, or no books if the query is
+             invalid (e.g. it is still being typed)
+    """
+    # bookquery builds on this module, so it is imported when first used
+    import bookquery
+
+    try:
+        return bookquery.search_by_query(query_, not exact_case.get())
+    except (ValueError, RuntimeError):
+        # libraryclient raises RuntimeError for the server's errors
+        return []
+
+
 def _show_all_books():
     """
-    Show all books in the database on screen.
+    Show all books in the database on screen, cancelling the search that was
+    waiting to be run, if any, so it doesn't replace them.
     """
+    global _pending_search
+
+    if _pending_search is not None:
+        frame.after_cancel(_pending_search)
+        _pending_search = None
+
+    _hide_error()
     _clear_results()
-    _show_books(database.books)
+
+    try:
+        _show_books(all_books())
+    except (RuntimeError, OSError) as e:
+        # libraryclient raises these if the library server can't list books
+        hide_results()
+        _show_error(f'Could not show all books: {e}')
+        return
+
     display_results()
 
 
@@ -193,8 +313,10 @@ def _show_books(books: Iterable[SimpleNamespace]):
 
     :param books: the books to show in the tree
     """
+    overdue_ids = overdue_book_ids()
+
     for book in books:
-        tags = ('highlight',) if _should_highlight(book) else ()
+        tags = ('highlight',) if _should_highlight(book, overdue_ids) else ()
 
         book_dict = {
             **vars(book),
@@ -205,6 +327,43 @@ def _show_books(books: Iterable[SimpleNamespace]):
         tree.insert('', index=END, values=tuple(book_dict.values()), tags=tags)
 
 
+def _show_error(msg):
+    """
+    Show the given error message on screen.
+
+    :param msg: the error message
+    """
+    label = error_frame.pack_slaves()[0]
+    label.configure(text=msg)
+
+    error_frame.pack(pady=5)
+
+
+def _hide_error():
+    """
+    Hide the error message.
+    """
+    error_frame.pack_forget()
+
+
+def all_books() -> Iterable[SimpleNamespace]:
+    """
+    Return all books in the database.
+
+    :return: all books, in the order they are in the book database
+    """
+    return database.iter_books()
+
+
+def overdue_book_ids() -> Set[int]:
+    """
+    Return the IDs of the books that have been on loan for more than 60 days.
+
+    :return: the IDs of the overdue books, which shouldn't be modified
+    """
+    return database.overdue_book_ids()
+
+
 def display_results():
     """
     Display search results on screen.
@@ -226,7 +385,8 @@ def _clear_results():
     tree.delete(*tree.get_children())
 
 
-def search_by_param(attr, query, ignore_case=False) -> List[SimpleNamespace]:
+def search_by_param(attr, query, ignore_case=False,
+                    fuzzy=False) -> List[SimpleNamespace]:
     """
     Search for books whose attribute 'attr' match the given query.
 
@@ -234,24 +394,161 @@ def search_by_param(attr, query, ignore_case=False) -> List[SimpleNamespace]:
       If ignore_case is True, the casing of the attribute and query are both
       ignored (the search becomes case-insensitive).
 
-    The attribute matches the query if it contains the query.
+    The attribute matches the query if it contains the query or, if fuzzy is
+    True, if each word of the query nearly starts one of its words, give or
+    take a few typos (see database.values_like). Fuzzy results are ranked by
+    how many typos they have.
+
+    The distinct values of the attribute that contain the query are found using
+    the database's trigram indexes, then the books with those values are
+    returned in ID order. The IDs of the books found are cached until the
+    attribute's catalog version changes.
+
+    :param attr: the attribute of the book to search for
+    :param query: the value to check the book attribute against
+    :param ignore_case: whether to ignore casing or not
+    :param fuzzy: whether to tolerate typos or not
+    :return: list of books that match the given condition
+    """
+    query = str(query)
+    key = (attr, query.casefold() if ignore_case else query, bool(ignore_case),
+           bool(fuzzy))
+    version = database.catalog_version(attr)
+
+    entry = _cache.get(key)
+    if entry is not None and entry[0] == version:
+        _cache.move_to_end(key)
+        _stats['hits'] += 1
+        # the books are read again, as their other attributes may have changed
+        return [database.search_book_by_id(book_id) for book_id in entry[1]]
+
+    _stats['misses'] += 1
+
+    results = _search_by_param(attr, query, ignore_case, fuzzy)
+    _cache[key] = version, tuple(book.id for book in results)
+    _cache.move_to_end(key)
+
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+        _stats['evictions'] += 1
+
+    return results
+
+
+def _search_by_param(attr, query: str, ignore_case: bool,
+                     fuzzy: bool) -> List[SimpleNamespace]:
+    """
+    Search for books whose attribute 'attr' matches the given query, without
+    using the cache.
+
+    :param attr: the attribute of the book to search for
+    :param query: the value to check the book attribute against
+    :param ignore_case: whether to ignore casing or not
+    :param fuzzy: whether to tolerate typos or not
+    :return: list of books that match the given condition, in ID order, or
+             ranked then in ID order if fuzzy
+    """
+    if fuzzy:
+        # copies of a title are shown together, in ID order
+        return [book for value in database.values_like(attr, query, ignore_case)
+                for book in database.search_books_by_param(attr, value)]
+
+    results = []
+    for value in database.values_containing(attr, query, ignore_case):
+        results.extend(database.search_books_by_param(attr, value))
+
+    results.sort(key=lambda book: book.id)
+    return results
+
+
+def refine_search(attr, query, ignore_case=False,
+                  fuzzy=False) -> List[SimpleNamespace]:
+    """
+    Search for books whose attribute 'attr' matches the given query, like
+    search_by_param.
+
+    If the query contains the query of the last search, for the same attribute
+    and casing (e.g. the librarian has typed more of it), only the results of
+    the last search can match, so only they are checked. Otherwise, the whole
+    catalog is searched. Fuzzy searches allow more typos in longer queries, so
+    they always search the whole catalog.
 
     :param attr: the attribute of the book to search for
     :param query: the value to check the book attribute against
     :param ignore_case: whether to ignore casing or not
+    :param fuzzy: whether to tolerate typos or not
     :return: list of books that match the given condition
     """
+    global _last_search
+
+    if fuzzy:
+        _last_search = None
+        return search_by_param(attr, query, ignore_case, fuzzy=True)
+
     query = str(query)
+    folded = query.casefold() if ignore_case else query
+
+    if _last_search is not None and \
+            _last_search[0] == attr and _last_search[2] == ignore_case and \
+            _last_search[1] in folded:
+        # copies share their values, so each value is only checked once
+        matches = {}
+        results = [book for book in _last_search[3]
+                   if _value_contains(matches, getattr(book, attr), folded,
+                                      ignore_case)]
+    else:
+        results = search_by_param(attr, query, ignore_case)
+
+    _last_search = attr, folded, ignore_case, results
+    return results
+
+
+def _value_contains(matches: dict, value, query: str,
+                    ignore_case: bool) -> bool:
+    """
+    Check whether a book attribute contains the given query, remembering the
+    answer for each value.
+
+    :param matches: value -> whether it contains the query
+    :param value: the value of the attribute
+    :param query: the query, casefolded if ignoring case
+    :param ignore_case: whether to ignore casing or not
+    :return: whether the value contains the query
+    """
+    match = matches.get(value)
+    if match is None:
+        value_str = str(value).casefold() if ignore_case else str(value)
+        match = matches[value] = query in value_str
 
-    # convert book attribute to str because 'id' is stored as int
-    get_value = lambda book: str(getattr(book, attr)) if not ignore_case else \
-        str(getattr(book, attr)).casefold()
+    return match
 
-    if ignore_case:
-        query = query.casefold()
 
-    return [book for book in database.books
-            if query in get_value(book)]
+def reset_search():
+    """
+    Forget the last search, so the next search checks the whole catalog.
+    """
+    global _last_search
+
+    _last_search = None
+
+
+def cache_stats() -> Dict[str, int]:
+    """
+    Return a copy of the search cache statistics.
+
+    :return: statistic -> count
+    """
+    return _stats.copy()
+
+
+def clear_cache():
+    """
+    Empty the search cache and reset its statistics.
+    """
+    _cache.clear()
+
+    for key in _stats:
+        _stats[key] = 0
 
 
 def search_by_title(title, ignore_case=False) -> List[SimpleNamespace]:
@@ -266,30 +563,40 @@ def search_by_title(title, ignore_case=False) -> List[SimpleNamespace]:
     return search_by_param('title', title, ignore_case)
 
 
-def _should_highlight(book: SimpleNamespace) -> bool:
+def _should_highlight(book: SimpleNamespace,
+                      overdue_ids: Set[int] = None) -> bool:
     """
     Check whether the given book should be highlighted: if it being on loan for
     more than 60 days.
 
     :param book: the book to check
+    :param overdue_ids: the IDs of the overdue books (see overdue_book_ids), to
+                        check many books with
     :return: whether the book should be highlighted or not
     """
-    most_recent_log = database.most_recent_log_for_book_id(book.id)
-    checkout_date = most_recent_log['checkout']
+    if overdue_ids is None:
+        overdue_ids = overdue_book_ids()
 
-    return (database.is_book_on_loan(book) and
-            database.is_more_than_60_days_ago(checkout_date))
+    return database.is_book_on_loan(book) and book.id in overdue_ids
 
 
 def test():
     """
     Main method which contains test code for this module.
     """
+    global CACHE_SIZE
+
     f = lambda results: (
         [book for book in results if _should_highlight(book)],
         [book for book in results if not _should_highlight(book)]
     )
 
+    overdue_ids = database.overdue_book_ids()
+    assert all(_should_highlight(book, overdue_ids) == _should_highlight(book)
+               == database.is_book_overdue(book.id)
+               for book in database.iter_books()), \
+        '_should_highlight failed test'
+
     # len(highlight) = 2, len(normal) = 1
     highlight, normal = f(search_by_title(title='Sinful Duty'))
     assert len(highlight) == 2 and len(normal) == 1, \
@@ -310,6 +617,92 @@ def test():
     assert (l := search_by_param('id', 10))[0].genre == 'Crime' \
            and len(l) == 1, "search by ID failed for ID 1"
 
+    # longer queries refine the results of the last search
+    temp = database.values_containing
+    calls = []
+    database.values_containing = lambda *args: calls.append(args) or \
+        temp(*args)
+
+    reset_search()
+    clear_cache()
+    for query_ in ('s', 'si', 'sin', 'sinful', 'SINFUL DUTY'):
+        assert refine_search('title', query_, ignore_case=True) == \
+               search_by_param('title', query_, ignore_case=True), \
+            f"refine_search failed for '{query_}'"
+    # the results of the first search are cached, so only the other 4 queries
+    # are searched for again
+    assert len(calls) == 1 + 4, 'refine_search did not refine its results'
+
+    # the whole catalog is searched if the query doesn't extend the last one
+    assert refine_search('title', 'Avengers') == search_by_title('Avengers'), \
+        'refine_search failed for a new query'
+    assert refine_search('title', 'avengers') == [], \
+        'refine_search ignored casing'
+    reset_search()
+    assert refine_search('title', 'Avengers') == search_by_title('Avengers'), \
+        'reset_search failed test'
+
+    # repeated searches are answered from the cache
+    clear_cache()
+    calls.clear()
+    results = search_by_title('sinful duty', ignore_case=True)
+    results.clear()
+    assert search_by_title('SINFUL DUTY', ignore_case=True) == \
+           search_by_title('Sinful Duty') and len(calls) == 2, \
+        'search_by_param did not use the cache'
+    assert cache_stats() == {'hits': 1, 'misses': 2, 'evictions': 0}, \
+        'cache_stats failed test'
+
+    # only searches of the changed attribute are searched again
+    book = database.search_book_by_id(18)
+    assert search_by_param('member', 'test') == [], \
+        "search failed for member 'test'"
+    database.set_book_member(book, 'test')
+    assert search_by_param('member', 'test') == [book], \
+        'search_by_param returned stale results'
+    search_by_title('Sinful Duty')
+    assert len(calls) == 4, 'search_by_param did not reuse valid results'
+    database.set_book_member(book, '0')
+    database._dirty_book_ids.clear()
+
+    # cached results show the books' current members
+    import bookcheckout
+    import bookreturn
+
+    temp_update = database.update_database, database.update_logfile
+    database.update_database = database.update_logfile = lambda: None
+    member_of_38 = lambda: [book.member for book in
+                            search_by_title('Sinful Duty') if book.id == 38]
+    assert member_of_38() == ['0'], "search failed for 'Sinful Duty'"
+    bookcheckout.checkout_book('abcd', 38)
+    hits = cache_stats()['hits']
+    assert member_of_38() == ['abcd'] and cache_stats()['hits'] == hits + 1, \
+        'search_by_param returned books with a stale member'
+    bookreturn.return_book(38)
+    database.update_database, database.update_logfile = temp_update
+
+    temp_size = CACHE_SIZE
+    CACHE_SIZE = 2
+    clear_cache()
+    for query_ in ('Sinful', 'Avengers', 'Sinful', 'Impact'):
+        search_by_title(query_)
+    assert list(_cache) == [('title', 'Sinful', False, False),
+                            ('title', 'Impact', False, False)] and \
+           cache_stats()['evictions'] == 1, 'cache eviction failed test'
+    CACHE_SIZE = temp_size
+    clear_cache()
+
+    database.values_containing = temp
+
+    # fuzzy searches tolerate typos
+    assert search_by_title('Avengrs', ignore_case=True) == [] and \
+           search_by_param('title', 'avengrs', ignore_case=True, fuzzy=True) \
+           == search_by_title('Avengers'), "fuzzy search failed for 'Avengrs'"
+    assert refine_search('author', 'Stan Le', fuzzy=True) == \
+           search_by_param('author', 'Stan Lee'), \
+        "fuzzy search failed for 'Stan Le'"
+    clear_cache()
+
     print('booksearch.py has passed all tests!')
 
 
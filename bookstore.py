@@ -0,0 +1,282 @@
+"""
+This module provides a compact, columnar representation of the book database,
+which the database module stores books in to save memory when there are a lot
+of books.
+
+A book store is a dict of parallel columns, where the book at a given position
+is made up of the values at that position in each column:
+    'id': array('i')
+    'genre': array('i') - codes of genres, i.e. indexes into the genre table
+    'title': array('i') - codes of titles
+    'author': array('i') - codes of authors
+    'purchase_date': array('i') - purchase dates, as day ordinals
+    'member': array('i') - codes of member IDs
+  and the tables used to intern the values of the coded columns:
+    'tables': Dict[str, list] - column -> each distinct value, stored once
+    'codes': Dict[str, Dict[str, int]] - column -> value -> code
+  and the purchase date string of each distinct day, so it is only formatted
+  once:
+    'date_strings': Dict[int, str]
+
+Each book takes 24 bytes of columns, compared to several hundred bytes for a
+SimpleNamespace with its own __dict__.
+
+Books are materialized as SimpleNamespaces (as described in the database
+module) when they are read, so they can be used as before, but changing a
+materialized book does not change the store.
+"""
+
+from array import array
+from types import SimpleNamespace
+from typing import List, Generator, Iterable
+
+import datecodec
+
+# the columns whose values are stored as codes into a table
+CODED_COLUMNS = ('genre', 'title', 'author', 'member')
+
+
+def new_store() -> dict:
+    """
+    Create an empty book store.
+
+    :return: the book store
+    """
+    return {
+        'id': array('i'),
+        **{column: array('i') for column in CODED_COLUMNS},
+        'purchase_date': array('i'),
+        'tables': {column: [] for column in CODED_COLUMNS},
+        'codes': {column: {} for column in CODED_COLUMNS},
+        'date_strings': {},
+    }
+
+
+def size(store: dict) -> int:
+    """
+    Return the number of books in the given store.
+
+    :param store: the book store
+    :return: the number of books
+    """
+    return len(store['id'])
+
+
+def append(store: dict, book_id: int, genre: str, title: str, author: str,
+           purchase_date: int, member: str) -> int:
+    """
+    Append a book to the given store.
+
+    :param store: the book store
+    :param book_id: the ID of the book
+    :param genre: the genre of the book
+    :param title: the title of the book
+    :param author: the author of the book
+    :param purchase_date: the purchase date of the book, as a day ordinal
+    :param member: the ID of the member that has the book, '0' if the book is
+                   available, or None if the book has no member field
+    :return: the position of the new book
+    """
+    store['id'].append(book_id)
+    store['genre'].append(code(store, 'genre', genre))
+    store['title'].append(code(store, 'title', title))
+    store['author'].append(code(store, 'author', author))
+    store['purchase_date'].append(purchase_date)
+    store['member'].append(code(store, 'member', member))
+
+    return len(store['id']) - 1
+
+
+def code(store: dict, column: str, value) -> int:
+    """
+    Return the code of the given value of a coded column in the given store,
+    adding the value to the column's table if it isn't already there.
+
+    :param store: the book store
+    :param column: the coded column
+    :param value: the value
+    :return: the code of the value
+    """
+    codes = store['codes'][column]
+
+    value_code = codes.get(value)
+    if value_code is None:
+        value_code = codes[value] = len(store['tables'][column])
+        store['tables'][column].append(value)
+
+    return value_code
+
+
+def get_value(store: dict, position: int, column: str):
+    """
+    Return the value of a column of the book at the given position, as it is
+    in a materialized book, without materializing the rest of the book.
+
+    :param store: the book store
+    :param position: the position of the book
+    :param column: the column
+    :return: the value
+    """
+    value = store[column][position]
+
+    if column == 'purchase_date':
+        return date_string(store, value)
+    if column == 'id':
+        return value
+
+    return store['tables'][column][value]
+
+
+def iter_values(store: dict, column: str) -> Iterable:
+    """
+    Return the values of a column of every book in the given store, in order,
+    as they are in materialized books.
+
+    :param store: the book store
+    :param column: the column
+    :return: the values, in an iterable
+    """
+    if column == 'purchase_date':
+        return (date_string(store, day) for day in store[column])
+    if column == 'id':
+        return store[column]
+
+    return map(store['tables'][column].__getitem__, store[column])
+
+
+def date_string(store: dict, day: int) -> str:
+    """
+    Return the given purchase date as a DD/MM/YYYY string, formatting it only
+    the first time it is needed.
+
+    :param store: the book store
+    :param day: the purchase date, as a day ordinal
+    :return: the date string
+    """
+    date_strings = store['date_strings']
+
+    s = date_strings.get(day)
+    if s is None:
+        s = date_strings[day] = datecodec.format_day(day)
+
+    return s
+
+
+def positions_of(store: dict, column: str, value) -> List[int]:
+    """
+    Return the positions of the books with the given value of a column, by
+    scanning the column rather than materializing each book.
+
+    :param store: the book store
+    :param column: the column
+    :param value: the value, as it is in a materialized book
+    :return: the positions of the matching books, in order
+    """
+    if column in CODED_COLUMNS:
+        value = store['codes'][column].get(value)
+        if value is None:
+            return []
+    elif column == 'purchase_date':
+        try:
+            value = datecodec.parse_day(value)
+        except (AttributeError, ValueError):
+            return []
+
+    return [position for position, stored in enumerate(store[column])
+            if stored == value]
+
+
+def set_value(store: dict, position: int, column: str, value):
+    """
+    Set the value of a coded column (e.g. the member) of the book at the given
+    position.
+
+    :param store: the book store
+    :param position: the position of the book
+    :param column: the coded column
+    :param value: the new value
+    """
+    store[column][position] = code(store, column, value)
+
+
+def remove(store: dict, position: int):
+    """
+    Remove the book at the given position, moving the books after it down one
+    position. Its values stay in the tables.
+
+    :param store: the book store
+    :param position: the position of the book
+    """
+    for column in ('id', 'purchase_date', *CODED_COLUMNS):
+        del store[column][position]
+
+
+def get_book(store: dict, position: int) -> SimpleNamespace:
+    """
+    Materialize the book at the given position as a SimpleNamespace.
+
+    :param store: the book store
+    :param position: the position of the book
+    :return: the book
+    """
+    tables = store['tables']
+
+    return SimpleNamespace(
+        id=store['id'][position],
+        genre=tables['genre'][store['genre'][position]],
+        title=tables['title'][store['title'][position]],
+        author=tables['author'][store['author'][position]],
+        purchase_date=date_string(store, store['purchase_date'][position]),
+        member=tables['member'][store['member'][position]]
+    )
+
+
+def iter_books(store: dict) -> Generator[SimpleNamespace, None, None]:
+    """
+    Materialize every book in the given store, in order.
+
+    :param store: the book store
+    :return: the books as SimpleNamespaces, in a generator
+    """
+    for position in range(size(store)):
+        yield get_book(store, position)
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    store = new_store()
+    for book_id, member in ((1, 'coai'), (2, '0'), (3, 'coai')):
+        append(store, book_id, 'Action', 'Avengers', 'Stan Lee',
+               datecodec.parse_day('01/07/2003'), member)
+
+    assert size(store) == 3, 'append failed test'
+    assert get_book(store, 0) == SimpleNamespace(
+        id=1, genre='Action', title='Avengers', author='Stan Lee',
+        purchase_date='01/07/2003', member='coai'), 'get_book failed test'
+    assert store['tables']['title'] == ['Avengers'] and \
+           store['tables']['member'] == ['coai', '0'], \
+        'values were not interned'
+    assert [get_value(store, position, 'member') for position in range(3)] == \
+           list(iter_values(store, 'member')) == ['coai', '0', 'coai'], \
+        'get_value or iter_values failed test'
+
+    assert positions_of(store, 'member', 'coai') == [0, 2] and \
+           positions_of(store, 'id', 2) == [1] and \
+           positions_of(store, 'purchase_date', '1/7/2003') == [0, 1, 2] and \
+           positions_of(store, 'genre', 'Horror') == [], \
+        'positions_of failed test'
+
+    set_value(store, 1, 'member', 'suii')
+    assert get_book(store, 1).member == 'suii', 'set_value failed test'
+
+    remove(store, 0)
+    assert [book.id for book in iter_books(store)] == [2, 3], \
+        'remove failed test'
+
+    print('bookstore.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,186 @@
+"""
+This module provides functionality to return books in bulk, e.g. the books left
+in the drop box at the end of the day, from a file of scanned book IDs.
+
+Book IDs can be separated by commas, whitespace or newlines, so both a list of
+IDs from a scanner and a CSV file of them can be used. The file is read as a
+stream, a line at a time, and its IDs are kept as an array of ints, so it
+doesn't matter how many IDs it has. The whole file is read before the database
+is locked, so other desks aren't held up while a slow scanner or pipe is read.
+
+Unlike return_book, a book that can't be returned doesn't stop the rest from
+being returned; the errors are all reported at the end. The database and
+logfile are only updated once, after every book has been returned.
+
+Usage: python bulkreturn.py [file]
+  The book IDs are read from stdin if no file (or '-') is given.
+"""
+
+import io
+import re
+import sys
+from array import array
+from typing import Iterable, Generator, List, Tuple, Optional
+
+import bookreturn
+import database
+
+# separators between book IDs
+_SEPARATORS = re.compile(r'[,\s]+')
+
+
+def read_book_ids(lines: Iterable[str]) -> Generator[str, None, None]:
+    """
+    Split lines of scanned book IDs into the IDs, skipping blank ones.
+
+    :param lines: the lines, e.g. a file
+    :return: the book IDs, as they were scanned, in a generator
+    """
+    for line in lines:
+        for book_id in _SEPARATORS.split(line):
+            if book_id:
+                yield book_id
+
+
+def return_books(book_ids: Iterable[str]) -> Tuple[Optional[str],
+                                                   Optional[str],
+                                                   Optional[str]]:
+    """
+    Return every book with one of the given IDs that can be returned, then
+    update the database and logfile once.
+
+    :param book_ids: the IDs of the books to return, as they were scanned
+    :return: (error message, warning message, success message)
+    """
+    ids, invalid = _parse_book_ids(book_ids)
+
+    database.begin_transaction()
+    try:
+        return _return_books(ids, invalid)
+    finally:
+        database.end_transaction()
+
+
+def _parse_book_ids(book_ids: Iterable[str]) -> Tuple[array, List[str]]:
+    """
+    Read every scanned book ID as an int.
+
+    :param book_ids: the IDs of the books, as they were scanned
+    :return: (the IDs, the error messages for the IDs that aren't numbers)
+    """
+    ids = array('i')
+    invalid: List[str] = []
+
+    for book_id in book_ids:
+        try:
+            ids.append(int(book_id))
+        except (ValueError, OverflowError):
+            invalid.append(f"Invalid book ID (not a number): '{book_id}'")
+
+    return ids, invalid
+
+
+def _return_books(book_ids: Iterable[int],
+                  invalid: List[str]) -> Tuple[Optional[str], Optional[str],
+                                               Optional[str]]:
+    """
+    Return every book with one of the given IDs that can be returned, then
+    update the database and logfile once, assuming a database transaction has
+    been started.
+
+    :param book_ids: the IDs of the books to return
+    :param invalid: the error messages for the scanned IDs that aren't numbers
+    :return: (error message, warning message, success message)
+    """
+    returned: List[str] = []
+    overdue: List[str] = []
+    errors: List[str] = []
+
+    for book_id in book_ids:
+        if (error := bookreturn._return_one(book_id, returned, overdue)) \
+                is not None:
+            errors.append(error)
+
+    return (_error(errors + invalid), bookreturn._warning(overdue),
+            bookreturn._success(returned))
+
+
+def _error(errors: List[str]) -> Optional[str]:
+    """
+    Return the error message for return_books given the errors for each book
+    that couldn't be returned.
+
+    :param errors: the error messages
+    :return: 'error message' of return_books
+    """
+    if not errors:
+        return None
+
+    if len(errors) == 1:
+        return errors[0]
+    else:
+        return f'{len(errors)} books could not be returned:\n' + \
+               '\n'.join(errors)
+
+
+def main(path: str = '-'):
+    """
+    Return the books with the IDs in the given file, and print the result.
+
+    :param path: the path of the file, or '-' for stdin
+    """
+    if path == '-':
+        result = return_books(read_book_ids(sys.stdin))
+    else:
+        with open(path) as file:
+            result = return_books(read_book_ids(file))
+
+    for msg in result:
+        if msg is not None:
+            print(msg)
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    # Temporarily modify database methods so files aren't modified while testing
+    temp = database.update_database, database.update_logfile
+    database.update_database = database.update_logfile = lambda: None
+
+    assert list(read_book_ids(['1, 4\n', '\n', ' 5\t6,,x \n'])) == \
+           ['1', '4', '5', '6', 'x'], 'read_book_ids failed test'
+
+    assert return_books([]) == (None, None, None), \
+        'return_books failed for no input'
+
+    scanned = io.StringIO('1,4\n5\n1\nx\n')
+    assert return_books(read_book_ids(scanned)) == \
+           ("2 books could not be returned:\n"
+            "Book 1 already returned\n"
+            "Invalid book ID (not a number): 'x'",
+            'Books 1,4,5 were returned after 60 days',
+            'Books 1,4,5 returned'), 'return_books failed test'
+
+    assert all(database.search_book_by_id(book_id).member == '0'
+               for book_id in (1, 4, 5)), 'return_books did not return books'
+
+    # the IDs are all read before the database is locked
+    temp_begin = database.begin_transaction
+    database.begin_transaction = lambda: scanned.close() or temp_begin()
+    scanned = io.StringIO('1\n')
+    try:
+        return_books(read_book_ids(scanned))
+    finally:
+        database.begin_transaction = temp_begin
+
+    print('bulkreturn.py has passed all tests!')
+
+    database.update_database, database.update_logfile = temp
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['test']:
+        test()
+    else:
+        main(*sys.argv[1:2])
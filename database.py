@@ -11,7 +11,14 @@ attributes:
     'purchase_date': str
     'member': str
 
-The book database is represented as a List[SimpleNamespace].
+The book database is represented by a compact, columnar book store (see the
+bookstore module), which books are materialized from when they are read, e.g.
+by search_books_by_param or iter_books. Changing a book does not change the
+book database, except through functions such as set_book_member.
+
+The member field of each row in the book database file is padded with spaces
+to a fixed width, so checkouts and returns can overwrite it in place instead
+of rewriting the whole file.
 
 Logs are represented by dicts:
     'book_id': int
@@ -20,141 +27,1746 @@ Logs are represented by dicts:
     'member': str
   Books that haven't been returned yet have None as 'return'
 
-The logfile is represented as a List[dict].
+The logfile is represented as a List[dict], or by a compact, columnar log
+store (see the logstore module) when COMPACT_LOGS is True. Functions such as
+iter_logs and most_recent_log_for_book_id work with either representation.
+
+Books and logs are loaded when they are first needed rather than when this
+module is imported, and can be loaded in the background with
+load_in_background.
+
+Changes to logs are appended to a journal (logjournal.txt) rather than
+rewriting the whole logfile. The journal is replayed when the logfile is read,
+and compacted back into the logfile once it gets too long.
+
+Old, returned logs can be moved out of memory and the logfile into yearly,
+compressed archive segments with archive_logs. Archived logs are only read
+when the logs in memory can't answer a question.
+
+Written by F120840 between 8th November and 16th December 2021.
+"""
+
+import bisect
+import csv
+import gzip
+import io
+import json
+import locale
+import os
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List, Generator, Tuple, Dict, Set, Union, Iterable
+
+try:
+    import fcntl
+except ImportError:
+    # file locking isn't available on Windows
+    fcntl = None
+
+import bookstore
+import datecodec
+import logstore
+
+# the number of days a book can be on loan for before it is overdue
+LOAN_DAYS = 60
+
+DATABASE_FILE = 'database.txt'
+LOGFILE = 'logfile.txt'
+JOURNAL_FILE = 'logjournal.txt'
+ARCHIVE_DIR = 'logarchive'
+LOCK_FILE = 'library.lock'
+VERSION_FILE = 'library.version'
+
+# when True, log changes are appended to the journal instead of rewriting the
+# whole logfile on every transaction
+JOURNAL_MODE = True
+# the number of journal records after which the journal is compacted back into
+# the logfile
+JOURNAL_COMPACT_THRESHOLD = 500
+# the kind of the journal's first record, which holds the size and CRC-32 of
+# the logfile the journal extends (see _journal_records)
+JOURNAL_HEADER = '#'
+# when True, logs are held in a compact log store (see the logstore module)
+# rather than as a List[dict]
+COMPACT_LOGS = False
+
+ENCODING = locale.getpreferredencoding(False)
+# when True, checkouts and returns overwrite only the changed books' member
+# slots in the book database file instead of rewriting the whole file
+IN_PLACE_UPDATES = True
+# the width member slots are padded to when the book database file is rewritten
+MEMBER_WIDTH = 4
+# fuzzy searches allow 1 typo per this many characters of each query word
+FUZZY_CHARS_PER_TYPO = 4
+# the characters that make csv quote a field, so a member ID with any of them
+# can't be written into a member slot as it is
+CSV_SPECIAL_CHARS = (',', '"', '\r', '\n')
+
+
+# Books
+
+def _read_database() -> dict:
+    """
+    Read the book database file, recording where each book's member slot is in
+    the file.
+
+    :return: a book store containing all books
+    """
+    global _member_slot_offsets
+    global _member_slot_widths
+
+    result = bookstore.new_store()
+    _member_slot_offsets, _member_slot_widths = array('q'), array('i')
+    line_offsets: List[Tuple[int, bytes]] = []
+
+    with open(DATABASE_FILE, 'rb') as db:
+        lines = _decode_lines(db, line_offsets)
+        reader = csv.DictReader(lines, fieldnames=BOOK_HEADERS)
+        for book in reader:
+            # member slots are padded with spaces so they can be overwritten
+            if (member := book['member']) is not None:
+                member = member.rstrip()
+            purchase_date = datecodec.parse_day(book['purchase_date'])
+            bookstore.append(result, int(book['id']), book['genre'],
+                             book['title'], book['author'], purchase_date,
+                             member)
+
+            # the member field is on the last line of the book's row
+            _add_member_slot(*line_offsets[-1])
+            line_offsets.clear()
+
+    return result
+
+
+def _add_member_slot(offset: int, line: bytes):
+    """
+    Record where the member slot of the next book is in the book database
+    file.
+
+    :param offset: the byte offset of the line the book's member field is on
+    :param line: the line, as it is in the file
+    """
+    start = line.rfind(b',') + 1
+    end = len(line.rstrip(b'\r\n'))
+
+    # books with no member field don't have a slot to overwrite, and neither
+    # do books whose member field is quoted, as it may contain commas
+    if line.count(b',') >= len(BOOK_HEADERS) - 1 and \
+            b'"' not in line[start:end]:
+        _member_slot_offsets.append(offset + start)
+        _member_slot_widths.append(end - start)
+    else:
+        _member_slot_offsets.append(0)
+        _member_slot_widths.append(-1)
+
+
+def _decode_lines(file, line_offsets: List[Tuple[int, bytes]]) -> \
+        Generator[str, None, None]:
+    """
+    Decode the lines of the given binary file, recording the byte offset and
+    raw bytes of each line as it is read.
+
+    :param file: the file, opened in binary mode
+    :param line_offsets: the list to append (offset, line) tuples to
+    :return: the decoded lines, in a generator
+    """
+    offset = 0
+    for line in file:
+        line_offsets.append((offset, line))
+        offset += len(line)
+        yield line.decode(ENCODING)
+
+
+def update_database():
+    """
+    Update the book database file.
+
+    With in-place updates, only the member slots of the books changed using
+    set_book_member are overwritten. The whole file is rewritten if any of
+    those slots are too small for the new member ID, if books have been added
+    or removed, or if no books have been marked as changed.
+    """
+    global _books_added_or_removed
+
+    _require_books()
+
+    positions = [_book_positions[book_id] for book_id in _dirty_book_ids]
+
+    if IN_PLACE_UPDATES and positions and not _books_added_or_removed and \
+            all(_member_fits_slot(position) for position in positions):
+        with open(DATABASE_FILE, 'r+b') as db:
+            for position in positions:
+                member = bookstore.get_value(books, position, 'member')
+                db.seek(_member_slot_offsets[position])
+                # pad by bytes, as non-ASCII member IDs are wider when encoded
+                db.write(member.encode(ENCODING).ljust(
+                    _member_slot_widths[position], b' '))
+    else:
+        _rewrite_database()
+
+    _dirty_book_ids.clear()
+    _books_added_or_removed = False
+    _bump_generation()
+
+
+def _rewrite_database():
+    """
+    Rewrite the whole book database file, giving every book a member slot that
+    is wide enough for any member ID.
+    """
+    global _member_slot_offsets
+    global _member_slot_widths
+
+    with open(DATABASE_FILE, 'w', newline='') as db:
+        writer = csv.DictWriter(db, fieldnames=BOOK_HEADERS)
+        for book in bookstore.iter_books(books):
+            row = vars(book)
+            if IN_PLACE_UPDATES:
+                row['member'] = (row['member'] or '').ljust(MEMBER_WIDTH)
+            writer.writerow(row)
+
+    # the slots have moved, so find them again, on the last line of each row
+    _member_slot_offsets, _member_slot_widths = array('q'), array('i')
+    line_offsets: List[Tuple[int, bytes]] = []
+    with open(DATABASE_FILE, 'rb') as db:
+        for row in csv.reader(_decode_lines(db, line_offsets)):
+            if row:
+                _add_member_slot(*line_offsets[-1])
+            line_offsets.clear()
+
+
+def _member_fits_slot(position: int) -> bool:
+    """
+    Check if the member ID of the book at the given position can be written
+    into its member slot in the book database file. Member IDs that csv would
+    quote never fit, as slots are written without quoting.
+
+    :param position: the position of the book in books
+    :return: whether the member ID fits in the book's slot
+    """
+    member = bookstore.get_value(books, position, 'member')
+    if any(char in member for char in CSV_SPECIAL_CHARS):
+        return False
+
+    return len(member.encode(ENCODING)) <= _member_slot_widths[position]
+
+
+def set_book_member(book: SimpleNamespace, member_id: str):
+    """
+    Set the member that has the given book, marking the book as changed so
+    update_database can persist it.
+
+    :param book: the book
+    :param member_id: the ID of the member that has the book, or '0' if the
+                      book is available
+    """
+    position = _book_positions[book.id]
+
+    _unindex_book_param(book.id, 'member',
+                        bookstore.get_value(books, position, 'member'))
+    bookstore.set_value(books, position, 'member', member_id)
+    book.member = bookstore.get_value(books, position, 'member')
+    _index_book_param(book.id, 'member', book.member)
+
+    _dirty_book_ids.add(book.id)
+    _catalog_versions['member'] += 1
+
+
+def catalog_version(param: str) -> int:
+    """
+    Return the version of the books' values of the given parameter. It changes
+    whenever a book's value of the parameter changes, a book is added or
+    removed, or the books are reloaded, so results that depend on the values
+    (e.g. search results) can be cached until it changes.
+
+    :param param: the property of the book
+    :return: the version
+    """
+    return _catalog_versions[param]
+
+
+def _bump_catalog_versions():
+    """
+    Change the version of every parameter, as the set of books has changed.
+    """
+    for param in _catalog_versions:
+        _catalog_versions[param] += 1
+
+
+def search_books_by_param(param: str, value) -> List[SimpleNamespace]:
+    """
+    Return books that match the given parameter.
+
+    Indexed parameters are looked up in their index, and the matching books are
+    returned in ID order. Other parameters need a scan of all books.
+
+    :param param: the property of the book to check
+    :param value: the value to check the property is equal to
+    :return: books that match the parameter
+    """
+    _require_books()
+
+    if param == 'id':
+        book = search_book_by_id(value)
+        return [book] if book is not None else []
+
+    index = _param_indexes.get(param)
+    if index is None:
+        return [bookstore.get_book(books, position)
+                for position in bookstore.positions_of(books, param, value)]
+
+    matches = index.get(value)
+    if not matches:
+        return []
+
+    if (param, value) in _unordered_matches:
+        # restore ID order, which was lost by books being indexed out of order
+        index[value] = matches = dict.fromkeys(sorted(matches))
+        _unordered_matches.discard((param, value))
+
+    return [bookstore.get_book(books, _book_positions[book_id])
+            for book_id in matches]
+
+
+def books_grouped_by_param(param: str) -> \
+        Iterable[Tuple[object, Iterable[SimpleNamespace]]]:
+    """
+    Return the books grouped by the value of the given parameter, so searches
+    can check each distinct value once rather than once per book.
+
+    Indexed parameters are grouped using their index. For other parameters,
+    each book is in its own group.
+
+    :param param: the property of the books to group by
+    :return: (value, books with that value) tuples
+    """
+    _require_books()
+
+    index = _param_indexes.get(param)
+    if index is None:
+        return ((getattr(book, param), (book,)) for book in iter_books())
+
+    return ((value, map(search_book_by_id, matches))
+            for value, matches in index.items())
+
+
+def count_books_by_param(param: str, value) -> int:
+    """
+    Return the number of books that match the given parameter, without listing
+    them for indexed parameters.
+
+    :param param: the property of the book to check
+    :param value: the value to check the property is equal to
+    :return: the number of books that match the parameter
+    """
+    _require_books()
+
+    if param == 'id':
+        return int(value in _book_positions)
+
+    index = _param_indexes.get(param)
+    if index is None:
+        return len(search_books_by_param(param, value))
+
+    return len(index.get(value, ()))
+
+
+def count_values(param: str) -> int:
+    """
+    Return the number of distinct values of the given parameter.
+
+    :param param: the property of the books
+    :return: the number of distinct values
+    """
+    _require_books()
+
+    index = _param_indexes.get(param)
+    if index is None:
+        return len(_book_positions) if param == 'id' else \
+            len(set(bookstore.iter_values(books, param)))
+
+    return len(index)
+
+
+def estimate_values_containing(param: str, query: str,
+                               ignore_case: bool = False) -> int:
+    """
+    Estimate the number of distinct values of the given parameter that contain
+    the query, without searching for them (see values_containing).
+
+    For indexed parameters, this is the number of values with the query's
+    rarest trigram, which is at least the number that contain the query.
+    Otherwise, every value is assumed to.
+
+    :param param: the property of the books to search
+    :param query: the string the values must contain
+    :param ignore_case: whether to ignore casing or not
+    :return: at least the number of values that contain the query
+    """
+    _require_books()
+
+    gram_index = _gram_indexes.get(param, {}).get(ignore_case)
+    grams = _grams(query.casefold() if ignore_case else query)
+
+    if gram_index is None or not grams:
+        return count_values(param)
+
+    return min(len(gram_index.get(gram, ())) for gram in grams)
+
+
+def values_containing(param: str, query: str,
+                      ignore_case: bool = False) -> List[object]:
+    """
+    Return the distinct values of the given parameter that contain the query,
+    when converted to strings.
+
+    For indexed parameters, only the values that have every trigram of the
+    query (see _grams) are checked, which are found by intersecting the
+    query's posting lists, smallest first. Queries that are too short to have
+    any trigrams are checked against every distinct value. IDs, which are all
+    distinct, are scanned.
+
+    :param param: the property of the books to search
+    :param query: the string the values must contain
+    :param ignore_case: whether to ignore casing or not
+    :return: the values that contain the query
+    """
+    _require_books()
+
+    if ignore_case:
+        query = query.casefold()
+
+    gram_index = _gram_indexes.get(param, {}).get(ignore_case)
+    if gram_index is None:
+        candidates = _book_positions if param == 'id' else \
+            set(bookstore.iter_values(books, param))
+    elif grams := _grams(query):
+        postings = sorted((gram_index.get(gram, set()) for gram in grams),
+                          key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+    else:
+        candidates = _param_indexes[param]
+
+    if ignore_case:
+        return [value for value in candidates
+                if query in str(value).casefold()]
+
+    return [value for value in candidates if query in str(value)]
+
+
+def values_like(param: str, query: str,
+                ignore_case: bool = False) -> List[object]:
+    """
+    Return the distinct values of the given parameter that nearly match the
+    query, when converted to strings: for every word of the query, the value
+    has a word that starts with it, give or take a few typos (characters
+    inserted, deleted or substituted). 1 typo is allowed per
+    FUZZY_CHARS_PER_TYPO characters of each word. The values with the fewest
+    typos come first.
+
+    For indexed parameters, the words near each query word are found in a trie
+    of the values' words (see _near_words). The values with the query word
+    whose near words have the fewest values are then checked for the other
+    query words. Other parameters are searched for the query exactly (see
+    values_containing).
+
+    :param param: the property of the books to search
+    :param query: the words the values must nearly have
+    :param ignore_case: whether to ignore casing or not
+    :return: the values that nearly match the query, ranked
+    """
+    _require_books()
+
+    if ignore_case:
+        query = query.casefold()
+
+    word_index = _word_indexes.get(param, {}).get(ignore_case)
+    if word_index is None or not (words := _words(query)):
+        return values_containing(param, query, ignore_case)
+
+    trie = _word_tries[param][ignore_case]
+    # near word -> typos, for each query word
+    near = sorted((_near_words(trie, word, len(word) // FUZZY_CHARS_PER_TYPO)
+                   for word in words),
+                  key=lambda near_words: sum(len(word_index[word])
+                                             for word in near_words))
+
+    typos = {}
+    for word, count in near[0].items():
+        for value in word_index[word]:
+            if count < typos.get(value, count + 1):
+                typos[value] = count
+
+    for near_words in near[1:]:
+        for value in list(typos):
+            value_str = str(value).casefold() if ignore_case else str(value)
+            counts = [near_words[word] for word in _words(value_str)
+                      if word in near_words]
+            if counts:
+                typos[value] += min(counts)
+            else:
+                del typos[value]
+
+    return sorted(typos, key=lambda value: (typos[value], value))
+
+
+def _near_words(trie: dict, word: str, max_typos: int) -> Dict[str, int]:
+    """
+    Return the words in the given trie that start with the given word, give or
+    take at most max_typos typos.
+
+    The trie is walked depth first, keeping the typos between each prefix of
+    the word and the path so far (see _next_row). Once none of them are within
+    max_typos, no longer path can be, so the rest of the branch is skipped.
+
+    :param trie: the trie of words (see _add_to_trie)
+    :param word: the word
+    :param max_typos: the most typos a near word can have
+    :return: near word -> the fewest typos between the word and its prefixes
+    """
+    near = {}
+    # (node, typos of each prefix of the word, fewest typos of the whole word)
+    stack = [(trie, list(range(len(word) + 1)), len(word))]
+
+    while stack:
+        node, row, typos = stack.pop()
+        typos = min(typos, row[-1])
+
+        for char, child in node.items():
+            if char is None:
+                if typos <= max_typos:
+                    near[child] = typos
+            elif min(row) <= max_typos:
+                stack.append((child, _next_row(row, word, char), typos))
+            elif typos <= max_typos:
+                # every word in the branch starts with a near prefix
+                stack.append((child, row, typos))
+
+    return near
+
+
+def _next_row(row: List[int], word: str, char: str) -> List[int]:
+    """
+    Given the typos between each prefix of the word and a string, return the
+    typos between each prefix of the word and the string followed by the given
+    character (the edit distance, a row of the Levenshtein table at a time).
+
+    :param row: row[i] = the typos between word[:i] and the string
+    :param word: the word
+    :param char: the next character of the string
+    :return: the typos between each prefix of the word and the longer string
+    """
+    next_row = [row[0] + 1]
+    for i, word_char in enumerate(word):
+        next_row.append(min(row[i + 1] + 1, next_row[i] + 1,
+                            row[i] + (word_char != char)))
+
+    return next_row
+
+
+def _words(s: str) -> Set[str]:
+    """
+    Return the words (separated by whitespace) of the given string.
+
+    :param s: the string
+    :return: the words
+    """
+    return set(s.split())
+
+
+def _add_to_trie(trie: dict, word: str):
+    """
+    Add a word to a trie of words. Each node is a dict of character -> child
+    node, and the nodes that words end at have the word under None.
+
+    :param trie: the root node of the trie
+    :param word: the word
+    """
+    node = trie
+    for char in word:
+        node = node.setdefault(char, {})
+
+    node[None] = word
+
+
+def _remove_from_trie(trie: dict, word: str):
+    """
+    Remove a word from a trie of words, along with the nodes that no longer
+    lead to any words.
+
+    :param trie: the root node of the trie
+    :param word: the word
+    """
+    path = [trie]
+    for char in word:
+        path.append(path[-1][char])
+
+    del path[-1][None]
+    for node, char in zip(reversed(path[:-1]), reversed(word)):
+        if node[char]:
+            break
+        del node[char]
+
+
+def _grams(s: str) -> Set[str]:
+    """
+    Return the trigrams (substrings of length 3) of the given string.
+
+    :param s: the string
+    :return: the trigrams
+    """
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _index_value_grams(param: str, value):
+    """
+    Add a new distinct value of the given parameter to its trigram and word
+    indexes.
+
+    :param param: the indexed parameter
+    :param value: the value
+    """
+    value_str = str(value)
+
+    for ignore_case, gram_index in _gram_indexes[param].items():
+        folded = value_str.casefold() if ignore_case else value_str
+        for gram in _grams(folded):
+            gram_index.setdefault(gram, set()).add(value)
+
+        word_index = _word_indexes[param][ignore_case]
+        for word in _words(folded):
+            if (posting := word_index.get(word)) is None:
+                posting = word_index[word] = set()
+                _add_to_trie(_word_tries[param][ignore_case], word)
+            posting.add(value)
+
+
+def _unindex_value_grams(param: str, value):
+    """
+    Remove a value of the given parameter, that no book has any more, from its
+    trigram and word indexes.
+
+    :param param: the indexed parameter
+    :param value: the value
+    """
+    value_str = str(value)
+
+    for ignore_case, gram_index in _gram_indexes[param].items():
+        folded = value_str.casefold() if ignore_case else value_str
+        for gram in _grams(folded):
+            posting = gram_index[gram]
+            posting.discard(value)
+            if not posting:
+                del gram_index[gram]
+
+        word_index = _word_indexes[param][ignore_case]
+        for word in _words(folded):
+            posting = word_index[word]
+            posting.discard(value)
+            if not posting:
+                del word_index[word]
+                _remove_from_trie(_word_tries[param][ignore_case], word)
+
+
+def _load_books():
+    """
+    Read the book database file into books and index it.
+    """
+    global books
+    global _books_added_or_removed
+    global _books_loaded
+    global _books_generation
+
+    start = time.perf_counter()
+
+    # read the generation first, so a write during loading makes books stale
+    _books_generation = _read_generation()
+    books = _read_database()
+    _dirty_book_ids.clear()
+    _books_added_or_removed = False
+    _index_books()
+    _bump_catalog_versions()
+
+    load_timings['books'] = time.perf_counter() - start
+    _books_loaded = True
+
+
+def _index_books():
+    """
+    (Re)build the ID index and parameter indexes for all books.
+    """
+    global _book_positions
+    global _max_book_id
+
+    _book_positions = {book_id: position
+                       for position, book_id in enumerate(books['id'])}
+    _max_book_id = max(_book_positions, default=0)
+
+    _unordered_matches.clear()
+    for param, index in _param_indexes.items():
+        index.clear()
+        for gram_index in _gram_indexes[param].values():
+            gram_index.clear()
+        for word_index in _word_indexes[param].values():
+            word_index.clear()
+        for trie in _word_tries[param].values():
+            trie.clear()
+        # the keys of _book_positions are used, so every index shares the same
+        # int objects for book IDs rather than creating their own
+        for book_id, value in zip(_book_positions,
+                                  bookstore.iter_values(books, param)):
+            _index_book_param(book_id, param, value)
+
+
+def _index_book_param(book_id: int, param: str, value):
+    """
+    Add the given book to the index of the given parameter.
+
+    :param book_id: the ID of the book to index
+    :param param: the indexed parameter
+    :param value: the book's value of the parameter
+    """
+    index = _param_indexes[param]
+
+    matches = index.get(value)
+    if matches is None:
+        matches = index[value] = {}
+        _index_value_grams(param, value)
+
+    # books are normally indexed in ID order, so only check the last one
+    if matches and next(reversed(matches)) > book_id:
+        _unordered_matches.add((param, value))
+
+    matches[book_id] = None
+
+
+def _unindex_book_param(book_id: int, param: str, value):
+    """
+    Remove the given book from the index of the given parameter.
+
+    :param book_id: the ID of the book to remove from the index
+    :param param: the indexed parameter
+    :param value: the book's value of the parameter
+    """
+    index = _param_indexes[param]
+    matches = index[value]
+
+    del matches[book_id]
+    if not matches:
+        del index[value]
+        _unordered_matches.discard((param, value))
+        _unindex_value_grams(param, value)
+
+
+def search_book_by_id(book_id: int) -> SimpleNamespace:
+    """
+    Return the book with the given ID, or None if there is no book with that ID.
+
+    :param book_id: the book ID to search for
+    :return: the book with the given ID
+    """
+    _require_books()
+
+    position = _book_positions.get(book_id)
+    return bookstore.get_book(books, position) if position is not None \
+        else None
+
+
+def iter_books() -> Generator[SimpleNamespace, None, None]:
+    """
+    Return all books, in the order they are in the book database file.
+
+    :return: all books, in a generator
+    """
+    _require_books()
+
+    return bookstore.iter_books(books)
+
+
+def book_count() -> int:
+    """
+    Return the number of books in the book database.
+
+    :return: the number of books
+    """
+    _require_books()
+
+    return bookstore.size(books)
+
+
+def add_book(genre: str, title: str, author: str, purchase_date: str,
+             book_id: int = None) -> SimpleNamespace:
+    """
+    Add a new, available book to the book database.
+
+    :param genre: the genre of the book
+    :param title: the title of the book
+    :param author: the author of the book
+    :param purchase_date: the purchase date of the book, in DD/MM/YYYY format
+    :param book_id: the ID of the book, by default 1 more than the highest ID
+    :return: the new book
+    :raises ValueError: if there is already a book with the given ID, or the
+                        purchase date isn't a valid DD/MM/YYYY date
+    """
+    global _books_added_or_removed
+    global _max_book_id
+
+    _require_books()
+
+    if book_id is None:
+        book_id = _max_book_id + 1
+    elif book_id in _book_positions:
+        raise ValueError(f'There is already a book with ID: {book_id}')
+
+    position = bookstore.append(books, book_id, genre, title, author,
+                                datecodec.parse_day(purchase_date), '0')
+    _book_positions[book_id] = position
+    book = bookstore.get_book(books, position)
+    for param in _param_indexes:
+        _index_book_param(book_id, param, getattr(book, param))
+
+    _max_book_id = max(_max_book_id, book_id)
+    _books_added_or_removed = True
+    _bump_catalog_versions()
+
+    return book
+
+
+def remove_book(book_id: int) -> SimpleNamespace:
+    """
+    Remove the book with the given ID from the book database.
+
+    :param book_id: the ID of the book to remove
+    :return: the removed book, or None if there is no book with that ID
+    :raises ValueError: if the book is on loan
+    """
+    global _books_added_or_removed
+
+    _require_books()
+
+    book = search_book_by_id(book_id)
+    if book is None:
+        return None
+
+    if is_book_on_loan(book):
+        raise ValueError(f'Book {book_id} is on loan, to: {book.member}')
+
+    position = _book_positions.pop(book_id)
+    bookstore.remove(books, position)
+    # the books after the removed book have moved down a position
+    for later in range(position, bookstore.size(books)):
+        _book_positions[bookstore.get_value(books, later, 'id')] = later
+
+    for param in _param_indexes:
+        _unindex_book_param(book_id, param, getattr(book, param))
+    _dirty_book_ids.discard(book_id)
+
+    _books_added_or_removed = True
+    _bump_catalog_versions()
+
+    return book
+
+
+def is_book_on_loan(book: SimpleNamespace) -> bool:
+    """
+    Check if the given book is currently on loan.
+
+    :param book: the book to check
+    :return: True if the book is on loan, False is the book is available
+    """
+    return book.member != '0'
+
+
+# Logs
+
+def _read_logfile() -> List[dict]:
+    """
+    Read the logfile, then replay any journal records on top of it.
+
+    :return: a list of dicts representing all logs
+    """
+    fingerprint = [0, 0]
+    with open(LOGFILE, 'rb') as logfile:
+        reader = csv.DictReader(_fingerprint_lines(logfile, fingerprint),
+                                fieldnames=LOG_HEADERS)
+        result = list(reader)
+
+    # update types
+    for log in result:
+        log['book_id'] = int(log['book_id'])
+        log['checkout'] = str_to_date(log['checkout'])
+        log['return'] = str_to_date(r) if (r := log['return']) else None
+
+    # the open log of each book, so return stamps don't need to search logs
+    open_logs = {log['book_id']: log for log in result if is_log_on_loan(log)}
+
+    for kind, book_id, date, member in _journal_records(fingerprint):
+        if kind == '+':
+            log = {
+                'book_id': book_id,
+                'checkout': str_to_date(date),
+                'return': None,
+                'member': member
+            }
+            result.append(log)
+            open_logs[book_id] = log
+        elif (log := open_logs.pop(book_id, None)) is not None:
+            log['return'] = str_to_date(date)
+
+    return result
+
+
+def _read_logfile_compact() -> dict:
+    """
+    Read the logfile straight into a compact log store (see the logstore
+    module), then replay any journal records on top of it.
+
+    :return: a log store containing all logs
+    """
+    store = logstore.new_store()
+
+    fingerprint = [0, 0]
+    with open(LOGFILE, 'rb') as logfile:
+        for book_id, checkout, ret, member in \
+                csv.reader(_fingerprint_lines(logfile, fingerprint)):
+            logstore.append(store, int(book_id),
+                            datecodec.parse_day(checkout),
+                            datecodec.parse_day(ret) if ret else
+                            logstore.NO_RETURN,
+                            member)
+
+    # the position of the open log of each book
+    open_logs = {}
+    for position in range(logstore.size(store)):
+        book_id, _, _, on_loan = logstore.get_fields(store, position)
+        if on_loan:
+            open_logs[book_id] = position
+
+    for kind, book_id, date, member in _journal_records(fingerprint):
+        day = datecodec.parse_day(date)
+        if kind == '+':
+            open_logs[book_id] = logstore.append(store, book_id, day,
+                                                 logstore.NO_RETURN, member)
+        elif (position := open_logs.pop(book_id, None)) is not None:
+            logstore.set_return(store, position, day)
+
+    return store
+
+
+def _fingerprint_lines(file, fingerprint: List[int]) -> \
+        Generator[str, None, None]:
+    """
+    Decode the lines of the given binary file, adding each line to its
+    fingerprint ([size, CRC-32]) as it is read.
+
+    :param file: the file, opened in binary mode
+    :param fingerprint: the fingerprint of the lines before, updated in place
+    :return: the decoded lines, in a generator
+    """
+    for line in file:
+        fingerprint[0] += len(line)
+        fingerprint[1] = zlib.crc32(line, fingerprint[1])
+        yield line.decode(ENCODING)
+
+
+def _file_fingerprint(path: str) -> Tuple[int, int]:
+    """
+    Return the fingerprint of the given file, as journal headers store it.
+
+    :param path: the path of the file
+    :return: (size, CRC-32) of the file
+    """
+    size = crc = 0
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+
+    return size, crc
+
+
+def _journal_records(fingerprint: List[int]) -> \
+        Generator[Tuple[str, int, str, str], None, None]:
+    """
+    Read the records in the journal, in the order they were written, counting
+    them as they are read.
+
+    The journal starts with a header, JOURNAL_HEADER,size,crc32, holding the
+    fingerprint of the logfile it extends. If it doesn't match the logfile, the
+    journal was already compacted into it (a crash stopped compact_logfile
+    before the journal was removed), so none of its records are replayed.
+
+    Journal records are either:
+      '+',book_id,checkout,member  - a new log
+      'r',book_id,return           - a return stamp for the book's open log
+
+    Malformed records are skipped, as is a last record torn by a crash while
+    it was being appended, which update_logfile truncates before appending.
+
+    :param fingerprint: [size, CRC-32] of the logfile that was read
+    :return: (kind, book ID, date, member ID or None) of each record, in a
+             generator
+    """
+    global _journal_length
+    global _journal_end
+    global _logfile_fingerprint
+
+    _journal_length = 0
+    _journal_end = 0
+    _logfile_fingerprint = tuple(fingerprint)
+
+    try:
+        journal = open(JOURNAL_FILE, 'rb')
+    except FileNotFoundError:
+        return
+
+    with journal:
+        for line in journal:
+            if not line.endswith(b'\n'):
+                break
+
+            record = next(csv.reader([line.decode(ENCODING)]), [])
+            if not _journal_end and record[:1] == [JOURNAL_HEADER]:
+                if record != _journal_header():
+                    return
+            elif (parsed := _parse_journal_record(record)) is not None:
+                _journal_length += 1
+                yield parsed
+
+            _journal_end += len(line)
+
+
+def _journal_header() -> List[str]:
+    """
+    Return the header of a journal extending the logfile as it was last read
+    or written.
+
+    :return: the fields of the header record
+    """
+    return [JOURNAL_HEADER, *map(str, _logfile_fingerprint)]
+
+
+def _parse_journal_record(record: List[str]) -> \
+        Union[Tuple[str, int, str, str], None]:
+    """
+    Parse the fields of a journal record, checking it is complete.
+
+    :param record: the fields of the record
+    :return: (kind, book ID, date, member ID or None), or None if the record
+             is malformed
+    """
+    kind = record[0] if record else None
+    if not (kind == '+' and len(record) == 4 and record[3]
+            or kind == 'r' and len(record) == 3):
+        return None
+
+    try:
+        book_id = int(record[1])
+        datecodec.parse_day(record[2])
+    except ValueError:
+        return None
+
+    return kind, book_id, record[2], record[3] if kind == '+' else None
+
+
+def _load_logs():
+    """
+    Read the logfile into logs, in the representation chosen by COMPACT_LOGS,
+    and index it.
+    """
+    global logs
+    global _logs_on_disk
+    global _logs_loaded
+    global _logs_generation
+
+    start = time.perf_counter()
+
+    # read the generation first, so a write during loading makes logs stale
+    _logs_generation = _read_generation()
+    logs = _read_logfile_compact() if COMPACT_LOGS else _read_logfile()
+    _logs_on_disk = _log_count()
+    _journal_queue.clear()
+    _index_logs()
+    _load_archive_manifest()
+
+    load_timings['logs'] = time.perf_counter() - start
+    _logs_loaded = True
+
+
+def use_compact_logs(compact: bool = True):
+    """
+    Convert logs to or from a compact log store (see the logstore module).
+    Logs keep their positions, so the log indexes stay valid. If logs haven't
+    been loaded yet, they will be loaded in the chosen representation.
+
+    :param compact: whether logs should be stored compactly
+    """
+    global logs
+    global COMPACT_LOGS
+
+    with _logs_lock:
+        if _logs_loaded and compact and not COMPACT_LOGS:
+            logs = logstore.from_logs(logs)
+        elif _logs_loaded and not compact and COMPACT_LOGS:
+            logs = list(logstore.iter_logs(logs))
+
+        COMPACT_LOGS = compact
+
+
+def _log_count() -> int:
+    """
+    Return the number of logs, in either representation.
+
+    :return: the number of logs
+    """
+    return logstore.size(logs) if COMPACT_LOGS else len(logs)
+
+
+def _log_at(position: int) -> dict:
+    """
+    Return the log at the given position in logs. Compact logs are
+    materialized, so changing them does not change logs.
+
+    :param position: the position of the log
+    :return: the log
+    """
+    return logstore.get_log(logs, position) if COMPACT_LOGS else logs[position]
+
+
+def iter_logs() -> Generator[dict, None, None]:
+    """
+    Return all logs, in order, whichever way logs are stored.
+
+    :return: all logs, in a generator
+    """
+    _require_logs()
+
+    return logstore.iter_logs(logs) if COMPACT_LOGS else iter(logs)
+
+
+def is_journal_stale() -> bool:
+    """
+    Check whether the journal on disk was already compacted into the logfile
+    on disk, so its records must not be replayed (see _journal_records).
+
+    :return: True if the journal's header doesn't match the logfile
+    """
+    try:
+        with open(JOURNAL_FILE, 'rb') as journal:
+            header = next(csv.reader([journal.readline().decode(ENCODING)]),
+                          [])
+    except FileNotFoundError:
+        return False
+
+    return header[:1] == [JOURNAL_HEADER] and \
+        header[1:] != [str(n) for n in _file_fingerprint(LOGFILE)]
+
+
+def update_logfile():
+    """
+    Update the logfile.
+
+    In journal mode, only the changes made since the last update are appended
+    to the journal, which is compacted into the logfile once it gets too long.
+    """
+    global _journal_end
+
+    _require_logs()
+
+    added = sum(1 for kind, _ in _journal_queue if kind == '+')
+
+    # logs have been added without add_log, so the journal can't describe them
+    if not JOURNAL_MODE or _logs_on_disk + added != _log_count():
+        _compact_logfile()
+        return
+
+    # the records are appended in a single write, so a batch of changes (e.g.
+    # from checkout_books) is either all in the journal or not at all, although
+    # the book database file is written separately
+    records = io.StringIO(newline='')
+    writer = csv.writer(records)
+    if not _journal_end:
+        # start a new journal, replacing any stale one
+        writer.writerow(_journal_header())
+    for kind, position in _journal_queue:
+        log = _log_at(position)
+        if kind == '+':
+            writer.writerow((kind, log['book_id'],
+                             date_to_str(log['checkout']), log['member']))
+        else:
+            writer.writerow((kind, log['book_id'],
+                             date_to_str(log['return'])))
+
+    data = records.getvalue().encode(ENCODING)
+    with open(JOURNAL_FILE, 'r+b' if _journal_end else 'wb') as journal:
+        # drop anything after the last complete record, i.e. a torn record
+        journal.seek(_journal_end)
+        journal.truncate()
+        journal.write(data)
+
+    _journal_end += len(data)
+    _mark_persisted(_journal_length + len(_journal_queue))
+
+    if _journal_length >= JOURNAL_COMPACT_THRESHOLD:
+        _compact_logfile()
+
+
+def compact_logfile():
+    """
+    Rewrite the whole logfile from logs and empty the journal.
+
+    This is done in a database transaction, so the latest logs are written and
+    no desk writes to the files meanwhile.
+    """
+    begin_transaction()
+    try:
+        _compact_logfile()
+    finally:
+        end_transaction()
+
+
+def _compact_logfile():
+    """
+    Rewrite the whole logfile from logs and empty the journal, assuming a
+    database transaction has been started.
+
+    The new logfile replaces the old one only once it is complete, so a crash
+    leaves one or the other, and a journal left behind by a crash no longer
+    matches the new logfile's fingerprint, so it isn't replayed on top of it.
+    """
+    global _journal_end
+    global _logfile_fingerprint
+
+    _require_logs()
+
+    temp_file = LOGFILE + '.tmp'
+    with open(temp_file, 'w', newline='') as logfile:
+        writer = csv.DictWriter(logfile, fieldnames=LOG_HEADERS)
+        for log in iter_logs():
+            log = log.copy()  # copy so we don't mutate the original object
+            log['checkout'] = date_to_str(log['checkout'])
+            if (ret := log['return']) is not None:
+                log['return'] = date_to_str(ret)
+            writer.writerow(log)
+        logfile.flush()
+        os.fsync(logfile.fileno())
+
+    _logfile_fingerprint = _file_fingerprint(temp_file)
+    os.replace(temp_file, LOGFILE)
+
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+
+    _journal_end = 0
+    _mark_persisted(0)
+
+
+def _mark_persisted(journal_length: int):
+    """
+    Record that all logs are persisted, with the given number of records left
+    in the journal.
+
+    :param journal_length: the number of records now in the journal
+    """
+    global _journal_length
+    global _logs_on_disk
+
+    _journal_length = journal_length
+    _logs_on_disk = _log_count()
+    _journal_queue.clear()
+    _bump_generation()
+
+
+def add_log(book_id: int, member_id: str) -> dict:
+    """
+    Create a new log for a book being withdrawn and append it to logs.
+
+    :param book_id: the ID of the book being withdrawn
+    :param member_id: the ID of the member withdrawing the book
+    :return: the new log
+    """
+    _require_logs()
+
+    log = new_log(book_id, member_id)
+
+    if COMPACT_LOGS:
+        logstore.append(logs, book_id, log['checkout'].toordinal(),
+                        logstore.NO_RETURN, member_id)
+    else:
+        logs.append(log)
+
+    _index_new_logs()
+    _journal_queue.append(('+', _log_count() - 1))
+    return log
+
+
+def stamp_return(book_id: int) -> dict:
+    """
+    Stamp the current date as the return date of the most recent log of the
+    book with the given ID, i.e. the log of when it was withdrawn.
+
+    :param book_id: the ID of the book being returned
+    :return: the updated log
+    """
+    _require_logs()
+    _index_new_logs()
+
+    position = _book_log_positions[book_id][-1]
+    now = datetime.now()
+
+    if COMPACT_LOGS:
+        logstore.set_return(logs, position, now.toordinal())
+    else:
+        logs[position]['return'] = now
+
+    log = _log_at(position)
+    _unindex_open_log(log, position)
+    _journal_queue.append(('r', position))
+    return log
+
+
+def logs_for_member_id(member_id: str) -> Generator[dict, None, None]:
+    """
+    Return all logs corresponding to the member with the given ID.
 
-Written by F120840 between 8th November and 16th December 2021.
-"""
+    Logs in memory are returned first, in order. Then archived logs are read
+    from the archive segments the member appears in, newest segment first,
+    but only if the generator is iterated that far.
 
-import csv
-from datetime import datetime
-from functools import lru_cache
-from types import SimpleNamespace
-from typing import List, Generator
+    :param member_id: the member ID
+    :return: all logs corresponding to that member, in a generator
+    """
+    _require_logs()
+    _index_new_logs()
 
-DATE_FORMAT = '%d/%m/%Y'
-NOW = datetime.now()
+    for position in _member_log_positions.get(member_id, ()):
+        yield _log_at(position)
 
+    for year in sorted(_archive_manifest, reverse=True):
+        if member_id in _archive_manifest[year]['members']:
+            yield from (log for log in _read_segment(year)
+                        if log['member'] == member_id)
 
-# Books
 
-def _read_database() -> List[SimpleNamespace]:
+def open_logs_for_member_id(member_id: str) -> List[dict]:
     """
-    Read the book database file.
+    Return the logs of the books the member with the given ID currently has on
+    loan.
 
-    :return: a list of SimpleNamespaces representing all books
+    :param member_id: the member ID
+    :return: the logs of the member's current loans
     """
-    result = []
+    _require_logs()
+    _index_new_logs()
 
-    with open('database.txt', newline='') as db:
-        reader = csv.DictReader(db, fieldnames=BOOK_HEADERS)
-        for book in reader:
-            book['id'] = int(book['id'])
-            result.append(SimpleNamespace(**book))
+    return [_log_at(position) for position in
+            _member_open_logs.get(member_id, {}).values()]
 
-    return result
 
+def most_recent_log_for_book_id(book_id: int) -> dict:
+    """
+    Return the most recent log that corresponds to a book with given ID. This
+    log can be used to determine  whether the book has been on loan for more
+    than 60 days or not.
+
+    :param book_id: the ID the book to check for
+    :return: the most recent log (dict)
+    """
+    _require_logs()
+    _index_new_logs()
+
+    positions = _book_log_positions.get(book_id)
+    if positions:
+        return _log_at(positions[-1])
 
-def update_database():
+    # the book has no logs in memory, so its most recent log may be archived
+    for year in sorted(_archive_manifest, reverse=True):
+        if book_id in _archive_manifest[year]['books']:
+            most_recent = None
+            for log in _read_segment(year):
+                if log['book_id'] == book_id:
+                    most_recent = log
+            return most_recent
+
+
+def open_log_for_book_id(book_id: int) -> dict:
     """
-    Update the book database file.
+    Return the log of the current loan of the book with the given ID, or None
+    if the book isn't on loan according to its logs.
+
+    :param book_id: the ID of the book
+    :return: the log of the book's current loan
     """
-    with open('database.txt', 'w', newline='') as db:
-        writer = csv.DictWriter(db, fieldnames=BOOK_HEADERS)
-        for book in books:
-            writer.writerow(vars(book))
+    log = most_recent_log_for_book_id(book_id)
+    if log is not None and is_log_on_loan(log):
+        return log
 
 
-def search_books_by_param(param: str, value) -> List[SimpleNamespace]:
+def log_count_for_book_id(book_id: int) -> int:
     """
-    Return books that match the given parameter.
+    Return the number of logs for the book with the given ID, i.e. how many
+    times it has been withdrawn.
 
-    :param param: the property of the book to check
-    :param value: the value to check the property is equal to
-    :return: books that match the parameter
+    :param book_id: the ID of the book
+    :return: the number of logs for the book, including archived logs
     """
-    return [book for book in books if getattr(book, param) == value]
+    _require_logs()
+    _index_new_logs()
 
+    return (len(_book_log_positions.get(book_id, ())) +
+            _archived_book_counts.get(book_id, 0))
 
-def search_book_by_id(book_id: int) -> SimpleNamespace:
+
+def overdue_logs() -> List[dict]:
     """
-    Return the book with the given ID, or None if there is no book with that ID.
+    Return the logs of all loans that are more than 60 days old, oldest first.
 
-    :param book_id: the book ID to search for
-    :return: the book with the given ID
+    :return: the logs of overdue loans
     """
-    if 1 <= book_id <= len(books):
-        return books[book_id - 1]
+    _require_logs()
+    _index_new_logs()
 
+    # loans checked out before the cutoff day are overdue
+    end = bisect.bisect_left(_open_loan_days, _today() - LOAN_DAYS)
 
-def is_book_on_loan(book: SimpleNamespace) -> bool:
+    return [_log_at(position) for day in _open_loan_days[:end]
+            for position in _open_loans_by_day[day].values()]
+
+
+def overdue_logs_for_member_id(member_id: str) -> List[dict]:
     """
-    Check if the given book is currently on loan.
+    Return the logs of the loans that the member with the given ID has had for
+    more than 60 days.
 
-    :param book: the book to check
-    :return: True if the book is on loan, False is the book is available
+    :param member_id: the member ID
+    :return: the logs of the member's overdue loans
     """
-    return book.member != '0'
+    _require_logs()
+    _index_new_logs()
 
+    return [_log_at(position) for book_id, position in
+            _member_open_logs.get(member_id, {}).items()
+            if is_book_overdue(book_id)]
 
-# Logs
 
-def _read_logfile() -> List[dict]:
+def is_book_overdue(book_id: int) -> bool:
     """
-    Read the logfile.
+    Check if the book with the given ID has been on loan for more than 60 days,
+    according to its logs.
 
-    :return: a list of dicts representing all logs
+    :param book_id: the ID of the book
+    :return: whether the book is overdue
     """
-    with open('logfile.txt', newline='') as logfile:
-        reader = csv.DictReader(logfile, fieldnames=LOG_HEADERS)
-        result = list(reader)
+    return book_id in overdue_book_ids()
 
-    # update types
-    for log in result:
-        log['book_id'] = int(log['book_id'])
-        log['checkout'] = str_to_date(log['checkout'])
-        log['return'] = str_to_date(r) if (r := log['return']) else None
 
-    return result
+def overdue_book_ids() -> Set[int]:
+    """
+    Return the IDs of the books that have been on loan for more than 60 days,
+    according to their logs, so many books can be checked with a set lookup
+    each.
 
+    The set is kept up to date as loans open and close, and when the day
+    changes, only the loans that have become overdue since are added to it.
 
-def update_logfile():
+    :return: the IDs of the overdue books, which shouldn't be modified
     """
-    Update the logfile.
+    global _overdue_cutoff
+
+    _require_logs()
+    _index_new_logs()
+
+    cutoff = _today() - LOAN_DAYS
+    if cutoff != _overdue_cutoff:
+        if cutoff < _overdue_cutoff:
+            # the clock has gone back, so some loans may no longer be overdue
+            _overdue_book_ids.clear()
+            start = 0
+        else:
+            start = bisect.bisect_left(_open_loan_days, _overdue_cutoff)
+
+        end = bisect.bisect_left(_open_loan_days, cutoff)
+        for day in _open_loan_days[start:end]:
+            _overdue_book_ids.update(_open_loans_by_day[day])
+
+        _overdue_cutoff = cutoff
+
+    return _overdue_book_ids
+
+
+def _index_logs():
     """
-    with open('logfile.txt', 'w', newline='') as logfile:
-        writer = csv.DictWriter(logfile, fieldnames=LOG_HEADERS)
-        for log in logs:
-            log = log.copy()  # copy so we don't mutate the original object
-            log['checkout'] = date_to_str(log['checkout'])
-            if (ret := log['return']) is not None:
-                log['return'] = date_to_str(ret)
-            writer.writerow(log)
+    Rebuild the log indexes from scratch. This is needed when logs are removed
+    or reordered, rather than appended.
+    """
+    global _indexed_log_count
 
+    _book_log_positions.clear()
+    _member_log_positions.clear()
+    _member_open_logs.clear()
+    _open_loans_by_day.clear()
+    _open_loan_days.clear()
+    _open_loan_day_of_book.clear()
+    _overdue_book_ids.clear()
+    _indexed_log_count = 0
+    _index_new_logs()
 
-def logs_for_member_id(member_id: str) -> Generator[dict, None, None]:
+
+def _index_new_logs():
     """
-    Return all logs corresponding to the member with the given ID.
+    Add the logs that have been appended since logs were last indexed to the
+    log indexes. Logs are only ever appended, so this also catches up with logs
+    that were appended to logs directly.
+    """
+    global _indexed_log_count
 
-    :param member_id: the member ID
-    :return: all logs corresponding to that member, in a generator
+    count = _log_count()
+
+    for position in range(_indexed_log_count, count):
+        if COMPACT_LOGS:
+            book_id, member_id, day, on_loan = logstore.get_fields(logs,
+                                                                   position)
+        else:
+            log = logs[position]
+            book_id, member_id = log['book_id'], log['member']
+            day = log['checkout'].toordinal()
+            on_loan = is_log_on_loan(log)
+
+        _book_log_positions.setdefault(book_id, []).append(position)
+        _member_log_positions.setdefault(member_id, []).append(position)
+
+        if on_loan:
+            _index_open_log(book_id, member_id, day, position)
+
+    _indexed_log_count = count
+
+
+def _index_open_log(book_id: int, member_id: str, day: int, position: int):
     """
-    for log in logs:
-        if log['member'] == member_id:
-            yield log
+    Add a log that is on loan to the open loan indexes.
 
+    :param book_id: the ID of the log's book
+    :param member_id: the ID of the log's member
+    :param day: the day ordinal of the log's checkout date
+    :param position: the position of the log
+    """
+    # a book only has one open loan, its most recent one
+    if (old_day := _open_loan_day_of_book.get(book_id)) is not None:
+        _remove_open_loan_day(book_id, old_day)
 
-def most_recent_log_for_book_id(book_id: int) -> dict:
+    _member_open_logs.setdefault(member_id, {})[book_id] = position
+
+    loans = _open_loans_by_day.get(day)
+    if loans is None:
+        loans = _open_loans_by_day[day] = {}
+        bisect.insort(_open_loan_days, day)
+
+    loans[book_id] = position
+    _open_loan_day_of_book[book_id] = day
+
+    if day < _overdue_cutoff:
+        _overdue_book_ids.add(book_id)
+
+
+def _unindex_open_log(log: dict, position: int):
     """
-    Return the most recent log that corresponds to a book with given ID. This
-    log can be used to determine  whether the book has been on loan for more
-    than 60 days or not.
+    Remove the given log, which has just been returned, from the open loan
+    indexes.
 
-    :param book_id: the ID the book to check for
-    :return: the most recent log (dict)
+    :param log: the returned log
+    :param position: the position of the log
+    """
+    book_id = log['book_id']
+
+    open_logs = _member_open_logs.get(log['member'], {})
+    if open_logs.get(book_id) == position:
+        del open_logs[book_id]
+
+    day = _open_loan_day_of_book.get(book_id)
+    if day is not None and _open_loans_by_day[day].get(book_id) == position:
+        _remove_open_loan_day(book_id, day)
+
+
+def _remove_open_loan_day(book_id: int, day: int):
+    """
+    Remove the open loan of the given book from the checkout day buckets.
+
+    :param book_id: the ID of the book
+    :param day: the day ordinal the book was checked out on
+    """
+    loans = _open_loans_by_day[day]
+    del loans[book_id]
+    del _open_loan_day_of_book[book_id]
+    _overdue_book_ids.discard(book_id)
+
+    if not loans:
+        del _open_loans_by_day[day]
+        del _open_loan_days[bisect.bisect_left(_open_loan_days, day)]
+
+
+# Archive
+
+def archive_logs(before_year: int) -> int:
+    """
+    Move returned logs of books checked out before the given year out of memory
+    and the logfile, into compressed archive segments - one per year. Logs of
+    books that are still on loan are never archived.
+
+    Each segment is a gzipped file in the logfile format. The manifest records
+    how many logs of each book and member each segment holds, so archived logs
+    are only read when a segment can contain the logs being looked for.
+
+    This is done in a database transaction, so the latest logs are archived
+    and no desk writes to the files meanwhile.
+
+    :param before_year: the year to archive logs from before
+    :return: the number of logs archived
+    """
+    begin_transaction()
+    try:
+        return _archive_logs(before_year)
+    finally:
+        end_transaction()
+
+
+def _archive_logs(before_year: int) -> int:
+    """
+    Archive logs (see archive_logs), assuming a database transaction has been
+    started.
+
+    :param before_year: the year to archive logs from before
+    :return: the number of logs archived
+    """
+    _require_logs()
+
+    hot: List[dict] = []
+    segments: Dict[int, List[dict]] = {}
+
+    for log in iter_logs():
+        year = log['checkout'].year
+        if year < before_year and not is_log_on_loan(log):
+            segments.setdefault(year, []).append(log)
+        else:
+            hot.append(log)
+
+    if not segments:
+        return 0
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    for year, segment in segments.items():
+        # gzip members can be appended to, and are read back as one stream
+        with gzip.open(_segment_path(year), 'at', newline='') as file:
+            writer = csv.writer(file)
+            for row in _log_rows(segment):
+                writer.writerow(row)
+
+        summary = _archive_manifest.setdefault(
+            year, {'count': 0, 'books': {}, 'members': {}})
+        summary['count'] += len(segment)
+        for log in segment:
+            books_ = summary['books']
+            books_[log['book_id']] = books_.get(log['book_id'], 0) + 1
+            members = summary['members']
+            members[log['member']] = members.get(log['member'], 0) + 1
+
+    _save_archive_manifest()
+    _count_archived_books()
+
+    # the logfile is only rewritten once the logs are safely archived
+    _replace_logs(hot)
+    _compact_logfile()
+
+    return sum(len(segment) for segment in segments.values())
+
+
+def _replace_logs(new_logs: List[dict]):
+    """
+    Replace all logs with the given logs, in the representation chosen by
+    COMPACT_LOGS, and reindex them.
+
+    :param new_logs: the new logs
+    """
+    global logs
+
+    logs = logstore.from_logs(new_logs) if COMPACT_LOGS else new_logs
+    _index_logs()
+
+
+def _segment_path(year: int) -> str:
+    """
+    Return the path of the archive segment for the given year.
+
+    :param year: the year of the segment
+    :return: the path of the segment
+    """
+    return os.path.join(ARCHIVE_DIR, f'{year}.csv.gz')
+
+
+def _read_segment(year: int) -> Generator[dict, None, None]:
+    """
+    Read the logs in the archive segment for the given year, streaming them
+    from the compressed file.
+
+    :param year: the year of the segment
+    :return: the logs in the segment, in a generator
+    """
+    with gzip.open(_segment_path(year), 'rt', newline='') as file:
+        for book_id, checkout, ret, member in csv.reader(file):
+            yield {
+                'book_id': int(book_id),
+                'checkout': str_to_date(checkout),
+                'return': str_to_date(ret) if ret else None,
+                'member': member
+            }
+
+
+def _load_archive_manifest():
+    """
+    Read the archive manifest, if logs have been archived.
+    """
+    _archive_manifest.clear()
+
+    try:
+        with open(os.path.join(ARCHIVE_DIR, 'manifest.json')) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        manifest = {}
+
+    # JSON keys are always strings, so convert years and book IDs back
+    for year, summary in manifest.items():
+        summary['books'] = {int(book_id): count for book_id, count in
+                            summary['books'].items()}
+        _archive_manifest[int(year)] = summary
+
+    _count_archived_books()
+
+
+def _save_archive_manifest():
+    """
+    Write the archive manifest.
+    """
+    with open(os.path.join(ARCHIVE_DIR, 'manifest.json'), 'w') as file:
+        json.dump(_archive_manifest, file)
+
+
+def _count_archived_books():
     """
-    for log in reversed(logs):
-        if log['book_id'] == book_id:
-            return log
+    Total the number of archived logs of each book, across all segments.
+    """
+    _archived_book_counts.clear()
+
+    for summary in _archive_manifest.values():
+        for book_id, count in summary['books'].items():
+            _archived_book_counts[book_id] = \
+                _archived_book_counts.get(book_id, 0) + count
 
 
 def new_log(book_id: int, member_id: str) -> dict:
@@ -189,15 +1801,25 @@ def is_log_on_loan(log: dict) -> bool:
 
 def is_more_than_60_days_ago(date: datetime) -> bool:
     """
-    Check if the given date was more than 60 days ago.
+    Check if the given date was more than 60 days ago, counting in whole days
+    from today.
 
     :param date: the date to check
     :return: whether the given date was more than 60 days ago or not
     """
-    return (NOW - date).days > 60
+    return _today() - date.toordinal() > LOAN_DAYS
+
+
+def _today() -> int:
+    """
+    Return today's date as a day ordinal. This is checked each time rather than
+    when the module is imported, so overdue checks stay correct after midnight.
+
+    :return: today's day ordinal
+    """
+    return datetime.now().toordinal()
 
 
-@lru_cache(maxsize=None)
 def str_to_date(s: str) -> datetime:
     """
     Convert a string in the DD/MM/YYYY format to a datetime object.
@@ -205,10 +1827,9 @@ def str_to_date(s: str) -> datetime:
     :param s: the date string
     :return: the datetime object
     """
-    return datetime.strptime(s, DATE_FORMAT)
+    return datetime.fromordinal(datecodec.parse_day(s))
 
 
-@lru_cache(maxsize=None)
 def date_to_str(d: datetime) -> str:
     """
     Convert a datetime object to a string with DD/MM/YYYY format as it is more
@@ -217,23 +1838,862 @@ def date_to_str(d: datetime) -> str:
     :param d: the datetime object
     :return: the date string
     """
-    return datetime.strftime(d, DATE_FORMAT)
+    return datecodec.format_day(d.toordinal())
+
+
+# Loading
+
+def __getattr__(name: str):
+    """
+    Load books or logs the first time another module accesses them, as they
+    aren't loaded when this module is imported.
+
+    :param name: the name of the attribute being accessed
+    :return: the value of the attribute
+    """
+    if name == 'books':
+        _require_books()
+        return books
+
+    if name == 'logs':
+        _require_logs()
+        return logs
+
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def _require_books():
+    """
+    Load books if they haven't been loaded yet, waiting for them to finish
+    loading if they are being loaded in the background.
+    """
+    if not _books_loaded:
+        with _books_lock:
+            if not _books_loaded:
+                _load_books()
+
+
+def _require_logs():
+    """
+    Load logs if they haven't been loaded yet, waiting for them to finish
+    loading if they are being loaded in the background.
+    """
+    if not _logs_loaded:
+        with _logs_lock:
+            if not _logs_loaded:
+                _load_logs()
+
+
+def load_in_background() -> List[threading.Thread]:
+    """
+    Start loading books and logs concurrently, in background threads, so the
+    GUI can be shown without waiting for them. Anything that needs books or
+    logs before they have loaded waits for them.
+
+    :return: the threads loading books and logs
+    """
+    threads = [threading.Thread(target=_require_books, daemon=True),
+               threading.Thread(target=_require_logs, daemon=True)]
+
+    for thread in threads:
+        thread.start()
+
+    return threads
+
+
+def reload():
+    """
+    Discard books and logs, including any changes that haven't been saved, and
+    read them from the files again.
+    """
+    with _books_lock:
+        _load_books()
+
+    with _logs_lock:
+        _load_logs()
+
+
+def refresh():
+    """
+    Reload books and logs if another desk (or the library server) has written
+    to the files since they were loaded, i.e. the generation in the version file
+    has changed.
+    """
+    generation = _read_generation()
+    if (_books_loaded and _books_generation != generation) or \
+            (_logs_loaded and _logs_generation != generation):
+        reload()
+
+
+# Transactions
+
+def begin_transaction():
+    """
+    Start a transaction that reads and changes books or logs, so several desks
+    can share the same files.
+
+    An exclusive lock is taken on the lock file, so only one desk can be in a
+    transaction at a time; the lock is only held until end_transaction, so
+    desks don't block each other between transactions. If another desk has
+    written to the files since books or logs were loaded (the generation in the
+    version file has changed), they are reloaded so the transaction is carried
+    out against the latest data.
+
+    Transactions can be nested; only the outermost one takes the lock.
+    """
+    global _lock_file
+    global _lock_depth
+
+    _lock_depth += 1
+    if _lock_depth > 1:
+        return
+
+    try:
+        _lock_file = open(LOCK_FILE, 'a')
+        if fcntl is not None:
+            fcntl.flock(_lock_file, fcntl.LOCK_EX)
+
+        refresh()
+    except BaseException:
+        # the transaction didn't start, so end_transaction won't be called to
+        # release the lock
+        _lock_depth = 0
+        if _lock_file is not None:
+            _lock_file.close()
+            _lock_file = None
+        raise
+
+
+def end_transaction():
+    """
+    End a transaction started by begin_transaction, releasing the lock.
+    """
+    global _lock_file
+    global _lock_depth
+
+    _lock_depth -= 1
+    if _lock_depth > 0:
+        return
+
+    if fcntl is not None:
+        fcntl.flock(_lock_file, fcntl.LOCK_UN)
+    _lock_file.close()
+    _lock_file = None
+
+
+def _read_generation() -> int:
+    """
+    Read the generation of the files, which is increased every time they are
+    written to.
+
+    :return: the generation, or 0 if the files have never been written to
+    """
+    try:
+        with open(VERSION_FILE) as file:
+            return int(file.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _bump_generation():
+    """
+    Increase the generation of the files after writing to them, so other desks
+    know to reload them.
+    """
+    global _books_generation
+    global _logs_generation
+
+    generation = _read_generation() + 1
+
+    # write to a temporary file first, so the version file is never partial
+    temp_file = VERSION_FILE + '.tmp'
+    with open(temp_file, 'w') as file:
+        file.write(str(generation))
+    os.replace(temp_file, VERSION_FILE)
+
+    _books_generation = _logs_generation = generation
+
+
+# seconds taken to load 'books' and 'logs'
+load_timings: Dict[str, float] = {}
 
+_lock_file = None
+_lock_depth = 0
+# the generation of the files when books and logs were loaded
+_books_generation = 0
+_logs_generation = 0
 
 BOOK_HEADERS = ('id', 'genre', 'title', 'author', 'purchase_date', 'member')
-books: List[SimpleNamespace] = _read_database()
+# the byte offset and width of the member slot in the file of the book at each
+# position in books, or a width of -1 if the book has no member slot
+_member_slot_offsets = array('q')
+_member_slot_widths = array('i')
+# IDs of the books whose member has changed since the book database file was
+# updated
+_dirty_book_ids: Set[int] = set()
+books: dict
+_books_loaded = False
+_books_lock = threading.RLock()
+# book ID -> position of the book in books, so books can be found by ID however
+# IDs are allocated
+_book_positions: Dict[int, int] = {}
+_max_book_id = 0
+# param -> value -> IDs of the books with that value (the keys of a dict, which
+# keep their order), for the parameters that are searched for most often
+INDEXED_PARAMS = ('genre', 'member', 'author', 'title', 'purchase_date')
+_param_indexes: Dict[str, Dict[object, Dict[int, None]]] = {
+    param: {} for param in INDEXED_PARAMS
+}
+# param -> ignore case -> trigram -> values of the param with the trigram (in
+# their casefolded form if ignoring case), for substring searches
+_gram_indexes: Dict[str, Dict[bool, Dict[str, Set[object]]]] = {
+    param: {False: {}, True: {}} for param in INDEXED_PARAMS
+}
+# param -> ignore case -> word -> values of the param with the word, and the
+# trie of those words (see _add_to_trie), for fuzzy searches
+_word_indexes: Dict[str, Dict[bool, Dict[str, Set[object]]]] = {
+    param: {False: {}, True: {}} for param in INDEXED_PARAMS
+}
+_word_tries: Dict[str, Dict[bool, dict]] = {
+    param: {False: {}, True: {}} for param in INDEXED_PARAMS
+}
+# (param, value) of indexed books that are no longer in ID order
+_unordered_matches: Set[Tuple[str, object]] = set()
+# whether books have been added or removed since the file was updated
+_books_added_or_removed = False
+# param -> the version of the books' values of the param (see catalog_version)
+_catalog_versions: Dict[str, int] = dict.fromkeys(BOOK_HEADERS, 0)
 
 LOG_HEADERS = ('book_id', 'checkout', 'return', 'member')
-logs: List[dict] = _read_logfile()
+# (kind, position) of changes to logs that haven't been written to the journal
+_journal_queue: List[Tuple[str, int]] = []
+_journal_length = 0
+# the size in bytes of the complete records in the journal, including its
+# header, or 0 if a new journal has to be started (see _journal_records)
+_journal_end = 0
+# (size, CRC-32) of the logfile, as it was last read or written
+_logfile_fingerprint: Tuple[int, int] = (0, 0)
+# the number of logs stored in the logfile and journal
+_logs_on_disk = 0
+# book ID -> positions in logs of the book's logs, in order
+_book_log_positions: Dict[int, List[int]] = {}
+# member ID -> positions in logs of the member's logs, in order
+_member_log_positions: Dict[str, List[int]] = {}
+# member ID -> book ID -> position in logs, for the books each member has on
+# loan
+_member_open_logs: Dict[str, Dict[int, int]] = {}
+# checkout day ordinal -> book ID -> position in logs, for open loans
+_open_loans_by_day: Dict[int, Dict[int, int]] = {}
+# the checkout day ordinals in _open_loans_by_day, sorted
+_open_loan_days: List[int] = []
+# book ID -> checkout day ordinal, for books on loan
+_open_loan_day_of_book: Dict[int, int] = {}
+# IDs of the books on loan since before _overdue_cutoff (see overdue_book_ids)
+_overdue_book_ids: Set[int] = set()
+# the checkout day ordinal loans are overdue before, as of when
+# _overdue_book_ids was last brought up to date
+_overdue_cutoff = 0
+_indexed_log_count = 0
+# year -> summary of the archive segment for that year:
+#   'count': int, 'books': Dict[int, int], 'members': Dict[str, int]
+_archive_manifest: Dict[int, dict] = {}
+# book ID -> number of archived logs of the book
+_archived_book_counts: Dict[int, int] = {}
+logs: Union[List[dict], dict]
+_logs_loaded = False
+_logs_lock = threading.RLock()
+
+
+def _log_rows(logs_: Iterable[dict]) -> List[tuple]:
+    """
+    Return the given logs as they would be written to the logfile, so logs can
+    be compared regardless of the time of day they were created.
+
+    :param logs_: the logs to convert
+    :return: the logs as tuples of strings
+    """
+    return [(log['book_id'], date_to_str(log['checkout']),
+             date_to_str(r) if (r := log['return']) else '', log['member'])
+            for log in logs_]
+
+
+def _test_in_place_updates():
+    """
+    Test overwriting member slots in place, using a temporary copy of the book
+    database file so the real one is not modified.
+    """
+    global DATABASE_FILE
+    global VERSION_FILE
+
+    temp = DATABASE_FILE, [book.member for book in iter_books()], VERSION_FILE
+    read_back = lambda: list(bookstore.iter_books(_read_database()))
+    _book = search_book_by_id(2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        DATABASE_FILE = os.path.join(tmp, 'database.txt')
+        VERSION_FILE = os.path.join(tmp, 'library.version')
+
+        _rewrite_database()
+        size = os.path.getsize(DATABASE_FILE)
+        assert read_back() == list(iter_books()), \
+            '_rewrite_database failed test'
+
+        set_book_member(_book, 'suii')
+        set_book_member(search_book_by_id(3), '0')
+        update_database()
+        assert os.path.getsize(DATABASE_FILE) == size, \
+            'update_database did not update in place'
+        assert read_back() == list(iter_books()), 'update_database failed test'
+
+        # too long for the member slot, so the file must be rewritten
+        set_book_member(_book, 'toolong')
+        update_database()
+        assert read_back() == list(iter_books()), \
+            'update_database failed test for a long member ID'
+
+        # fewer characters than the slot, but more bytes than characters
+        offset, width = _member_slot_offsets[1], _member_slot_widths[1]
+        with open(DATABASE_FILE, 'rb') as db:
+            before = db.read()
+        set_book_member(_book, 'josé')
+        update_database()
+        with open(DATABASE_FILE, 'rb') as db:
+            after = db.read()
+        assert after[:offset] == before[:offset] and \
+               after[offset + width:] == before[offset + width:], \
+            'update_database overflowed a slot with a non-ASCII member ID'
+        assert read_back() == list(iter_books()), \
+            'update_database failed test for a non-ASCII member ID'
+
+        # member IDs that csv quotes can't be written into a slot as they are,
+        # and quoted slots can't be overwritten
+        for member in ('a,bc', 'a"b', 'a\nb', '0'):
+            set_book_member(search_book_by_id(3), member)
+            update_database()
+            assert read_back() == list(iter_books()), \
+                f'update_database failed test for member ID {member!r}'
+
+    DATABASE_FILE, VERSION_FILE = temp[0], temp[2]
+    # restore members through set_book_member, so they are indexed again
+    for book, member in zip(iter_books(), temp[1]):
+        set_book_member(book, member)
+    _dirty_book_ids.clear()
+    _read_database()
+
+
+def _test_param_indexes():
+    """
+    Test that the parameter indexes agree with a scan of all books, including
+    after books' members change.
+    """
+    books_ = list(iter_books())
+    for param in INDEXED_PARAMS:
+        for value in {getattr(book, param) for book in books_}:
+            assert search_books_by_param(param, value) == \
+                   [book for book in books_
+                    if getattr(book, param) == value], \
+                f'search_books_by_param failed for {param} = {value}'
+
+    assert all(count_books_by_param(param, value) ==
+               len(search_books_by_param(param, value))
+               for param in BOOK_HEADERS for value in ('Action', '0', 5)), \
+        'count_books_by_param failed test'
+    assert count_values('genre') == len({book.genre for book in books_}) and \
+           count_values('id') == len(books_), 'count_values failed test'
+    assert estimate_values_containing('title', 'Duty') >= \
+           len(values_containing('title', 'Duty')) and \
+           estimate_values_containing('title', 'zzz') == 0, \
+        'estimate_values_containing failed test'
+
+    _book = books_[2]
+    _member = _book.member
+    versions = catalog_version('member'), catalog_version('title')
+    set_book_member(_book, 'test')
+    assert search_books_by_param('member', 'test') == [_book], \
+        'set_book_member did not index the new member'
+    assert catalog_version('member') != versions[0] and \
+           catalog_version('title') == versions[1], \
+        'set_book_member did not change only the member catalog version'
+    assert _book not in search_books_by_param('member', _member), \
+        'set_book_member did not unindex the old member'
+
+    set_book_member(_book, _member)
+    assert search_books_by_param('member', 'test') == [], \
+        'set_book_member did not unindex the new member'
+    assert search_books_by_param('member', _member) == \
+           [book for book in books_ if book.member == _member], \
+        'set_book_member did not restore ID order'
+    _dirty_book_ids.clear()
+
+
+def _test_gram_indexes():
+    """
+    Test that substring searches using the trigram indexes agree with a scan of
+    all values, including after values are added and removed.
+    """
+    scan = lambda param, query, ignore_case: sorted(
+        {getattr(book, param) for book in iter_books()
+         if (query.casefold() in str(getattr(book, param)).casefold()
+             if ignore_case else query in str(getattr(book, param)))},
+        key=str)
+
+    for param, query in (('title', 'Sinful Duty'), ('title', 'the'),
+                         ('title', 'THE'), ('title', 'in'), ('author', 'Smi'),
+                         ('genre', 'o'), ('purchase_date', '/2003'),
+                         ('member', 'coa'), ('id', '1'), ('title', 'xyz')):
+        for ignore_case in (False, True):
+            assert sorted(values_containing(param, query, ignore_case),
+                          key=str) == scan(param, query, ignore_case), \
+                f'values_containing failed for {param} containing {query}'
+
+    _book = search_book_by_id(3)
+    _member = _book.member
+    set_book_member(_book, 'Grams')
+    assert values_containing('member', 'gram', True) == ['Grams'], \
+        'set_book_member did not index the grams of the new member'
+    set_book_member(_book, _member)
+    assert values_containing('member', 'gram', True) == [], \
+        'set_book_member did not unindex the grams of the old member'
+    _dirty_book_ids.clear()
+
+
+def _test_values_like():
+    """
+    Test fuzzy searches against the typos between every query word and every
+    prefix of every word of every distinct value.
+    """
+    assert values_like('title', 'Avengrs') == ['Avengers'], \
+        "values_like failed for 'Avengrs'"
+    assert values_like('author', 'Stan Le') == ['Stan Lee'], \
+        "values_like failed for 'Stan Le'"
+    assert values_like('title', 'avengrs') == [] and \
+           values_like('title', 'avengrs', ignore_case=True) == ['Avengers'], \
+        'values_like failed to ignore case'
+    assert values_like('title', 'Sinful Duty')[0] == 'Sinful Duty', \
+        'values_like did not rank an exact match first'
+
+    for param, query in (('title', 'Sinfl Duty'), ('title', 'the'),
+                         ('title', 'Soldir of Impct'), ('author', 'Smth'),
+                         ('author', 'Joh Smth')):
+        expected = {}
+        for value in {getattr(book, param) for book in iter_books()}:
+            total = 0
+            for query_word in _words(query):
+                fewest = len(query_word)
+                for value_word in _words(value):
+                    row = list(range(len(query_word) + 1))
+                    for char in value_word:
+                        row = _next_row(row, query_word, char)
+                        fewest = min(fewest, row[-1])
+                if fewest > len(query_word) // FUZZY_CHARS_PER_TYPO:
+                    break
+                total += fewest
+            else:
+                expected[value] = total
+
+        assert expected and {value: expected[value] for value in
+                             values_like(param, query)} == expected, \
+            f"values_like failed for '{query}'"
+
+    trie = {}
+    for word in ('tea', 'ten', 'te'):
+        _add_to_trie(trie, word)
+    _remove_from_trie(trie, 'tea')
+    _remove_from_trie(trie, 'te')
+    assert trie == {'t': {'e': {'n': {None: 'ten'}}}}, \
+        '_remove_from_trie failed test'
+    assert _near_words(trie, 'tan', 1) == {'ten': 1} and \
+           _near_words(trie, 'tn', 0) == {}, '_near_words failed test'
+
+
+def _test_add_remove_book():
+    """
+    Test adding and removing books, including with non-contiguous IDs.
+    """
+    global _max_book_id
+    global _books_added_or_removed
+
+    temp = _max_book_id, _books_added_or_removed
+    version = catalog_version('title')
+
+    _book = add_book('Horror', 'Test', 'Tester', '01/01/2021')
+    assert catalog_version('title') != version, \
+        'add_book did not change the catalog version'
+    assert _book.id == 91 and search_book_by_id(91) == _book, \
+        'add_book failed to use the next ID'
+
+    _sparse = add_book('Horror', 'Test', 'Tester', '01/01/2021', 1000)
+    assert search_book_by_id(1000) == _sparse, 'add_book failed for sparse ID'
+    assert search_book_by_id(999) is None, 'search_book_by_id found no book'
+    assert add_book('Horror', 'Test', 'Tester', '01/01/2021').id == 1001, \
+        'add_book failed to use the next ID after a sparse ID'
+
+    try:
+        add_book('Horror', 'Test', 'Tester', '01/01/2021', 1)
+        assert False, 'add_book accepted a duplicate ID'
+    except ValueError:
+        pass
+
+    assert remove_book(91) == _book and search_book_by_id(91) is None, \
+        'remove_book failed test'
+    assert remove_book(91) is None, 'remove_book removed a missing book'
+    remove_book(1000)
+    remove_book(1001)
+    assert book_count() == 90 and \
+           [book.id for book in iter_books()] == list(range(1, 91)), \
+        'remove_book did not remove books'
+    assert search_books_by_param('title', 'Test') == [], \
+        'remove_book did not unindex books'
+
+    _max_book_id, _books_added_or_removed = temp
+
+
+def _test_log_indexes():
+    """
+    Test that the log indexes agree with a scan of all logs.
+    """
+    for book in iter_books():
+        _expected = next((log for log in reversed(logs)
+                          if log['book_id'] == book.id), None)
+        assert most_recent_log_for_book_id(book.id) is _expected, \
+            f'most_recent_log_for_book_id failed for book {book.id}'
+
+    assert open_log_for_book_id(1)['member'] == 'coai', \
+        'open_log_for_book_id failed for a book on loan'
+    assert open_log_for_book_id(2) is None, \
+        'open_log_for_book_id failed for an available book'
+
+    for member_id in {log['member'] for log in logs}:
+        assert list(logs_for_member_id(member_id)) == \
+               [log for log in logs if log['member'] == member_id], \
+            f'logs_for_member_id failed for {member_id}'
+        assert sorted(log['book_id'] for log in
+                      open_logs_for_member_id(member_id)) == \
+               sorted(log['book_id'] for log in logs_for_member_id(member_id)
+                      if is_log_on_loan(log)), \
+            f'open_logs_for_member_id failed for {member_id}'
+
+    # test the overdue index against the open logs
+    _overdue = [log for log in logs if is_log_on_loan(log) and
+                is_more_than_60_days_ago(log['checkout'])]
+    assert sorted(_log_rows(overdue_logs())) == sorted(_log_rows(_overdue)), \
+        'overdue_logs failed test'
+    assert [log['checkout'] for log in overdue_logs()] == \
+           sorted(log['checkout'] for log in _overdue), \
+        'overdue_logs are not oldest first'
+    assert is_book_overdue(1) and not is_book_overdue(2), \
+        'is_book_overdue failed test'
+    assert overdue_book_ids() == {log['book_id'] for log in _overdue}, \
+        'overdue_book_ids failed test'
+    assert sorted(log['book_id'] for log in
+                  overdue_logs_for_member_id('suii')) == \
+           sorted(log['book_id'] for log in _overdue
+                  if log['member'] == 'suii'), \
+        'overdue_logs_for_member_id failed test'
+
+    # logs appended directly are indexed when they are next needed
+    _log = new_log(2, 'suii')
+    logs.append(_log)
+    assert open_log_for_book_id(2) is _log, 'log indexes did not catch up'
+    logs.pop()
+    _index_logs()
+
+
+def _test_overdue_book_ids():
+    """
+    Test that the overdue book IDs are kept up to date as loans open and close
+    and the day changes.
+    """
+    global _today
+
+    temp = _today, _journal_queue.copy()
+    today = _today()
+    _expected = lambda: {book_id for book_id, day in
+                         _open_loan_day_of_book.items()
+                         if _today() - day > LOAN_DAYS}
+
+    add_log(2, 'suii')
+    assert 2 not in overdue_book_ids() and overdue_book_ids() == _expected(), \
+        'overdue_book_ids failed after a checkout'
+
+    for days in (1, LOAN_DAYS + 1, 10_000, 0):
+        _today = lambda: today + days
+        assert overdue_book_ids() == _expected(), \
+            f'overdue_book_ids failed {days} days later'
+        assert (2 in overdue_book_ids()) == (days > LOAN_DAYS), \
+            'overdue_book_ids failed for a new loan'
+
+    _today = lambda: today + 10_000
+    stamp_return(2)
+    assert 2 not in overdue_book_ids() and overdue_book_ids() == _expected(), \
+        'overdue_book_ids failed after a return'
+
+    _today = temp[0]
+    logs.pop()
+    _index_logs()
+    _journal_queue[:] = temp[1]
+    assert overdue_book_ids() == _expected(), \
+        'overdue_book_ids failed after reindexing'
+
+
+def _test_compact_logs():
+    """
+    Test that a compact log store gives the same results as a List[dict].
+    """
+    expected = _log_rows(logs)
+    most_recent = [most_recent_log_for_book_id(book.id)
+                   for book in iter_books()]
+    temp = _journal_queue.copy()
+
+    use_compact_logs()
+    assert _log_rows(iter_logs()) == expected, 'use_compact_logs failed test'
+    assert _log_rows(logstore.iter_logs(_read_logfile_compact())) == \
+           expected, '_read_logfile_compact failed test'
+    assert [most_recent_log_for_book_id(book.id) for book in iter_books()] == \
+           most_recent, 'most_recent_log_for_book_id failed for compact logs'
+
+    add_log(2, 'suii')
+    assert open_log_for_book_id(2)['member'] == 'suii', \
+        'add_log failed for compact logs'
+    stamp_return(2)
+    assert open_log_for_book_id(2) is None, \
+        'stamp_return failed for compact logs'
+
+    use_compact_logs(False)
+    logs.pop()
+    _index_logs()
+    _journal_queue[:] = temp
+    assert _log_rows(logs) == expected, 'use_compact_logs(False) failed test'
+
+
+def _test_archive():
+    """
+    Test archiving logs and reading them back, using temporary files so the
+    real logfile is not modified.
+    """
+    global LOGFILE
+    global JOURNAL_FILE
+    global ARCHIVE_DIR
+    global VERSION_FILE
+
+    temp = (LOGFILE, JOURNAL_FILE, ARCHIVE_DIR, VERSION_FILE, logs.copy(),
+            _journal_length)
+    members = {log['member'] for log in logs}
+    _expected = {member: sorted(_log_rows(logs_for_member_id(member)))
+                 for member in members}
+    _counts = [log_count_for_book_id(book.id) for book in iter_books()]
+    _most_recent = [most_recent_log_for_book_id(book.id)
+                    for book in iter_books()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        LOGFILE = os.path.join(tmp, 'logfile.txt')
+        JOURNAL_FILE = os.path.join(tmp, 'logjournal.txt')
+        ARCHIVE_DIR = os.path.join(tmp, 'logarchive')
+        VERSION_FILE = os.path.join(tmp, 'library.version')
+        # logs are up to date with the new version file, so aren't reloaded
+        _bump_generation()
+
+        archived = archive_logs(2010)
+        assert archived and len(logs) + archived == len(temp[4]), \
+            'archive_logs failed test'
+        assert all(log['checkout'].year >= 2010 or is_log_on_loan(log)
+                   for log in logs), 'archive_logs kept old returned logs'
+
+        for member in members:
+            assert sorted(_log_rows(logs_for_member_id(member))) == \
+                   _expected[member], \
+                f'logs_for_member_id failed for archived logs of {member}'
+        assert [log_count_for_book_id(book.id) for book in iter_books()] == \
+               _counts, 'log_count_for_book_id failed for archived logs'
+
+        assert [most_recent_log_for_book_id(book.id)
+                for book in iter_books()] == \
+               _most_recent, \
+            'most_recent_log_for_book_id failed for archived logs'
+        assert any(book.id not in _book_log_positions
+                   for book in iter_books()), \
+            'no books have only archived logs'
+
+        # archived logs are still there after reloading
+        _load_logs()
+        assert len(logs) + archived == len(temp[4]), \
+            'archived logs were not removed from the logfile'
+        assert [log_count_for_book_id(book.id) for book in iter_books()] == \
+               _counts, 'the archive manifest was not saved'
+
+        # restore logs while the version file is still temporary
+        _replace_logs(temp[4])
+        _mark_persisted(temp[5])
+
+    LOGFILE, JOURNAL_FILE, ARCHIVE_DIR, VERSION_FILE = temp[:4]
+    _load_archive_manifest()
+
+
+def _test_journal():
+    """
+    Test appending to, replaying and compacting the journal, using temporary
+    files so the real logfile is not modified.
+    """
+    global LOGFILE
+    global JOURNAL_FILE
+    global VERSION_FILE
+
+    temp = LOGFILE, JOURNAL_FILE, VERSION_FILE, logs.copy(), _journal_length
+
+    with tempfile.TemporaryDirectory() as tmp:
+        LOGFILE = os.path.join(tmp, 'logfile.txt')
+        JOURNAL_FILE = os.path.join(tmp, 'logjournal.txt')
+        VERSION_FILE = os.path.join(tmp, 'library.version')
+        # logs are up to date with the new version file, so aren't reloaded
+        _bump_generation()
+
+        compact_logfile()
+        assert not os.path.exists(JOURNAL_FILE), 'compact_logfile failed'
+
+        add_log(2, 'suii')
+        update_logfile()
+        stamp_return(2)
+        add_log(3, 'suii')
+        update_logfile()
+        assert _journal_length == 3, 'update_logfile did not append records'
+        assert _log_rows(_read_logfile()) == _log_rows(logs), \
+            '_read_logfile did not replay the journal correctly'
+
+        compact_logfile()
+        assert not os.path.exists(JOURNAL_FILE), 'compact_logfile failed'
+        assert _log_rows(_read_logfile()) == _log_rows(logs), \
+            'compact_logfile did not write all logs'
+
+        # malformed records, returns of books not on loan and a record torn by
+        # a crash are skipped, and the torn record is truncated
+        add_log(2, 'suii')
+        update_logfile()
+        with open(JOURNAL_FILE, 'ab') as journal:
+            journal.write(b'+,2\n+,2,x,suii\nr,-1,16/10/2026\n+,2,16/10/2026')
+        assert _log_rows(_read_logfile()) == _log_rows(logs), \
+            '_read_logfile did not skip bad records'
+        assert _log_rows(logstore.iter_logs(_read_logfile_compact())) == \
+               _log_rows(logs), \
+            '_read_logfile_compact did not skip bad records'
+        assert _journal_length == 2, '_journal_records counted bad records'
+        stamp_return(2)
+        update_logfile()
+        assert _log_rows(_read_logfile()) == _log_rows(logs), \
+            'update_logfile did not truncate a torn record'
+
+        # a journal left behind by a crash after compacting isn't replayed
+        with open(JOURNAL_FILE, 'rb') as journal:
+            stale = journal.read()
+        compact_logfile()
+        with open(JOURNAL_FILE, 'wb') as journal:
+            journal.write(stale)
+        assert is_journal_stale(), 'is_journal_stale failed test'
+        assert _log_rows(_read_logfile()) == _log_rows(logs), \
+            '_read_logfile replayed a stale journal'
+        add_log(2, 'suii')
+        update_logfile()
+        assert not is_journal_stale(), 'update_logfile kept a stale journal'
+        assert _log_rows(_read_logfile()) == _log_rows(logs), \
+            'update_logfile did not replace a stale journal'
+
+        # another desk journals a checkout, which compacting mustn't lose
+        with open(JOURNAL_FILE, 'ab') as journal:
+            journal.write(b'+,3,16/10/2026,desk\r\n')
+        with open(VERSION_FILE, 'w') as file:
+            file.write(str(_read_generation() + 1))
+        compact_logfile()
+        assert not os.path.exists(JOURNAL_FILE) and \
+               open_log_for_book_id(3)['member'] == 'desk', \
+            'compact_logfile did not reload stale logs'
+
+        # logs appended directly to logs cause a full rewrite instead
+        logs.append(new_log(4, 'suii'))
+        update_logfile()
+        assert not os.path.exists(JOURNAL_FILE), \
+            'update_logfile journaled an unknown log'
+
+        # restore logs while the version file is still temporary
+        logs[:] = temp[3]
+        _mark_persisted(temp[4])
+        _index_logs()
+
+    LOGFILE, JOURNAL_FILE, VERSION_FILE = temp[:3]
+
+
+def _test_transactions():
+    """
+    Test that a transaction reloads books and logs once another desk has
+    written to the files, using temporary lock and version files.
+    """
+    global DATABASE_FILE
+    global LOCK_FILE
+    global VERSION_FILE
+
+    temp = LOCK_FILE, VERSION_FILE, DATABASE_FILE
+
+    with tempfile.TemporaryDirectory() as tmp:
+        LOCK_FILE = os.path.join(tmp, 'library.lock')
+        VERSION_FILE = os.path.join(tmp, 'library.version')
+
+        _bump_generation()
+        member = bookstore.get_value(books, 1, 'member')
+
+        # nothing has been written since loading, so nothing is reloaded
+        bookstore.set_value(books, 1, 'member', 'desk')
+        begin_transaction()
+        begin_transaction()  # nested
+        end_transaction()
+        assert _lock_file is not None, 'nested end_transaction released lock'
+        end_transaction()
+        assert _lock_file is None, 'end_transaction did not release lock'
+        assert bookstore.get_value(books, 1, 'member') == 'desk', \
+            'begin_transaction reloaded books'
+
+        # another desk writes to the files
+        generation = _read_generation() + 1
+        with open(VERSION_FILE, 'w') as file:
+            file.write(str(generation))
+
+        begin_transaction()
+        assert bookstore.get_value(books, 1, 'member') == member, \
+            'begin_transaction did not reload stale books'
+        end_transaction()
+
+        # a transaction that fails to reload doesn't keep the lock
+        with open(VERSION_FILE, 'w') as file:
+            file.write(str(generation + 1))
+        DATABASE_FILE = os.path.join(tmp, 'missing.txt')
+        try:
+            begin_transaction()
+            assert False, 'begin_transaction did not fail'
+        except FileNotFoundError:
+            pass
+        assert _lock_file is None and _lock_depth == 0, \
+            'begin_transaction kept the lock after failing'
+
+        DATABASE_FILE = temp[2]
+        begin_transaction()
+        end_transaction()
+
+    LOCK_FILE, VERSION_FILE = temp[:2]
 
 
 def test():
     """
     Main method which contains test code for this module.
     """
+    # test books and logs are loaded lazily, rather than on import
+    assert not _books_loaded and not _logs_loaded, \
+        'books or logs were loaded on import'
+    for thread in load_in_background():
+        thread.join()
+    assert _books_loaded and _logs_loaded, 'load_in_background failed test'
+    assert sorted(load_timings) == ['books', 'logs'], \
+        'load_timings is missing timings'
+
     # test book keys
-    if books:
-        _book = books[0]
+    if book_count():
+        _book = search_book_by_id(1)
         assert sorted(BOOK_HEADERS) == sorted(list(vars(_book).keys())), \
             'BOOK_HEADERS and book keys are inconsistent'
 
@@ -244,7 +2704,8 @@ def test():
             'LOG_HEADERS and log keys are inconsistent'
 
     # test reading book database
-    assert _read_database() == books, '_read_database failed test'
+    assert list(bookstore.iter_books(_read_database())) == \
+           list(iter_books()), '_read_database failed test'
     # test reading logfile
     assert _read_logfile() == logs, '_read_logfile failed test'
 
@@ -255,8 +2716,10 @@ def test():
     assert _log['checkout'] is not None, 'new_log [checkout] is None'
     assert _log['return'] is None, 'new_log: [return] is not None'
 
-    print(f'{len(books) = }')
-    assert len(books) == 90, 'incorrect number of books'
+    print(f'{book_count() = }')
+    assert book_count() == 90, 'incorrect number of books'
+    assert search_book_by_id(1).title is search_book_by_id(2).title, \
+        'book strings were not interned'
     print(f'{len(logs) = }')
 
     # print('Book 11 title:', search_book_by_id(11).title)
@@ -282,6 +2745,18 @@ def test():
     assert not is_log_on_loan(_log_not_on_loan), \
         'is_log_on_loan failed for not on loan'
 
+    _test_param_indexes()
+    _test_gram_indexes()
+    _test_values_like()
+    _test_add_remove_book()
+    _test_in_place_updates()
+    _test_log_indexes()
+    _test_overdue_book_ids()
+    _test_compact_logs()
+    _test_journal()
+    _test_archive()
+    _test_transactions()
+
     print('database.py has passed all tests!')
 
 
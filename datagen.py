@@ -0,0 +1,312 @@
+"""
+This module generates synthetic book databases and logfiles, so the library can
+be tried out (and benchmarked) at sizes far beyond the data it ships with.
+
+Catalogs are made up of titles with one or more copies each. Titles are given a
+genre, an author and a purchase date at random.
+
+Logs are generated in checkout order, spread evenly over the years before
+today. Which title is checked out follows a Zipfian distribution: the title of
+popularity rank r is checked out in proportion to 1 / r ** zipf_s. A copy of the
+title that isn't on loan is picked; if every copy is on loan, the event is
+skipped, so there may be fewer logs than events asked for. Loans last about 3
+weeks on average, but some last much longer, so there are overdue books. Loans
+which haven't ended by today are still open, and their books are on loan in the
+database.
+
+The generated files are consistent (see the verifier module).
+
+Usage: python datagen.py DIRECTORY [--books N] [--events N] [--members N]
+                                   [--copies N] [--zipf S] [--seed SEED]
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+from datetime import date
+from typing import List, Generator, Tuple, Optional
+
+import database
+import datecodec
+import verifier
+
+GENRES = ('Action', 'Crime', 'Fantasy', 'Mystery', 'Romance', 'Sci-Fi',
+          'Tragedy', 'Drama', 'Adventure', 'Horror')
+
+_ADJECTIVES = ('Silent', 'Broken', 'Hidden', 'Burning', 'Last', 'Golden',
+               'Crimson', 'Lost', 'Forgotten', 'Endless', 'Frozen', 'Wild',
+               'Secret', 'Hollow', 'Shattered', 'Distant', 'Bitter', 'Pale',
+               'Restless', 'Savage')
+_NOUNS = ('Duty', 'Empire', 'Shadow', 'Garden', 'Storm', 'Crown', 'River',
+          'Legacy', 'Promise', 'Mirror', 'Staircase', 'Harbour', 'Whisper',
+          'Orchard', 'Blade', 'Tide', 'Letter', 'Throne', 'Ember', 'Voyage')
+_PLACES = ('', ' of Fire', ' of the North', ' of Glass', ' at Midnight',
+           ' in Winter', ' of Kings', ' of the Deep', ' in Exile', ' of Ash')
+_FIRST_NAMES = ('Sally', 'John', 'Eva', 'Robin', 'Stuart', 'Malini', 'Odila',
+                'Albina', 'Ben', 'Rhys', 'Daniel', 'Irving', 'Dennis', 'Riley',
+                'Marvin', 'Joshua', 'Oakley', 'Darren', 'Abra', 'Luke')
+_LAST_NAMES = ('Young', 'Smith', 'Messer', 'Hill', 'Smolak', 'Veith', 'Oakes',
+               'Daly', 'Herbert', 'Lena', 'Adjei', 'Odunwo', 'Davies',
+               'Huncho', 'Bailey', 'Eduardo', 'Diggs', 'Priestley', 'Lee',
+               'Rissacher')
+
+# the mean length of a loan, in days
+MEAN_LOAN_DAYS = 21
+
+# the earliest purchase and checkout date
+START_DAY = date(1970, 1, 1).toordinal()
+
+# the number of titles picked at a time
+_BATCH_SIZE = 100_000
+
+
+def _title(index: int) -> str:
+    """
+    Return the title with the given index. Every index has a different title.
+
+    :param index: the index of the title
+    :return: the title
+    """
+    index, adjective = divmod(index, len(_ADJECTIVES))
+    index, noun = divmod(index, len(_NOUNS))
+    index, place = divmod(index, len(_PLACES))
+
+    title = f'{_ADJECTIVES[adjective]} {_NOUNS[noun]}{_PLACES[place]}'
+    return title if index == 0 else f'{title} {index + 1}'
+
+
+def generate_catalog(n_books: int, max_copies: int = 5,
+                     rng: random.Random = random) -> List[list]:
+    """
+    Generate the rows of a book database with the given number of books, made
+    up of titles with between 1 and max_copies copies each. No books are on
+    loan.
+
+    :param n_books: the number of books
+    :param max_copies: the most copies a title can have
+    :param rng: the random number generator to use
+    :return: [id, genre, title, author, purchase date, member] of each book
+    """
+    today = date.today().toordinal()
+    catalog = []
+
+    title_index = 0
+    while len(catalog) < n_books:
+        title = _title(title_index)
+        genre = rng.choice(GENRES)
+        author = f'{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}'
+        purchase_date = datecodec.format_day(rng.randint(START_DAY, today))
+
+        copies = min(rng.randint(1, max_copies), n_books - len(catalog))
+        for _ in range(copies):
+            catalog.append([len(catalog) + 1, genre, title, author,
+                            purchase_date, '0'])
+
+        title_index += 1
+
+    return catalog
+
+
+def generate_members(n_members: int,
+                     rng: random.Random = random) -> List[str]:
+    """
+    Generate the given number of different member IDs.
+
+    :param n_members: the number of member IDs, at most 26 ** 4
+    :return: the member IDs
+    """
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+
+    codes = rng.sample(range(len(letters) ** 4), n_members)
+    return [''.join(letters[code // len(letters) ** i % len(letters)]
+                    for i in range(4)) for code in codes]
+
+
+def generate_logs(catalog: List[list], n_events: int, members: List[str],
+                  zipf_s: float = 1.0, rng: random.Random = random) -> \
+        Generator[Tuple[int, str, str, str], None, None]:
+    """
+    Generate the logs of up to the given number of checkouts of books in the
+    given catalog, in checkout order. Books that are still on loan today have
+    their member set in the catalog.
+
+    :param catalog: the catalog (see generate_catalog)
+    :param n_events: the number of checkouts to try
+    :param members: the IDs of the members who check out books
+    :param zipf_s: the exponent of the Zipfian distribution of titles
+    :param rng: the random number generator to use
+    :return: (book ID, checkout, return, member) of each log, with dates in the
+             DD/MM/YYYY format and an empty return for open loans, in a
+             generator
+    """
+    today = date.today().toordinal()
+    span = today - START_DAY
+
+    # the indexes of the copies of each title, in the catalog
+    copies: List[List[int]] = []
+    last_title = None
+    for index, book in enumerate(catalog):
+        if book[2] != last_title:
+            copies.append([])
+            last_title = book[2]
+        copies[-1].append(index)
+
+    # the most popular titles are spread randomly throughout the catalog
+    ranks = list(range(1, len(copies) + 1))
+    rng.shuffle(ranks)
+    cum_weights = []
+    total = 0
+    for rank in ranks:
+        total += 1 / rank ** zipf_s
+        cum_weights.append(total)
+
+    # the day each book is next available on
+    available = [START_DAY] * len(catalog)
+    titles = range(len(copies))
+
+    for start in range(0, n_events, _BATCH_SIZE):
+        batch = rng.choices(titles, cum_weights=cum_weights,
+                            k=min(_BATCH_SIZE, n_events - start))
+
+        for event, title in enumerate(batch, start):
+            day = START_DAY + event * span // n_events
+
+            index = next((index for index in copies[title]
+                          if available[index] <= day), None)
+            if index is None:
+                continue
+
+            book = catalog[index]
+            member = rng.choice(members)
+            returned = day + int(rng.expovariate(1 / MEAN_LOAN_DAYS))
+
+            if returned >= today:
+                # the loan is still open
+                book[5] = member
+                available[index] = sys.maxsize
+                ret = ''
+            else:
+                available[index] = returned
+                ret = datecodec.format_day(returned)
+
+            yield book[0], datecodec.format_day(day), ret, member
+
+
+def generate(directory: str, n_books: int, n_events: int,
+             n_members: Optional[int] = None, max_copies: int = 5,
+             zipf_s: float = 1.0, seed=None) -> Tuple[str, str]:
+    """
+    Generate a book database and logfile in the given directory.
+
+    :param directory: the directory to write the files to
+    :param n_books: the number of books
+    :param n_events: the number of checkouts to try
+    :param n_members: the number of members, or None for 1 per 10 books
+    :param max_copies: the most copies a title can have
+    :param zipf_s: the exponent of the Zipfian distribution of titles
+    :param seed: the seed of the random number generator
+    :return: (path of the database, path of the logfile)
+    """
+    rng = random.Random(seed)
+
+    if n_members is None:
+        n_members = max(10, n_books // 10)
+
+    catalog = generate_catalog(n_books, max_copies, rng)
+    members = generate_members(n_members, rng)
+
+    os.makedirs(directory, exist_ok=True)
+    database_file = os.path.join(directory, 'database.txt')
+    logfile = os.path.join(directory, 'logfile.txt')
+
+    # the logs decide which books are on loan, so they are generated first
+    with open(logfile, 'w', newline='') as file:
+        csv.writer(file).writerows(generate_logs(catalog, n_events, members,
+                                                 zipf_s, rng))
+
+    # pad member slots, as the database module does, so books can be checked
+    # out without rewriting the whole file
+    if database.IN_PLACE_UPDATES:
+        for book in catalog:
+            book[5] = book[5].ljust(database.MEMBER_WIDTH)
+
+    with open(database_file, 'w', newline='') as file:
+        csv.writer(file).writerows(catalog)
+
+    return database_file, logfile
+
+
+def main(args: Optional[List[str]] = None):
+    """
+    Generate a book database and logfile as given on the command line.
+
+    :param args: the command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Generate a synthetic book '
+                                                 'database and logfile.')
+    parser.add_argument('directory', help='the directory to write them to')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=None,
+                        help='the number of checkouts (default: 10 per book)')
+    parser.add_argument('--members', type=int, default=None)
+    parser.add_argument('--copies', type=int, default=5,
+                        help='the most copies a title can have')
+    parser.add_argument('--zipf', type=float, default=1.0,
+                        help='the exponent of title popularity')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(args)
+
+    events = args.events if args.events is not None else args.books * 10
+    paths = generate(args.directory, args.books, events, args.members,
+                     args.copies, args.zipf, args.seed)
+
+    print('Generated', *paths)
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    assert len({_title(i) for i in range(10_000)}) == 10_000, \
+        '_title gave the same title twice'
+
+    catalog = generate_catalog(100, max_copies=3, rng=random.Random(1))
+    assert len(catalog) == 100 and catalog[-1][0] == 100, \
+        'generate_catalog failed test'
+    assert len({book[2] for book in catalog}) < 100, \
+        'generate_catalog did not generate copies'
+
+    members = generate_members(50, random.Random(1))
+    assert len(set(members)) == 50 and all(len(m) == 4 for m in members), \
+        'generate_members failed test'
+
+    temp = (database.DATABASE_FILE, database.LOGFILE, database.JOURNAL_FILE,
+            database.LOCK_FILE)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate(tmp, 500, 5000, seed=1)
+
+        (database.DATABASE_FILE, database.LOGFILE, database.JOURNAL_FILE,
+         database.LOCK_FILE) = (os.path.join(tmp, name) for name in temp)
+
+        assert verifier.verify() == [], 'generated files are not consistent'
+
+        with open(database.DATABASE_FILE) as file:
+            on_loan = sum(1 for row in csv.reader(file)
+                          if row[5].rstrip() != '0')
+        assert 0 < on_loan < 500, 'generate did not leave books on loan'
+
+    (database.DATABASE_FILE, database.LOGFILE, database.JOURNAL_FILE,
+     database.LOCK_FILE) = temp
+
+    print('datagen.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['test']:
+        test()
+    else:
+        main()
@@ -0,0 +1,209 @@
+"""
+This module converts between DD/MM/YYYY date strings, as stored in the book
+database and logfile, and day ordinals (see datetime.date.toordinal).
+
+Dates are normalized to days, so times of day never reach the caches and each
+cache holds at most one entry per day. The caches are bounded: once they are
+full, the least recently used entry is evicted. The caches are shared by every
+thread (e.g. the threads of database.load_in_background), so they are only
+used while holding a lock.
+
+Cache statistics are kept for both directions of the conversion, as:
+    'hits': int
+    'misses': int
+    'evictions': int
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List
+
+# the maximum number of entries in each cache
+CACHE_SIZE = 4096
+
+# date string -> day ordinal
+_parse_cache: OrderedDict = OrderedDict()
+# day ordinal -> date string
+_format_cache: OrderedDict = OrderedDict()
+
+_stats: Dict[str, Dict[str, int]] = {
+    'parse': {'hits': 0, 'misses': 0, 'evictions': 0},
+    'format': {'hits': 0, 'misses': 0, 'evictions': 0},
+}
+# held while using the caches or their statistics
+_lock = threading.Lock()
+
+
+def parse_day(s: str) -> int:
+    """
+    Convert a string in the DD/MM/YYYY format to a day ordinal. The day and
+    month don't need to be zero-padded.
+
+    :param s: the date string
+    :return: the day ordinal
+    :raises ValueError: if the string isn't a valid DD/MM/YYYY date
+    """
+    with _lock:
+        day = _parse_cache.get(s)
+        if day is not None:
+            _parse_cache.move_to_end(s)
+            _stats['parse']['hits'] += 1
+            return day
+
+        _stats['parse']['misses'] += 1
+
+    parts = s.split('/')
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        raise ValueError(f"date '{s}' does not match format DD/MM/YYYY")
+
+    day = date(int(parts[2]), int(parts[1]), int(parts[0])).toordinal()
+    _cache(_parse_cache, 'parse', s, day)
+
+    return day
+
+
+def format_day(day: int) -> str:
+    """
+    Convert a day ordinal to a string in the DD/MM/YYYY format.
+
+    :param day: the day ordinal
+    :return: the date string
+    """
+    with _lock:
+        s = _format_cache.get(day)
+        if s is not None:
+            _format_cache.move_to_end(day)
+            _stats['format']['hits'] += 1
+            return s
+
+        _stats['format']['misses'] += 1
+
+    d = date.fromordinal(day)
+    s = f'{d.day:02}/{d.month:02}/{d.year:04}'
+    _cache(_format_cache, 'format', day, s)
+
+    return s
+
+
+def _cache(cache: OrderedDict, name: str, key, value):
+    """
+    Add an entry to the given cache, evicting the least recently used entry if
+    the cache is full.
+
+    :param cache: the cache
+    :param name: the name of the cache's statistics
+    :param key: the key of the entry
+    :param value: the value of the entry
+    """
+    with _lock:
+        cache[key] = value
+        cache.move_to_end(key)
+
+        if len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+            _stats[name]['evictions'] += 1
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Return a copy of the cache statistics.
+
+    :return: 'parse'/'format' -> statistics
+    """
+    with _lock:
+        return {name: stats.copy() for name, stats in _stats.items()}
+
+
+def clear_caches():
+    """
+    Empty both caches and reset their statistics.
+    """
+    with _lock:
+        _parse_cache.clear()
+        _format_cache.clear()
+
+        for stats in _stats.values():
+            for key in stats:
+                stats[key] = 0
+
+
+def _convert_repeatedly(days: List[int], errors: list):
+    """
+    Format and parse the given days many times, for testing the caches from
+    several threads.
+
+    :param days: the day ordinals
+    :param errors: the list to append any exception raised to
+    """
+    try:
+        for _ in range(200):
+            for day in days:
+                assert parse_day(format_day(day)) == day, \
+                    'a day was converted wrongly'
+    except Exception as e:
+        errors.append(e)
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    global CACHE_SIZE
+
+    clear_caches()
+
+    day = parse_day('12/01/2021')
+    assert day == date(2021, 1, 12).toordinal(), 'parse_day failed test'
+    assert parse_day('1/1/2000') == date(2000, 1, 1).toordinal(), \
+        'parse_day failed for a date without zero-padding'
+    assert format_day(day) == '12/01/2021', 'format_day failed test'
+    assert format_day(parse_day('1/1/2000')) == '01/01/2000', \
+        'format_day did not zero-pad'
+
+    for s in ('2021-01-12', '12/01', '32/01/2021', '12/x/2021', ''):
+        try:
+            parse_day(s)
+            assert False, f"parse_day accepted '{s}'"
+        except ValueError:
+            pass
+
+    hits = cache_stats()['parse']['hits']
+    parse_day('12/01/2021')
+    assert cache_stats()['parse']['hits'] == hits + 1, \
+        'parse cache was not hit'
+
+    # the least recently used entry is evicted once the cache is full
+    temp = CACHE_SIZE
+    CACHE_SIZE = 2
+    clear_caches()
+    parse_day('01/01/2000')
+    parse_day('02/01/2000')
+    parse_day('01/01/2000')
+    parse_day('03/01/2000')
+    assert list(_parse_cache) == ['01/01/2000', '03/01/2000'], \
+        'the least recently used entry was not evicted'
+    assert cache_stats()['parse'] == {'hits': 1, 'misses': 3,
+                                      'evictions': 1}, \
+        'cache_stats failed test'
+
+    # the caches can be shared by threads, even while entries are evicted
+    days = [date(2000, 1, 1).toordinal() + i for i in range(64)]
+    errors = []
+    threads = [threading.Thread(target=_convert_repeatedly,
+                                args=(days, errors)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors and len(_parse_cache) <= CACHE_SIZE, \
+        f'the caches failed when shared by threads: {errors}'
+
+    CACHE_SIZE = temp
+    clear_caches()
+
+    print('datecodec.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    test()
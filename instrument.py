@@ -0,0 +1,515 @@
+"""
+This module instruments the database module, recording how many times each of
+its functions is called, how long the calls take and how many rows (books or
+logs) they read, write or return.
+
+Instrumentation is turned on with enable(), which replaces the functions in the
+database module with instrumented versions, and off with disable(), which puts
+the originals back. So when it is off, there is no overhead at all. As the
+functions are replaced in the module, calls from within the database module
+(e.g. update_database calling _rewrite_database) are recorded too, but
+functions imported by value before instrumentation was enabled aren't.
+
+For generator functions (e.g. logs_for_member_id), and functions that return an
+iterator (e.g. iter_logs), the time spent iterating over the result is
+recorded, and every row it yields is counted.
+
+The rows a call scans are counted separately, through the functions that scan
+books or logs for the database functions (see _SCANNERS), e.g. the scan of
+every book when searching by a parameter that isn't indexed, or the archive
+segments read by logs_for_member_id. Scanned rows are counted for the innermost
+instrumented call.
+
+Calls that raise an exception are recorded too, and counted as errors.
+
+The statistics of each function are stored as:
+    'calls': int
+    'errors': int - the number of calls that raised an exception
+    'total': float - total time, in seconds
+    'min': float - time of the fastest call, in seconds
+    'max': float - time of the slowest call, in seconds
+    'rows': int - the number of rows read, written or returned
+    'scanned': int - the number of rows scanned to find them
+    'histogram': Dict[int, int] - the number of calls that took up to each
+                 power of 2 microseconds (but more than half of it)
+
+Setting the LIBRARY_INSTRUMENT environment variable to a path makes menu.py
+turn instrumentation on and dump the statistics to that path on exit.
+"""
+
+import atexit
+import copy
+import gzip
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from functools import partial
+from typing import Dict, Optional, Iterable, Tuple
+
+import bookstore
+import database
+import logstore
+
+# the database functions that are instrumented by default
+FUNCTIONS = (
+    '_read_database', '_read_logfile', '_read_logfile_compact',
+    'update_database', '_rewrite_database', 'update_logfile',
+    '_compact_logfile',
+    'search_books_by_param', 'books_grouped_by_param', 'search_book_by_id',
+    'set_book_member', 'add_book', 'remove_book',
+    'iter_logs', 'logs_for_member_id', 'open_logs_for_member_id',
+    'most_recent_log_for_book_id', 'open_log_for_book_id',
+    'log_count_for_book_id', 'overdue_logs', 'overdue_logs_for_member_id',
+    'add_log', 'stamp_return', 'archive_logs',
+)
+
+# function name -> how to count the rows of a call, given its result, for
+# functions that don't simply return a list of rows
+_ROW_COUNTERS = {
+    '_read_logfile_compact': logstore.size,
+    '_rewrite_database': lambda result: database.book_count(),
+    '_compact_logfile': lambda result: database._log_count(),
+    'search_book_by_id': lambda result: int(result is not None),
+    'most_recent_log_for_book_id': lambda result: int(result is not None),
+    'open_log_for_book_id': lambda result: int(result is not None),
+    'archive_logs': lambda result: result,
+}
+
+
+def _positions_scanned(store: dict, column: str, value) -> int:
+    """
+    Return the number of rows bookstore.positions_of scans for the given
+    arguments: every book, unless no book can have the value.
+
+    :param store: the book store
+    :param column: the column
+    :param value: the value
+    :return: the number of rows scanned
+    """
+    if column in bookstore.CODED_COLUMNS and \
+            value not in store['codes'][column]:
+        return 0
+
+    return bookstore.size(store)
+
+
+# (module, function name) -> how many rows a call of the function scans, given
+# its arguments, for the functions that scan books or logs for the database
+# functions, or None for generator functions, which scan each row they yield
+_SCANNERS = {
+    (bookstore, 'positions_of'): _positions_scanned,
+    (database, '_read_segment'): None,
+}
+
+# function name -> the original function, while instrumentation is enabled
+_originals: Dict[str, object] = {}
+# (module, function name) -> the original scanning function, while
+# instrumentation is enabled
+_scanner_originals: Dict[Tuple[object, str], object] = {}
+_stats: Dict[str, dict] = {}
+_lock = threading.Lock()
+# the rows scanned by each instrumented call in progress in each thread, the
+# innermost call last (see _begin_scan)
+_scans = threading.local()
+# the path the statistics are dumped to on exit, if any
+_dump_path: Optional[str] = None
+
+
+def enable(dump_path: Optional[str] = None,
+           functions: Iterable[str] = FUNCTIONS):
+    """
+    Turn instrumentation on for the given database functions.
+
+    :param dump_path: the path to dump the statistics to on exit, or None to
+                      not dump them
+    :param functions: the names of the functions to instrument
+    """
+    global _dump_path
+
+    for name in functions:
+        if name in _originals:
+            continue
+
+        original = getattr(database, name)
+        wrapper = _call_generator if inspect.isgeneratorfunction(original) \
+            else _call
+        _originals[name] = original
+        setattr(database, name, partial(wrapper, name, original))
+
+    if not _scanner_originals:
+        for (module, name), count in _SCANNERS.items():
+            original = getattr(module, name)
+            _scanner_originals[module, name] = original
+            setattr(module, name,
+                    partial(_scan_generator, original) if count is None
+                    else partial(_scan, count, original))
+
+    if dump_path is not None and _dump_path is None:
+        atexit.register(_dump_on_exit)
+    _dump_path = dump_path or _dump_path
+
+
+def disable():
+    """
+    Turn instrumentation off, putting the original database functions back.
+    The statistics recorded so far are kept.
+    """
+    global _dump_path
+
+    for name, original in _originals.items():
+        setattr(database, name, original)
+    _originals.clear()
+
+    for (module, name), original in _scanner_originals.items():
+        setattr(module, name, original)
+    _scanner_originals.clear()
+
+    if _dump_path is not None:
+        atexit.unregister(_dump_on_exit)
+        _dump_path = None
+
+
+def is_enabled() -> bool:
+    """
+    Check whether any database functions are instrumented.
+
+    :return: whether instrumentation is on
+    """
+    return bool(_originals)
+
+
+def _call(name: str, func, *args, **kwargs):
+    """
+    Call an instrumented function and record the call. If the function returns
+    an iterator, the call is recorded once the iterator has been iterated over.
+
+    :param name: the name of the function
+    :param func: the original function
+    :param args: the arguments to call it with
+    :param kwargs: the keyword arguments to call it with
+    :return: the result of the function
+    """
+    scan = _begin_scan()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except BaseException:
+        _record(name, time.perf_counter() - start, 0, _end_scan(scan),
+                error=True)
+        raise
+    elapsed = time.perf_counter() - start
+    scanned = _end_scan(scan)
+
+    counter = _ROW_COUNTERS.get(name)
+    if counter is not None:
+        rows = counter(result)
+    elif isinstance(result, list):
+        rows = len(result)
+    elif isinstance(result, Iterator):
+        return _iterate(name, result, elapsed, scanned)
+    else:
+        rows = 0
+
+    _record(name, elapsed, rows, scanned)
+    return result
+
+
+def _call_generator(name: str, func, *args, **kwargs):
+    """
+    Call an instrumented generator function, and record the call once the
+    generator has been iterated over.
+
+    :param name: the name of the function
+    :param func: the original generator function
+    :param args: the arguments to call it with
+    :param kwargs: the keyword arguments to call it with
+    :return: the rows of the generator, in a generator
+    """
+    return _iterate(name, func(*args, **kwargs), 0.0, 0)
+
+
+def _iterate(name: str, iterator, elapsed: float, scanned: int):
+    """
+    Iterate over the result of an instrumented function and record the call,
+    with the time spent in the iterator and the rows it yields, once it is
+    exhausted or closed.
+
+    :param name: the name of the function
+    :param iterator: the result of the function
+    :param elapsed: the time the function took to return the iterator
+    :param scanned: the number of rows the function scanned to return it
+    :return: the rows of the iterator, in a generator
+    """
+    rows = 0
+    error = False
+
+    try:
+        while True:
+            scan = _begin_scan()
+            start = time.perf_counter()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                break
+            except BaseException:
+                error = True
+                raise
+            finally:
+                elapsed += time.perf_counter() - start
+                scanned += _end_scan(scan)
+
+            rows += 1
+            yield row
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        _record(name, elapsed, rows, scanned, error)
+
+
+def _begin_scan() -> list:
+    """
+    Start counting the rows scanned by an instrumented call in this thread.
+
+    :return: [rows scanned], to pass to _end_scan
+    """
+    stack = getattr(_scans, 'stack', None)
+    if stack is None:
+        stack = _scans.stack = []
+
+    scan = [0]
+    stack.append(scan)
+    return scan
+
+
+def _end_scan(scan: list) -> int:
+    """
+    Stop counting the rows scanned by an instrumented call in this thread.
+
+    :param scan: the result of _begin_scan for the call
+    :return: the number of rows scanned
+    """
+    # calls end in the opposite order to the order they begin in
+    assert _scans.stack.pop() is scan, 'scans ended out of order'
+    return scan[0]
+
+
+def _add_scanned(rows: int):
+    """
+    Count rows scanned for the innermost instrumented call in this thread, if
+    there is one.
+
+    :param rows: the number of rows scanned
+    """
+    if stack := getattr(_scans, 'stack', None):
+        stack[-1][0] += rows
+
+
+def _scan(count, func, *args, **kwargs):
+    """
+    Call a scanning function and count the rows it scans.
+
+    :param count: how many rows a call scans, given its arguments
+    :param func: the original function
+    :param args: the arguments to call it with
+    :param kwargs: the keyword arguments to call it with
+    :return: the result of the function
+    """
+    result = func(*args, **kwargs)
+    _add_scanned(count(*args, **kwargs))
+    return result
+
+
+def _scan_generator(func, *args, **kwargs):
+    """
+    Iterate over a scanning generator function and count each row it yields.
+
+    :param func: the original generator function
+    :param args: the arguments to call it with
+    :param kwargs: the keyword arguments to call it with
+    :return: the rows of the generator, in a generator
+    """
+    for row in func(*args, **kwargs):
+        _add_scanned(1)
+        yield row
+
+
+def _record(name: str, elapsed: float, rows: int, scanned: int = 0,
+            error: bool = False):
+    """
+    Record a call of a function.
+
+    :param name: the name of the function
+    :param elapsed: how long the call took, in seconds
+    :param rows: the number of rows the call read, wrote or returned
+    :param scanned: the number of rows the call scanned
+    :param error: whether the call raised an exception
+    """
+    # the smallest power of 2 microseconds the call took at most
+    bucket = 1 << int(elapsed * 1e6).bit_length()
+
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = {'calls': 0, 'errors': 0, 'total': 0.0,
+                                    'min': elapsed, 'max': elapsed, 'rows': 0,
+                                    'scanned': 0, 'histogram': {}}
+
+        stats['calls'] += 1
+        stats['errors'] += error
+        stats['total'] += elapsed
+        stats['min'] = min(stats['min'], elapsed)
+        stats['max'] = max(stats['max'], elapsed)
+        stats['rows'] += rows
+        stats['scanned'] += scanned
+        histogram = stats['histogram']
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+
+def snapshot() -> Dict[str, dict]:
+    """
+    Return a copy of the statistics recorded so far.
+
+    :return: function name -> statistics
+    """
+    with _lock:
+        return copy.deepcopy(_stats)
+
+
+def reset():
+    """
+    Forget the statistics recorded so far.
+    """
+    with _lock:
+        _stats.clear()
+
+
+def dump(path: str):
+    """
+    Write the statistics recorded so far to the given file, as JSON.
+
+    :param path: the path of the file
+    """
+    with open(path, 'w') as file:
+        json.dump(snapshot(), file, indent=2, sort_keys=True)
+
+
+def _dump_on_exit():
+    """
+    Dump the statistics to the path given to enable, when the program exits.
+    """
+    if _dump_path is not None:
+        dump(_dump_path)
+
+
+def enable_from_environment():
+    """
+    Turn instrumentation on if the LIBRARY_INSTRUMENT environment variable is
+    set, dumping the statistics to the path it is set to on exit.
+    """
+    if path := os.environ.get('LIBRARY_INSTRUMENT'):
+        enable(path)
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    original = database.search_books_by_param
+    original_positions_of = bookstore.positions_of
+
+    reset()
+    enable()
+    assert is_enabled() and database.search_books_by_param is not original, \
+        'enable did not instrument functions'
+
+    results = database.search_books_by_param('title', 'Sinful Duty')
+    database.search_books_by_param('genre', 'Action')
+    logs = list(database.logs_for_member_id('coai'))
+
+    stats = snapshot()
+    search = stats['search_books_by_param']
+    assert search['calls'] == 2 and search['rows'] == len(results) + 9, \
+        'search_books_by_param was not recorded'
+    assert sum(search['histogram'].values()) == 2, 'histogram failed test'
+    assert search['min'] <= search['max'] <= search['total'], \
+        'timings failed test'
+    assert stats['logs_for_member_id']['rows'] == len(logs), \
+        'generator rows were not counted'
+    assert search['scanned'] == 0, 'index lookups were counted as scans'
+
+    # functions that return an iterator have their rows counted too
+    all_logs = list(database.iter_logs())
+    groups = list(database.books_grouped_by_param('genre'))
+    stats = snapshot()
+    assert stats['iter_logs']['rows'] == len(all_logs) and \
+           stats['books_grouped_by_param']['rows'] == len(groups) > 0, \
+        'iterator rows were not counted'
+
+    # a search by a parameter that isn't indexed scans every book
+    temp = database._param_indexes
+    database._param_indexes = {param: index for param, index in temp.items()
+                               if param != 'purchase_date'}
+    database.search_books_by_param('purchase_date', '01/07/2003')
+    database._param_indexes = temp
+    assert snapshot()['search_books_by_param']['scanned'] == \
+           database.book_count(), 'scanned rows were not counted'
+
+    # calls that raise are recorded
+    try:
+        database.search_books_by_param('colour', 'red')
+        assert False, 'an unknown parameter was searched for'
+    except KeyError:
+        pass
+    search = snapshot()['search_books_by_param']
+    assert search['calls'] == 4 and search['errors'] == 1, \
+        'calls that raised were not recorded'
+
+    # archive segments read by logs_for_member_id are scanned
+    temp = database.ARCHIVE_DIR, database._archive_manifest
+    with tempfile.TemporaryDirectory() as tmp:
+        database.ARCHIVE_DIR = tmp
+        database._archive_manifest = {
+            2000: {'count': 3, 'books': {1: 3}, 'members': {'arch': 1}}}
+        with gzip.open(database._segment_path(2000), 'wt') as file:
+            file.write('1,01/01/2000,02/01/2000,arch\n'
+                       '1,03/01/2000,04/01/2000,othr\n'
+                       '1,05/01/2000,06/01/2000,othr\n')
+
+        before = snapshot()['logs_for_member_id']
+        assert len(list(database.logs_for_member_id('arch'))) == 1, \
+            'archived logs were not read'
+        after = snapshot()['logs_for_member_id']
+        assert after['rows'] - before['rows'] == 1 and \
+               after['scanned'] - before['scanned'] == 3, \
+            'archive segment rows were not counted as scanned'
+    database.ARCHIVE_DIR, database._archive_manifest = temp
+
+    disable()
+    assert database.search_books_by_param is original and not is_enabled(), \
+        'disable did not restore functions'
+    database.search_books_by_param('genre', 'Action')
+    assert bookstore.positions_of is original_positions_of, \
+        'disable did not restore scanning functions'
+    database.search_books_by_param('purchase_date', '01/07/2003')
+    assert snapshot()['search_books_by_param']['calls'] == 4, \
+        'calls were recorded while disabled'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'stats.json')
+        dump(path)
+        with open(path) as file:
+            assert json.load(file)['search_books_by_param']['calls'] == 4, \
+                'dump failed test'
+
+    reset()
+    assert snapshot() == {}, 'reset failed test'
+
+    print('instrument.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,343 @@
+"""
+This module provides a client for the library server (see the libraryserver
+module). Its functions match those the desks use to check out, return, search
+for, list and recommend books, so the desks' frames can use a shared server
+instead of reading and writing the database and logfile themselves.
+
+One connection to the server is opened when it is first needed and reused for
+every request after that. If the server has closed a reused connection, e.g.
+because it was restarted, requests that only read (see READ_ONLY_OPERATIONS)
+are sent again on a new connection. Checkouts and returns are not, as the
+server may have carried them out before the connection was lost; their
+OSError is raised, and the next request opens a new connection.
+
+Errors reported by the server are raised as RuntimeErrors.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+from types import SimpleNamespace
+from typing import List, Tuple, Optional, Iterable, Set
+
+import database
+import libraryserver
+
+# the path of the server's Unix socket
+SOCKET_PATH = libraryserver.SOCKET_PATH
+
+# the operations which can safely be sent to the server more than once
+READ_ONLY_OPERATIONS = ('ping', 'search', 'query', 'list', 'overdue',
+                        'recommend')
+
+_connection: Optional[socket.socket] = None
+# buffered reader/writer of _connection
+_stream = None
+
+
+def request(op: str, **args):
+    """
+    Send a request to the server and wait for its response.
+
+    :param op: the name of the operation
+    :param args: the arguments of the operation
+    :return: the result of the operation
+    :raises RuntimeError: if the server couldn't carry out the operation
+    :raises OSError: if the server couldn't be reached, or the connection was
+                     lost before it responded to an operation that isn't
+                     read-only
+    """
+    line = json.dumps({'op': op, **args}).encode() + b'\n'
+
+    reused = _connection is not None
+    try:
+        response = _send(line)
+    except OSError:
+        close()
+        if not reused or op not in READ_ONLY_OPERATIONS:
+            raise
+        response = _send(line)
+
+    response = json.loads(response)
+    if not response['ok']:
+        raise RuntimeError(response['error'])
+
+    return response['result']
+
+
+def _send(line: bytes) -> bytes:
+    """
+    Send a line to the server over the current connection, opening one if
+    needed, and read the line it responds with.
+
+    :param line: the request
+    :return: the response
+    :raises ConnectionError: if the server closed the connection
+    """
+    global _connection
+    global _stream
+
+    if _connection is None:
+        connection = socket.socket(socket.AF_UNIX)
+        try:
+            connection.connect(SOCKET_PATH)
+        except OSError:
+            connection.close()
+            raise
+        _connection, _stream = connection, connection.makefile('rwb')
+
+    _stream.write(line)
+    _stream.flush()
+
+    if not (response := _stream.readline()):
+        raise ConnectionError('The library server closed the connection')
+
+    return response
+
+
+def close():
+    """
+    Close the connection to the server, if there is one.
+    """
+    global _connection
+    global _stream
+
+    if _connection is None:
+        return
+
+    _stream.close()
+    _connection.close()
+    _connection = _stream = None
+
+
+def checkout_book(member_id: str, *book_ids: int) -> Tuple[Optional[str],
+                                                           Optional[str],
+                                                           Optional[str]]:
+    """
+    Withdraw given book(s) to a given member (see bookcheckout.checkout_book).
+
+    :param member_id: the ID of the member to withdraw book(s) to
+    :param book_ids: the ID(s) of the book(s) the member wants to check out
+    :return: (error message, warning message, success message)
+    """
+    return tuple(request('checkout', member=member_id, books=book_ids))
+
+
+def checkout_books(member_id: str, book_ids: Iterable[int]) -> \
+        Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Withdraw all the given books to a given member, or none of them (see
+    bookcheckout.checkout_books).
+
+    :param member_id: the ID of the member to withdraw the books to
+    :param book_ids: the IDs of the books the member wants to check out
+    :return: (error message, warning message, success message)
+    """
+    return tuple(request('checkout', member=member_id, books=list(book_ids),
+                         all=True))
+
+
+def return_book(*book_ids: int) -> Tuple[Optional[str], Optional[str],
+                                         Optional[str]]:
+    """
+    Try to return given books (see bookreturn.return_book).
+
+    :param book_ids: the id(s) of the book(s) to return
+    :return: (error message, warning message, success message)
+    """
+    return tuple(request('return', books=book_ids))
+
+
+def search_by_param(attr, query, ignore_case=False,
+                    fuzzy=False) -> List[SimpleNamespace]:
+    """
+    Search for books whose attribute 'attr' match the given query (see
+    booksearch.search_by_param).
+
+    :param attr: the attribute of the book to search for
+    :param query: the value to check the book attribute against
+    :param ignore_case: whether to ignore casing or not
+    :param fuzzy: whether to tolerate typos or not
+    :return: list of books that match the given condition
+    """
+    books = request('search', attr=attr, query=query, ignore_case=ignore_case,
+                    fuzzy=fuzzy)
+    return [SimpleNamespace(**book) for book in books]
+
+
+def search_by_query(query: str, ignore_case=False) -> List[SimpleNamespace]:
+    """
+    Search for books that match every term of the given query (see
+    bookquery.search_by_query).
+
+    :param query: the query
+    :param ignore_case: whether to ignore casing or not
+    :return: list of books that match the query
+    """
+    books = request('query', query=query, ignore_case=ignore_case)
+    return [SimpleNamespace(**book) for book in books]
+
+
+def available_books() -> List[SimpleNamespace]:
+    """
+    Return the books that are available to check out (see
+    bookcheckout.available_books).
+
+    :return: the available books
+    """
+    books = request('list', attr='member', value='0')
+    return [SimpleNamespace(**book) for book in books]
+
+
+def books_on_loan_to(member_id: str) -> List[SimpleNamespace]:
+    """
+    Return the books that a given member currently has on loan (see
+    bookreturn.books_on_loan_to).
+
+    :param member_id: the ID of the member
+    :return: the member's books
+    """
+    books = request('list', attr='member', value=member_id)
+    return [SimpleNamespace(**book) for book in books]
+
+
+def all_books() -> List[SimpleNamespace]:
+    """
+    Return all books in the database (see booksearch.all_books).
+
+    :return: all books, in the order they are in the book database
+    """
+    return [SimpleNamespace(**book) for book in request('list')]
+
+
+def overdue_book_ids() -> Set[int]:
+    """
+    Return the IDs of the books that have been on loan for more than 60 days
+    (see booksearch.overdue_book_ids).
+
+    :return: the IDs of the overdue books
+    """
+    return set(request('overdue'))
+
+
+def recommend_genres(member_id: str) -> List[str]:
+    """
+    Return the given member's favourite genres, most liked first (see
+    bookrecommend.recommend_genres).
+
+    :param member_id: the ID of the member to recommend for
+    :return: the recommended genres for the member
+    """
+    return request('recommend', member=member_id)
+
+
+def recommend_titles_for_genre(genre: str, member_id: str) -> \
+        List[Tuple[str, int]]:
+    """
+    Return the most popular titles for a given genre that the given member
+    hasn't read (see bookrecommend.recommend_titles_for_genre).
+
+    :param genre: the genre to check for
+    :param member_id: the ID of the member to recommend for
+    :return: a sorted list of (title, popularity) for the genre
+    """
+    titles = request('recommend', member=member_id, genre=genre)
+    return [tuple(title_pop) for title_pop in titles]
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    global SOCKET_PATH
+
+    # Temporarily modify database methods so files aren't modified while testing
+    temp = (database.update_database, database.update_logfile,
+            database.LOCK_FILE, database.VERSION_FILE, SOCKET_PATH)
+    database.update_database = database.update_logfile = lambda: None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.LOCK_FILE = os.path.join(tmp, 'library.lock')
+        database.VERSION_FILE = os.path.join(tmp, 'library.version')
+        SOCKET_PATH = os.path.join(tmp, 'library.sock')
+
+        try:
+            request('ping')
+            assert False, 'request did not fail without a server'
+        except OSError:
+            pass
+
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(
+            libraryserver.start_server(SOCKET_PATH))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        assert checkout_book('test', 15) == (None, None, 'Book 15 withdrawn'), \
+            'checkout_book failed test'
+        connection = _connection
+        assert checkout_books('test', [14, 15])[0] == \
+               'Book 15 is already on loan, to: test', \
+            'checkout_books failed test'
+        assert return_book(15) == (None, None, 'Book 15 returned'), \
+            'return_book failed test'
+        assert _connection is connection, 'the connection was not reused'
+
+        results = search_by_param('title', 'sinful duty', ignore_case=True)
+        assert [book.id for book in results] == \
+               [book.id for book in database.search_books_by_param(
+                   'title', 'Sinful Duty')], 'search_by_param failed test'
+        assert [book.id for book in search_by_query('id:1..3 member:=0')] == \
+               [2, 3], 'search_by_query failed test'
+        assert [book.id for book in available_books()] == \
+               [book.id for book in database.search_books_by_param(
+                   'member', '0')], 'available_books failed test'
+        assert [book.id for book in books_on_loan_to('coaa')] == \
+               [book.id for book in database.search_books_by_param(
+                   'member', 'coaa')], 'books_on_loan_to failed test'
+        assert len(all_books()) == database.book_count(), \
+            'all_books failed test'
+        assert overdue_book_ids() == database.overdue_book_ids(), \
+            'overdue_book_ids failed test'
+
+        try:
+            request('dance')
+            assert False, 'server errors were not raised'
+        except RuntimeError:
+            pass
+
+        # checkouts aren't sent again if the connection is lost, as the server
+        # may have carried them out (as it has here)
+        _connection.shutdown(socket.SHUT_RD)
+        try:
+            checkout_book('test', 15)
+            assert False, 'a checkout was sent again'
+        except OSError:
+            pass
+        assert return_book(15) == (None, None, 'Book 15 returned'), \
+            'the checkout was not carried out once'
+
+        # but read-only requests are sent again on a new connection
+        connection = _connection
+        connection.shutdown(socket.SHUT_RD)
+        assert request('ping') == 'pong', 'request did not reconnect'
+        assert _connection is not connection, 'request did not reconnect'
+
+        close()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+    (database.update_database, database.update_logfile,
+     database.LOCK_FILE, database.VERSION_FILE, SOCKET_PATH) = temp
+
+    print('libraryclient.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    test()
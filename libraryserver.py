@@ -0,0 +1,398 @@
+"""
+This module provides the library server: a daemon which reads the book database
+and logfile once, keeps them in memory, and serves checkouts, returns, searches
+and recommendations to any number of desks over a local Unix socket.
+
+All requests are handled one at a time by a single asyncio event loop, so the
+server is the only writer of the database and logfile and every desk sees the
+same, consistent catalog without having to read the files itself.
+
+The protocol is line-delimited JSON. Each request is a JSON object on its own
+line, naming an operation and its arguments:
+    {"op": "checkout", "member": "coai", "books": [1, 2]}
+    {"op": "checkout", "member": "coai", "books": [1, 2], "all": true}
+    {"op": "return", "books": [1, 2]}
+    {"op": "search", "attr": "title", "query": "duty", "ignore_case": true}
+    {"op": "search", "attr": "author", "query": "Stan Le", "fuzzy": true}
+    {"op": "query", "query": "genre:Action member:=0", "ignore_case": true}
+    {"op": "list"}
+    {"op": "list", "attr": "member", "value": "0"}
+    {"op": "overdue"}
+    {"op": "recommend", "member": "coai"}
+    {"op": "recommend", "member": "coai", "genre": "Action"}
+    {"op": "ping"}
+and each response is a JSON object on its own line, either:
+    {"ok": true, "result": ...}
+    {"ok": false, "error": "..."}
+
+Checkouts and returns give [error message, warning message, success message],
+as checkout_book and return_book do; a checkout with "all" set withdraws all
+the books or none of them, as checkout_books does. Searches and queries (see
+the bookquery module) give a list of books, as dicts, as do lists: of every
+book, or of the books whose attribute equals a value. Overdue gives the IDs of
+the books that have been on loan for more than 60 days. Recommendations give
+the member's genres, most liked first, or if a genre is given, the most popular
+[title, popularity] pairs of that genre.
+
+A request that fails for any reason, including an error reading or writing
+the files, gets an error response rather than closing the connection.
+
+The server is started with: python libraryserver.py [socket path]
+The libraryclient module can be used to send requests to it.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+from typing import Optional
+
+import bookcheckout
+import bookreturn
+import bookquery
+import booksearch
+import database
+
+# the path of the Unix socket the server listens on by default
+SOCKET_PATH = 'library.sock'
+
+# the number of requests the server has handled
+requests_handled = 0
+
+
+def handle_request(line: bytes) -> bytes:
+    """
+    Handle a single request and return the response, both as lines of JSON.
+
+    :param line: the request
+    :return: the response
+    """
+    global requests_handled
+
+    requests_handled += 1
+
+    try:
+        request = json.loads(line)
+        operation = _OPERATIONS.get(request.get('op'))
+
+        if operation is None:
+            raise ValueError(f"Unknown operation: {request.get('op')!r}")
+
+        response = {'ok': True, 'result': operation(request)}
+    except KeyError as e:
+        response = {'ok': False, 'error': f'Missing argument: {e}'}
+    except (ValueError, TypeError, AttributeError, ImportError) as e:
+        response = {'ok': False, 'error': str(e)}
+    except Exception as e:
+        # e.g. an OSError writing the database, which the desk should hear
+        # about instead of losing its connection
+        response = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+    return json.dumps(response).encode() + b'\n'
+
+
+def _checkout(request: dict) -> list:
+    """
+    Check out books to a member.
+
+    :param request: {'member': member ID, 'books': book IDs, 'all': whether to
+                    withdraw all the books or none of them}
+    :return: [error message, warning message, success message]
+    """
+    if request.get('all', False):
+        return list(bookcheckout.checkout_books(request['member'],
+                                                request['books']))
+
+    return list(bookcheckout.checkout_book(request['member'],
+                                           *request['books']))
+
+
+def _return(request: dict) -> list:
+    """
+    Return books.
+
+    :param request: {'books': book IDs}
+    :return: [error message, warning message, success message]
+    """
+    return list(bookreturn.return_book(*request['books']))
+
+
+def _search(request: dict) -> list:
+    """
+    Search for books whose attribute contains a query.
+
+    :param request: {'attr': attribute, 'query': query, 'ignore_case': bool,
+                    'fuzzy': bool}
+    :return: the matching books, as dicts
+    """
+    books = booksearch.search_by_param(request['attr'], request['query'],
+                                       request.get('ignore_case', False),
+                                       request.get('fuzzy', False))
+    return [vars(book) for book in books]
+
+
+def _query(request: dict) -> list:
+    """
+    Search for books with the query language of the bookquery module.
+
+    :param request: {'query': query, 'ignore_case': bool}
+    :return: the matching books, as dicts
+    """
+    books = bookquery.search_by_query(request['query'],
+                                      request.get('ignore_case', False))
+    return [vars(book) for book in books]
+
+
+def _list(request: dict) -> list:
+    """
+    List every book, or the books whose attribute equals a value.
+
+    :param request: {'attr': optional attribute, 'value': its value}
+    :return: the books, as dicts
+    """
+    if 'attr' in request:
+        books = database.search_books_by_param(request['attr'],
+                                               request['value'])
+    else:
+        books = database.iter_books()
+
+    return [vars(book) for book in books]
+
+
+def _overdue(request: dict) -> list:
+    """
+    List the IDs of the books that have been on loan for more than 60 days.
+
+    :param request: {}
+    :return: the IDs of the overdue books, in order
+    """
+    return sorted(database.overdue_book_ids())
+
+
+def _recommend(request: dict) -> list:
+    """
+    Recommend genres, or titles of a genre, to a member.
+
+    :param request: {'member': member ID, 'genre': optional genre}
+    :return: the member's genres, or [title, popularity] pairs for the genre
+    """
+    # bookrecommend needs matplotlib, which isn't needed for anything else, so
+    # it's only imported when recommendations are asked for
+    import bookrecommend
+
+    member_id = request['member']
+
+    if (genre := request.get('genre')) is None:
+        return bookrecommend.recommend_genres(member_id)
+
+    return [list(title_pop) for title_pop in
+            bookrecommend.recommend_titles_for_genre(genre, member_id)]
+
+
+_OPERATIONS = {
+    'checkout': _checkout,
+    'return': _return,
+    'search': _search,
+    'query': _query,
+    'list': _list,
+    'overdue': _overdue,
+    'recommend': _recommend,
+    'ping': lambda request: 'pong',
+}
+
+
+async def _handle_client(reader: asyncio.StreamReader,
+                         writer: asyncio.StreamWriter):
+    """
+    Handle every request sent over a client's connection, until the client
+    closes it.
+
+    :param reader: the stream to read requests from
+    :param writer: the stream to write responses to
+    """
+    try:
+        while line := await reader.readline():
+            writer.write(handle_request(line))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(path: str = SOCKET_PATH) -> asyncio.AbstractServer:
+    """
+    Load the book database and logfile, and start listening for clients on the
+    Unix socket at the given path.
+
+    :param path: the path of the socket
+    :return: the server
+    :raises OSError: if a server is already listening at the path
+    """
+    for thread in database.load_in_background():
+        thread.join()
+
+    _remove_stale_socket(path)
+
+    return await asyncio.start_unix_server(_handle_client, path)
+
+
+def _remove_stale_socket(path: str):
+    """
+    Remove the socket at the given path if it was left behind by a server that
+    is no longer running.
+
+    :param path: the path of the socket
+    :raises OSError: if a server is still listening at the path
+    """
+    if not os.path.exists(path):
+        return
+
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.remove(path)
+            return
+
+    raise OSError(f'A library server is already running at {path}')
+
+
+async def _serve(path: str):
+    """
+    Run the server at the given path until it is cancelled.
+
+    :param path: the path of the socket
+    """
+    server = await start_server(path)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        os.remove(path)
+
+
+def main(path: Optional[str] = None):
+    """
+    Run the server until it is interrupted.
+
+    :param path: the path of the socket, or None for SOCKET_PATH
+    """
+    print(f'Library server listening at {path or SOCKET_PATH}')
+
+    try:
+        asyncio.run(_serve(path or SOCKET_PATH))
+    except KeyboardInterrupt:
+        pass
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    # Temporarily modify database methods so files aren't modified while testing
+    temp = (database.update_database, database.update_logfile,
+            database.LOCK_FILE, database.VERSION_FILE)
+    database.update_database = database.update_logfile = lambda: None
+
+    request = lambda **kwargs: json.loads(
+        handle_request(json.dumps(kwargs).encode()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.LOCK_FILE = os.path.join(tmp, 'library.lock')
+        database.VERSION_FILE = os.path.join(tmp, 'library.version')
+
+        assert request(op='ping') == {'ok': True, 'result': 'pong'}, \
+            'ping failed test'
+        assert request(op='checkout', member='test', books=[15]) == \
+               {'ok': True, 'result': [None, None, 'Book 15 withdrawn']}, \
+            'checkout failed test'
+        assert request(op='checkout', member='test', books=[14, 5],
+                       all=True)['result'][0] == \
+               'Book 5 is already on loan, to: coaa', \
+            'all-or-nothing checkout failed test'
+        assert database.search_book_by_id(14).member == '0', \
+            'all-or-nothing checkout withdrew books after an error'
+        assert request(op='return', books=[15]) == \
+               {'ok': True, 'result': [None, None, 'Book 15 returned']}, \
+            'return failed test'
+        assert [book['id'] for book in request(op='search', attr='title',
+                                               query='Sinful Duty')['result']] \
+               == [book.id for book in
+                   booksearch.search_by_title('Sinful Duty')], \
+            'search failed test'
+        assert [book['id'] for book in request(
+            op='query', query='author:"Stan Lee" member:=0')['result']] == \
+               [2, 3], \
+            'query failed test'
+        assert request(op='query', query='title:<A')['error'] == \
+               'Only id, purchase_date can be compared with <', \
+            'invalid queries were not rejected'
+        assert len(request(op='list')['result']) == database.book_count() \
+               and [book['id'] for book in request(
+                   op='list', attr='member', value='coaa')['result']] == \
+               [book.id for book in
+                database.search_books_by_param('member', 'coaa')], \
+            'list failed test'
+        assert request(op='overdue')['result'] == \
+               sorted(database.overdue_book_ids()), 'overdue failed test'
+
+        assert request(op='dance') == \
+               {'ok': False, 'error': "Unknown operation: 'dance'"}, \
+            'unknown operations were not rejected'
+        assert request(op='return') == \
+               {'ok': False, 'error': "Missing argument: 'books'"}, \
+            'missing arguments were not rejected'
+        assert not json.loads(handle_request(b'{'))['ok'], \
+            'invalid JSON was not rejected'
+
+        # other errors, e.g. writing the files, are reported too
+        _OPERATIONS['write'] = lambda request: open(tmp, 'w')
+        assert request(op='write')['error'].startswith('IsADirectoryError'), \
+            'OSErrors were not reported'
+        del _OPERATIONS['write']
+
+        # serve requests over a socket from another thread
+        path = os.path.join(tmp, 'library.sock')
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(start_server(path))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(path)
+            file = sock.makefile('rwb')
+            for _ in range(2):
+                file.write(b'{"op": "ping"}\n')
+                file.flush()
+                assert json.loads(file.readline())['result'] == 'pong', \
+                    'the server failed to respond over its socket'
+            file.close()
+
+        try:
+            _remove_stale_socket(path)
+            assert False, 'a second server was started at the same path'
+        except OSError:
+            pass
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+    (database.update_database, database.update_logfile,
+     database.LOCK_FILE, database.VERSION_FILE) = temp
+
+    print('libraryserver.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['test']:
+        test()
+    else:
+        main(*sys.argv[1:2])
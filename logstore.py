@@ -0,0 +1,204 @@
+"""
+This module provides a compact, columnar representation of the logfile, which
+the database module can use instead of a List[dict] to save memory when there
+are a lot of logs.
+
+A log store is a dict of parallel columns, where the log at a given position
+is made up of the values at that position in each column:
+    'book_id': array('i')
+    'checkout': array('i') - checkout dates, as day ordinals
+    'return': array('i') - return dates, as day ordinals, or NO_RETURN
+    'member': array('i') - codes of member IDs, i.e. indexes into 'members'
+  and the tables used to intern member IDs:
+    'members': List[str] - each distinct member ID, stored once
+    'member_codes': Dict[str, int] - member ID -> code
+
+Each log takes 16 bytes of columns, compared to several hundred bytes for a
+dict holding two datetime objects.
+
+Logs are materialized as dicts (as described in the database module) when they
+are read, so changing a materialized log does not change the store.
+"""
+
+from array import array
+from datetime import datetime
+from typing import List, Generator, Tuple
+
+# the return date of logs that haven't been returned yet (ordinals start at 1)
+NO_RETURN = 0
+
+
+def new_store() -> dict:
+    """
+    Create an empty log store.
+
+    :return: the log store
+    """
+    return {
+        'book_id': array('i'),
+        'checkout': array('i'),
+        'return': array('i'),
+        'member': array('i'),
+        'members': [],
+        'member_codes': {},
+    }
+
+
+def from_logs(logs: List[dict]) -> dict:
+    """
+    Create a log store containing the given logs.
+
+    :param logs: the logs, as dicts
+    :return: the log store
+    """
+    store = new_store()
+
+    for log in logs:
+        ret = log['return']
+        append(store, log['book_id'], log['checkout'].toordinal(),
+               NO_RETURN if ret is None else ret.toordinal(), log['member'])
+
+    return store
+
+
+def size(store: dict) -> int:
+    """
+    Return the number of logs in the given store.
+
+    :param store: the log store
+    :return: the number of logs
+    """
+    return len(store['book_id'])
+
+
+def append(store: dict, book_id: int, checkout: int, return_: int,
+           member: str) -> int:
+    """
+    Append a log to the given store.
+
+    :param store: the log store
+    :param book_id: the ID of the book the log corresponds to
+    :param checkout: the checkout date, as a day ordinal
+    :param return_: the return date, as a day ordinal, or NO_RETURN
+    :param member: the ID of the member the log corresponds to
+    :return: the position of the new log
+    """
+    store['book_id'].append(book_id)
+    store['checkout'].append(checkout)
+    store['return'].append(return_)
+    store['member'].append(member_code(store, member))
+
+    return len(store['book_id']) - 1
+
+
+def member_code(store: dict, member: str) -> int:
+    """
+    Return the code of the given member ID in the given store, adding the
+    member ID to the store's member table if it isn't already there.
+
+    :param store: the log store
+    :param member: the member ID
+    :return: the code of the member ID
+    """
+    codes = store['member_codes']
+
+    code = codes.get(member)
+    if code is None:
+        code = codes[member] = len(store['members'])
+        store['members'].append(member)
+
+    return code
+
+
+def get_fields(store: dict, position: int) -> Tuple[int, str, int, bool]:
+    """
+    Return the fields of the log at the given position that are needed to index
+    it, without materializing the log.
+
+    :param store: the log store
+    :param position: the position of the log
+    :return: (book ID, member ID, checkout day ordinal, whether the log is on
+             loan)
+    """
+    return (store['book_id'][position],
+            store['members'][store['member'][position]],
+            store['checkout'][position],
+            store['return'][position] == NO_RETURN)
+
+
+def get_log(store: dict, position: int) -> dict:
+    """
+    Materialize the log at the given position as a dict.
+
+    :param store: the log store
+    :param position: the position of the log
+    :return: the log as a dict
+    """
+    ret = store['return'][position]
+
+    return {
+        'book_id': store['book_id'][position],
+        'checkout': datetime.fromordinal(store['checkout'][position]),
+        'return': None if ret == NO_RETURN else datetime.fromordinal(ret),
+        'member': store['members'][store['member'][position]]
+    }
+
+
+def set_return(store: dict, position: int, return_: int):
+    """
+    Set the return date of the log at the given position.
+
+    :param store: the log store
+    :param position: the position of the log
+    :param return_: the return date, as a day ordinal
+    """
+    store['return'][position] = return_
+
+
+def iter_logs(store: dict) -> Generator[dict, None, None]:
+    """
+    Materialize every log in the given store, in order.
+
+    :param store: the log store
+    :return: the logs as dicts, in a generator
+    """
+    for position in range(size(store)):
+        yield get_log(store, position)
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    logs = [
+        {'book_id': 1, 'checkout': datetime(2021, 1, 12), 'return': None,
+         'member': 'coai'},
+        {'book_id': 2, 'checkout': datetime(2021, 1, 12),
+         'return': datetime(2021, 2, 1), 'member': 'suii'},
+        {'book_id': 3, 'checkout': datetime(2021, 3, 4), 'return': None,
+         'member': 'coai'},
+    ]
+
+    store = from_logs(logs)
+    assert size(store) == 3, 'from_logs failed test'
+    assert list(iter_logs(store)) == logs, 'iter_logs failed test'
+    assert store['members'] == ['coai', 'suii'], 'member IDs were not interned'
+    assert get_fields(store, 0) == \
+           (1, 'coai', datetime(2021, 1, 12).toordinal(), True), \
+        'get_fields failed test'
+    assert get_fields(store, 1)[::3] == (2, False), 'get_fields failed test'
+
+    set_return(store, 0, datetime(2021, 2, 2).toordinal())
+    assert get_log(store, 0)['return'] == datetime(2021, 2, 2), \
+        'set_return failed test'
+
+    position = append(store, 4, datetime(2021, 5, 6).toordinal(), NO_RETURN,
+                      'util')
+    assert position == 3 and get_log(store, 3)['member'] == 'util', \
+        'append failed test'
+
+    print('logstore.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    test()
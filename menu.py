@@ -16,9 +16,13 @@ from tkinter import ttk
 from tkinter.font import Font
 
 import bookcheckout
+import bookquery
 import bookrecommend
 import bookreturn
 import booksearch
+import database
+import instrument
+import libraryclient
 
 modules = {
     'Search': booksearch,
@@ -33,6 +37,9 @@ notebook: ttk.Notebook
 
 bg, fg = 'black', '#f8f8ff'
 
+# the path of the library server's socket, if this desk uses a server
+server_path = None
+
 
 def _fix_treeview_color(style):
     """
@@ -64,6 +71,10 @@ def _on_tab_selected(event):
     if module is None:
         _show_frame(menu)
     else:
+        # pick up any changes made by other desks, unless the library server
+        # holds the database for this desk
+        if server_path is None:
+            database.refresh()
         module.on_show()
 
 
@@ -101,9 +112,37 @@ def _menu_button(text, module) -> Button:
                   font=('Arial', 9))
 
 
-def main():
+def _use_server(path):
+    """
+    Send checkouts, returns, searches, listings and recommendations to the
+    library server at the given path (see the libraryserver module), instead of
+    carrying them out on this desk's copy of the database and logfile.
+
+    :param path: the path of the server's socket
+    """
+    global server_path
+
+    server_path = libraryclient.SOCKET_PATH = path
+
+    bookcheckout.checkout_book = libraryclient.checkout_book
+    bookcheckout.available_books = libraryclient.available_books
+    bookreturn.return_book = libraryclient.return_book
+    bookreturn.books_on_loan_to = libraryclient.books_on_loan_to
+    booksearch.search_by_param = libraryclient.search_by_param
+    booksearch.all_books = libraryclient.all_books
+    booksearch.overdue_book_ids = libraryclient.overdue_book_ids
+    bookquery.search_by_query = libraryclient.search_by_query
+    bookrecommend.recommend_genres = libraryclient.recommend_genres
+    bookrecommend.recommend_titles_for_genre = \
+        libraryclient.recommend_titles_for_genre
+
+
+def main(server=None):
     """
     Main method to set up and display the program's GUI.
+
+    :param server: the path of the library server's socket to use, or None to
+                   use the files directly
     """
     global menu
     global notebook
@@ -111,6 +150,17 @@ def main():
     # puts all container Frames on top of each other
     setup_frame = lambda f: f.grid(row=0, column=0, sticky=NSEW)
 
+    if server is not None:
+        _use_server(server)
+
+    # record statistics about the database if LIBRARY_INSTRUMENT is set
+    instrument.enable_from_environment()
+
+    # read the book database and logfile while the GUI is being set up, unless
+    # the library server has already read them
+    if server is None:
+        database.load_in_background()
+
     root = Tk()
     root.title('Library Management System')
     root.geometry('800x625')
@@ -160,4 +210,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # python menu.py [--server [socket path]]
+    if sys.argv[1:2] == ['--server']:
+        main(sys.argv[2] if len(sys.argv) > 2 else libraryclient.SOCKET_PATH)
+    else:
+        main()
@@ -0,0 +1,594 @@
+"""
+This module checks that the book database, logfile and journal are consistent
+with each other, reporting every violation it finds rather than stopping at the
+first one.
+
+The logfile and then the journal are streamed through once, in the order they
+were written, keeping track of each book's open loans (logs without a return
+date). Once they have been read, each book's member in the database is checked
+against its open loans.
+
+Checking can be split between processes by book ID shard (book ID % shards),
+each of which streams the files but only keeps track of its own books.
+
+A journal left behind by a crash after it was compacted into the logfile (see
+database.is_journal_stale) is never replayed, so it isn't checked either.
+
+In incremental mode, what has been checked so far is saved to a state file, so
+the next check only reads journal records appended since then. The logfile is
+only ever rewritten (when the journal is compacted into it), never appended to,
+so if it has changed since the last check everything is checked again.
+
+Archived logs (see database.archive_logs) are never on loan, so they can't
+break any of these rules and aren't read.
+
+Each violation is stored as a dict:
+    'kind': str - one of the kinds below
+    'book_id': int or None if the record is too malformed to have one
+    'file': str - the file the violation is in
+    'line': int or None if the violation isn't on a single line
+    'message': str
+
+Usage: python verifier.py [--shards N] [--incremental [STATE_FILE]]
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Optional
+
+import database
+import datecodec
+
+# a book was checked out while it was already on loan
+DOUBLE_OPEN_LOAN = 'double open loan'
+# a log or journal record is for a book that isn't in the database
+ORPHAN_LOG = 'orphan log'
+# a book's member in the database doesn't match its open loan
+MEMBER_MISMATCH = 'member mismatch'
+# a book was returned before it was checked out
+RETURN_BEFORE_CHECKOUT = 'return before checkout'
+# a return stamp in the journal is for a book that isn't on loan
+RETURN_WITHOUT_LOAN = 'return without loan'
+# a record couldn't be read
+MALFORMED_RECORD = 'malformed record'
+
+# the kinds of violation that break the rule that a book is on loan (in the
+# database) if and only if it has exactly one open loan (in its logs)
+ON_LOAN_KINDS = (DOUBLE_OPEN_LOAN, MEMBER_MISMATCH, RETURN_WITHOUT_LOAN)
+
+# the default state file for incremental checks
+STATE_FILE = 'verifier.json'
+
+# book ID -> [member ID, checkout day ordinal] of each of its open loans
+Loans = Dict[int, List[list]]
+
+# the number of fields in each kind of journal record
+_JOURNAL_FIELDS = {'+': 4, 'r': 3}
+
+
+def verify(shards: int = 1, state_file: Optional[str] = None) -> List[dict]:
+    """
+    Check the database, logfile and journal for violations.
+
+    This is done in a database transaction, so no desk writes to the files
+    while they are being checked.
+
+    :param shards: the number of processes to split checking the logfile and
+                   journal between, if they have to be checked in full
+    :param state_file: the state file to check incrementally with, or None to
+                       check everything
+    :return: the violations, in the order they appear in the files
+    """
+    database.begin_transaction()
+    try:
+        return _verify(shards, state_file)
+    finally:
+        database.end_transaction()
+
+
+def _verify(shards: int, state_file: Optional[str]) -> List[dict]:
+    """
+    Check the database, logfile and journal for violations, assuming a database
+    transaction has been started.
+
+    :param shards: the number of processes to split checking between
+    :param state_file: the state file to check incrementally with, or None
+    :return: the violations
+    """
+    members = _read_members()
+    stamp = _logfile_stamp()
+    journal = None if database.is_journal_stale() else database.JOURNAL_FILE
+
+    state = _load_state(state_file, stamp) if state_file is not None else None
+
+    if state is None:
+        state = _check_logs_in_shards(members, shards, journal)
+        state['logfile'] = stamp
+    elif journal is not None:
+        # carry on from where the last check stopped
+        state['offset'], state['line'] = _check_file(
+            journal, True, members, None, state['loans'],
+            state['violations'], state['offset'], state['line'])
+
+    if state_file is not None:
+        _save_state(state_file, state)
+
+    return state['violations'] + _check_members(members, state['loans'])
+
+
+def _read_members() -> Dict[int, Optional[str]]:
+    """
+    Read the member of each book in the database, without loading the books.
+
+    :return: book ID -> member ID, or None if the book has no member
+    """
+    members = {}
+
+    with open(database.DATABASE_FILE, newline='') as db:
+        for row in csv.reader(db):
+            # member slots are padded with spaces (see database.update_database)
+            members[int(row[0])] = row[5].rstrip() if len(row) > 5 else None
+
+    return members
+
+
+def _logfile_stamp() -> List[int]:
+    """
+    Return the size and modification time of the logfile, which change when it
+    is rewritten.
+
+    :return: [size, modification time in nanoseconds]
+    """
+    try:
+        stat = os.stat(database.LOGFILE)
+    except FileNotFoundError:
+        return [0, 0]
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _check_logs_in_shards(members: Dict[int, Optional[str]], shards: int,
+                          journal: Optional[str]) -> dict:
+    """
+    Check the whole logfile and journal, splitting the books between the given
+    number of processes.
+
+    :param members: book ID -> member ID of the books in the database
+    :param shards: the number of processes
+    :param journal: the path of the journal, or None if it is stale
+    :return: the state after checking: {'loans': Loans,
+             'violations': List[dict], 'offset': offset of the end of the
+             journal, 'line': lines in the journal}
+    """
+    if shards <= 1:
+        return _check_logs((database.LOGFILE, journal), members, None)
+
+    paths = [(database.LOGFILE, journal)] * shards
+    shard_members = [{book_id: member for book_id, member in members.items()
+                      if book_id % shards == shard} for shard in range(shards)]
+
+    with ProcessPoolExecutor(shards) as executor:
+        results = list(executor.map(_check_logs, paths, shard_members,
+                                    [(shard, shards) for shard in
+                                     range(shards)]))
+
+    state = {'loans': {}, 'violations': [], 'offset': results[0]['offset'],
+             'line': results[0]['line']}
+
+    for result in results:
+        state['loans'].update(result['loans'])
+        state['violations'].extend(result['violations'])
+
+    state['violations'].sort(key=_violation_order)
+    return state
+
+
+def _check_logs(paths: Tuple[str, Optional[str]],
+                members: Dict[int, Optional[str]],
+                shard: Optional[Tuple[int, int]]) -> dict:
+    """
+    Check the whole logfile and journal, for the books in the given shard.
+
+    :param paths: the paths of the logfile and journal, or None if the journal
+                  is stale
+    :param members: book ID -> member ID of the books in the shard
+    :param shard: (shard, number of shards), or None to check all books
+    :return: the state after checking (see _check_logs_in_shards)
+    """
+    loans: Loans = {}
+    violations: List[dict] = []
+
+    logfile, journal = paths
+    _check_file(logfile, False, members, shard, loans, violations)
+    offset = line = 0
+    if journal is not None:
+        offset, line = _check_file(journal, True, members, shard, loans,
+                                   violations)
+
+    return {'loans': loans, 'violations': violations, 'offset': offset,
+            'line': line}
+
+
+def _check_file(path: str, journal: bool, members: Dict[int, Optional[str]],
+                shard: Optional[Tuple[int, int]], loans: Loans,
+                violations: List[dict], offset: int = 0,
+                line: int = 0) -> Tuple[int, int]:
+    """
+    Check the records in the logfile or journal from the given offset onwards,
+    updating loans and adding any violations found.
+
+    :param path: the path of the file
+    :param journal: whether the file is the journal
+    :param members: book ID -> member ID of the books being checked
+    :param shard: (shard, number of shards), or None to check all books
+    :param loans: the open loans of the books so far
+    :param violations: the violations found so far
+    :param offset: the offset to start reading from
+    :param line: the number of lines before the offset
+    :return: (offset of the end of the file, number of lines in the file)
+    """
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return offset, line
+
+    # (offset, raw line) of each line of the record being read
+    line_offsets: List[Tuple[int, bytes]] = []
+
+    with file:
+        file.seek(offset)
+        # records are read with csv, as they were written with it, so quoted
+        # fields (e.g. member IDs with commas) are read correctly. Journal
+        # records are replayed a line at a time (see database._journal_records),
+        # so they are read a line at a time too
+        lines = database._decode_lines(file, line_offsets)
+        if journal:
+            records = (next(csv.reader([text]), []) for text in lines)
+        else:
+            records = csv.reader(lines)
+
+        for fields in records:
+            # the record is reported on its first line
+            record_line = line + 1
+            offset += sum(len(raw) for _, raw in line_offsets)
+            line += len(line_offsets)
+            line_offsets.clear()
+
+            if not fields or journal and fields[0] == database.JOURNAL_HEADER:
+                continue
+
+            _check_record(fields, journal, path, record_line, members, shard,
+                          loans, violations)
+
+    return offset, line
+
+
+def _check_record(fields: List[str], journal: bool, path: str, line: int,
+                  members: Dict[int, Optional[str]],
+                  shard: Optional[Tuple[int, int]], loans: Loans,
+                  violations: List[dict]):
+    """
+    Check a single record of the logfile or journal.
+
+    :param fields: the fields of the record
+    :param journal: whether the record is from the journal
+    :param path: the path of the file the record is in
+    :param line: the line the record is on
+    :param members: book ID -> member ID of the books being checked
+    :param shard: (shard, number of shards), or None to check all books
+    :param loans: the open loans of the books so far
+    :param violations: the violations found so far
+    """
+    # logfile: book_id,checkout,return,member
+    # journal: +,book_id,checkout,member or r,book_id,return
+    kind = fields[0] if journal else '+'
+    expected = _JOURNAL_FIELDS.get(kind) if journal else 4
+
+    try:
+        book_id = int(fields[1 if journal else 0])
+    except (IndexError, ValueError):
+        book_id = None
+
+    if shard is not None:
+        # records without a book ID are reported by the first shard only
+        owner = book_id % shard[1] if book_id is not None else 0
+        if owner != shard[0]:
+            return
+
+    add = lambda kind_, message: violations.append(
+        _violation(kind_, book_id, path, line, message))
+
+    if book_id is None or len(fields) != expected:
+        add(MALFORMED_RECORD, f"Malformed record: '{','.join(fields)}'")
+        return
+
+    try:
+        if not journal:
+            checkout = datecodec.parse_day(fields[1])
+            ret = datecodec.parse_day(fields[2]) if fields[2] else None
+            member = fields[3]
+        elif kind == '+':
+            checkout, ret, member = datecodec.parse_day(fields[2]), None, \
+                                    fields[3]
+        else:
+            checkout, ret, member = None, datecodec.parse_day(fields[2]), None
+    except ValueError as e:
+        add(MALFORMED_RECORD, str(e))
+        return
+
+    if book_id not in members:
+        add(ORPHAN_LOG, f'Book {book_id} is not in the database')
+
+    book_loans = loans.setdefault(book_id, [])
+
+    if checkout is None:
+        # a return stamp closes the book's most recent open loan
+        if not book_loans:
+            add(RETURN_WITHOUT_LOAN, f'Book {book_id} was returned but is not '
+                                     'on loan')
+            return
+        member, checkout = book_loans.pop()
+    elif ret is None:
+        if book_loans:
+            add(DOUBLE_OPEN_LOAN, f'Book {book_id} was checked out to '
+                                  f'{member} while on loan to '
+                                  f'{book_loans[-1][0]}')
+        book_loans.append([member, checkout])
+
+    if ret is not None and ret < checkout:
+        add(RETURN_BEFORE_CHECKOUT, f'Book {book_id} was returned on '
+                                    f'{datecodec.format_day(ret)}, before it '
+                                    'was checked out on '
+                                    f'{datecodec.format_day(checkout)}')
+
+
+def _check_members(members: Dict[int, Optional[str]],
+                   loans: Loans) -> List[dict]:
+    """
+    Check each book's member in the database against its open loans.
+
+    :param members: book ID -> member ID of the books in the database
+    :param loans: the open loans of the books
+    :return: the violations
+    """
+    violations = []
+
+    for book_id, member in members.items():
+        book_loans = loans.get(book_id)
+        loan_member = book_loans[-1][0] if book_loans else '0'
+
+        if member != loan_member:
+            if loan_member == '0':
+                message = f'Book {book_id} is on loan to {member} in the ' \
+                          'database, but has no open loan'
+            else:
+                message = f'Book {book_id} is on loan to {member} in the ' \
+                          f'database, but its open loan is to {loan_member}'
+
+            violations.append(_violation(MEMBER_MISMATCH, book_id,
+                                         database.DATABASE_FILE, None,
+                                         message))
+
+    return violations
+
+
+def _violation(kind: str, book_id: Optional[int], file: str,
+               line: Optional[int], message: str) -> dict:
+    """
+    Create a violation.
+
+    :param kind: the kind of violation
+    :param book_id: the ID of the book, if known
+    :param file: the file the violation is in
+    :param line: the line the violation is on, if any
+    :param message: the description of the violation
+    :return: the violation
+    """
+    return {'kind': kind, 'book_id': book_id, 'file': file, 'line': line,
+            'message': message}
+
+
+def _violation_order(violation: dict) -> Tuple[bool, int]:
+    """
+    Return the key to sort violations of the logfile and journal by, so they
+    are in the order they appear in the files.
+
+    :param violation: the violation
+    :return: the sort key
+    """
+    return violation['file'] != database.LOGFILE, violation['line']
+
+
+def describe(violation: dict) -> str:
+    """
+    Describe the given violation, with where it is.
+
+    :param violation: the violation
+    :return: the description
+    """
+    where = violation['file']
+    if violation['line'] is not None:
+        where += f":{violation['line']}"
+
+    return f"{where}: {violation['kind']}: {violation['message']}"
+
+
+def _load_state(state_file: str, stamp: List[int]) -> Optional[dict]:
+    """
+    Load the state saved by the last incremental check, if it is still valid:
+    the logfile hasn't been rewritten and the journal hasn't been truncated
+    since.
+
+    :param state_file: the state file
+    :param stamp: the current stamp of the logfile (see _logfile_stamp)
+    :return: the state, or None if everything has to be checked again
+    """
+    try:
+        with open(state_file) as file:
+            state = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    try:
+        journal_size = os.path.getsize(database.JOURNAL_FILE)
+    except FileNotFoundError:
+        journal_size = 0
+
+    if state.get('logfile') != stamp or journal_size < state['offset']:
+        return None
+
+    # JSON object keys are always strings
+    state['loans'] = {int(book_id): book_loans
+                      for book_id, book_loans in state['loans'].items()}
+    return state
+
+
+def _save_state(state_file: str, state: dict):
+    """
+    Save the state of an incremental check.
+
+    :param state_file: the state file
+    :param state: the state
+    """
+    # only books with open loans need to be remembered
+    state = {**state, 'loans': {book_id: book_loans for book_id, book_loans in
+                                state['loans'].items() if book_loans}}
+
+    with open(state_file, 'w') as file:
+        json.dump(state, file)
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """
+    Check the files and print any violations.
+
+    :param args: the command line arguments
+    :return: the exit status: 1 if there are violations, else 0
+    """
+    parser = argparse.ArgumentParser(description='Check the book database, '
+                                                 'logfile and journal are '
+                                                 'consistent.')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='the number of processes to check with')
+    parser.add_argument('--incremental', nargs='?', const=STATE_FILE,
+                        metavar='STATE_FILE',
+                        help='only check what has been added since the last '
+                             'incremental check')
+    args = parser.parse_args(args)
+
+    violations = verify(args.shards, args.incremental)
+
+    for violation in violations:
+        print(describe(violation))
+
+    print(f'{len(violations)} violation(s) found')
+    return 1 if violations else 0
+
+
+def test():
+    """
+    Main method which contains test code for this module.
+    """
+    temp = (database.DATABASE_FILE, database.LOGFILE, database.JOURNAL_FILE,
+            database.LOCK_FILE)
+
+    # some books in logfile.txt were returned before they were checked out, so
+    # only check that the on-loan status of each book is valid
+    assert not [violation for violation in verify()
+                if violation['kind'] in ON_LOAN_KINDS], \
+        'the on-loan status of books is not valid'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        (database.DATABASE_FILE, database.LOGFILE, database.JOURNAL_FILE,
+         database.LOCK_FILE) = (os.path.join(tmp, name) for name in temp)
+
+        with open(database.DATABASE_FILE, 'w') as file:
+            file.write('1,Action,Avengers,Stan Lee,01/07/2003,coai\n'
+                       '2,Action,Avengers,Stan Lee,01/07/2003,0   \n'
+                       '3,Action,Avengers,Stan Lee,01/07/2003,suii\n'
+                       '4,Action,"Reflex, Conquest",Jim Bob,08/07/2011,'
+                       'util\n'
+                       '5,Action,Avengers,Stan Lee,01/07/2003,"a,bc"\n')
+        with open(database.LOGFILE, 'w') as file:
+            file.write('1,01/01/2020,,coai\n'
+                       '2,01/01/2020,01/01/2019,coai\n'  # returned before
+                       '3,01/01/2020,,coai\n'
+                       '9,01/01/2020,,coai\n'  # not in the database
+                       '4,01/01/2020,,util\n'
+                       '4,02/01/2020,,util\n'  # already on loan
+                       '4,1/1/2020\n'  # malformed
+                       '5,01/01/2020,,"a,bc"\n')  # quoted by csv
+
+        kinds = lambda violations: [(v['kind'], v['book_id'], v['line'])
+                                    for v in violations]
+        expected = [
+            (RETURN_BEFORE_CHECKOUT, 2, 2),
+            (ORPHAN_LOG, 9, 4),
+            (DOUBLE_OPEN_LOAN, 4, 6),
+            (MALFORMED_RECORD, 4, 7),
+            (MEMBER_MISMATCH, 3, None),
+        ]
+        assert kinds(verify()) == expected, 'verify failed test'
+        assert verify(shards=2) == verify(), \
+            'verify gave different results when sharded'
+
+        # incremental checks only read records added since the last check
+        state_file = os.path.join(tmp, STATE_FILE)
+        assert kinds(verify(state_file=state_file)) == expected, \
+            'incremental verify failed test'
+
+        with open(database.JOURNAL_FILE, 'w') as file:
+            file.write('r,3,02/01/2020\n'
+                       'r,3,03/01/2020\n'  # not on loan
+                       '+,3,04/01/2020,suii\n'
+                       'r,5,05/01/2020\n'
+                       '+,5,06/01/2020,"a,bc"\n')
+
+        with open(state_file) as file:
+            offset = json.load(file)['offset']
+        assert offset == 0, 'the state file was not saved'
+
+        expected = expected[:-1] + [(RETURN_WITHOUT_LOAN, 3, 2)]
+        assert kinds(verify(state_file=state_file)) == expected, \
+            'incremental verify did not check the journal'
+        assert verify(state_file=state_file) == verify(), \
+            'incremental verify gave different results to verify'
+
+        # the journal's header isn't a record, and a stale journal isn't read
+        with open(database.JOURNAL_FILE, 'rb') as file:
+            records = file.read()
+        header = database.JOURNAL_HEADER + ',%d,%d\n' % \
+            database._file_fingerprint(database.LOGFILE)
+        with open(database.JOURNAL_FILE, 'wb') as file:
+            file.write(header.encode() + records)
+        assert kinds(verify())[-1] == (RETURN_WITHOUT_LOAN, 3, 3), \
+            'verify did not skip the journal header'
+        with open(database.JOURNAL_FILE, 'wb') as file:
+            file.write(b'#,0,0\n' + records)
+        assert kinds(verify())[-1] == (MEMBER_MISMATCH, 3, None), \
+            'verify read a stale journal'
+        os.remove(database.JOURNAL_FILE)
+
+        # a rewritten logfile is checked again in full
+        with open(database.LOGFILE, 'a') as file:
+            file.write('1,01/01/2020,,coai\n')
+        assert kinds(verify(state_file=state_file))[4] == \
+               (DOUBLE_OPEN_LOAN, 1, 9), \
+            'incremental verify did not notice the logfile was rewritten'
+
+    (database.DATABASE_FILE, database.LOGFILE, database.JOURNAL_FILE,
+     database.LOCK_FILE) = temp
+
+    print('verifier.py has passed all tests!')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['test']:
+        test()
+    else:
+        sys.exit(main())